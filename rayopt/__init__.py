@@ -25,20 +25,73 @@ from .conjugates import *
 from .system import *
 from .raytrace import *
 from .paraxial_trace import *
+from .paraxial_derivatives import *
 from .gaussian_trace import *
 from .geometric_trace import *
+from .geometric_psf import *
+from .ensemble_trace import *
+from .tolerance import *
 from .poly_trace import *
 from .optimize import *
+from .checkpoint import *
+from .instrument import *
+from .global_search import *
+from .configurations import *
 
-from . import library
-from .library import Library
-from . import analysis
-from .analysis import Analysis
+import sys as _sys
+import importlib as _importlib
 
-from .formats import (system_from_text,
-                      system_from_yaml, system_to_yaml,
-                      system_from_json, system_to_json)
+# heavy dependencies (matplotlib, sqlalchemy, pkg_resources, yaml,
+# scipy) are only imported on first use of these names
+_lazy = {
+    "library": (".library", None),
+    "Library": (".library", "Library"),
+    "evaluation": (".evaluation", None),
+    "analysis": (".analysis", None),
+    "result_cache": (".result_cache", None),
+    "ResultCache": (".result_cache", "ResultCache"),
+    "glass_map": (".glass_map", None),
+    "GlassMap": (".glass_map", "GlassMap"),
+    "GlassSubstitution": (".glass_map", "GlassSubstitution"),
+    "Analysis": (".analysis", "Analysis"),
+    "formats": (".formats", None),
+    "system_from_text": (".formats", "system_from_text"),
+    "system_from_yaml": (".formats", "system_from_yaml"),
+    "system_to_yaml": (".formats", "system_to_yaml"),
+    "system_from_json": (".formats", "system_from_json"),
+    "system_to_json": (".formats", "system_to_json"),
+    "zemax": (".zemax", None),
+    "oslo": (".oslo", None),
+    "rii": (".rii", None),
+    "codev": (".codev", None),
+    "len_to_system": (".oslo", "len_to_system"),
+    "zmx_to_system": (".zemax", "zmx_to_system"),
+}
 
-from . import zemax, oslo, rii
-from .oslo import len_to_system
-from .zemax import zmx_to_system
+
+def __getattr__(name):
+    try:
+        module, attr = _lazy[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    value = _importlib.import_module(module, __name__)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
+
+
+# `from rayopt import *` still imports everything
+__all__ = sorted(set(_n for _n in globals() if not _n.startswith("_")) |
+                 set(_lazy))
+
+
+if _sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562)
+    for _name in _lazy:
+        __getattr__(_name)
@@ -19,14 +19,17 @@
 from __future__ import (absolute_import, print_function,
                         unicode_literals, division)
 
+import json
+
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 
 from . import GeometricTrace, GaussianTrace
-from .utils import tanarcsin
-from .special_sums import polar_sum
+from .evaluation import (paraxial, transverse_fan, spot, wavefront,
+                         longitudinal, compute_unit, pupil_solutions)
+from .result_cache import fingerprint
 
 
 class CenteredFormatter(mpl.ticker.ScalarFormatter):
@@ -61,11 +64,15 @@ class Analysis(object):
     defocus = 5
     plot_opds = True
     plot_longitudinal = True
+    plot = True
+    executor = None
+    cache = None
 
     def __init__(self, system, **kwargs):
         self.system = system
         self.text = []
         self.figures = []
+        self.results = {}
         for k, v in kwargs.items():
             if not hasattr(self, k):
                 raise ValueError("no such option %s" % k)
@@ -89,6 +96,7 @@ class Analysis(object):
             t.rays_point((0, 0.), nrays=13, distribution="radau",
                          clip=False, filter=False)
             t.refocus()
+            self.system.paraxial.update()
         if self.print_system:
             self.text.append(str(self.system))
         if self.print_paraxial:
@@ -100,6 +108,9 @@ class Analysis(object):
         t.rays_paraxial()
         if self.print_full:
             self.text.append(str(t))
+        self.results = self.compute()
+        if not self.plot:
+            return self.text, self.figures
         fig, ax = plt.subplots(figsize=(self.figwidth, self.figwidth))
         self.figures.append(fig)
         self.system.plot(ax)
@@ -114,37 +125,116 @@ class Analysis(object):
             t.rays_clipping((0, h))
             t.plot(ax)
 
+        r = self.results
+        fields = self.system.fields
+        nf, nw = len(fields), len(self.system.wavelengths)
+
         if self.plot_transverse:
-            figheight = self.figwidth*len(self.system.fields)/5
+            figheight = self.figwidth*nf/5
             fig = plt.figure(figsize=(self.figwidth, figheight))
             self.figures.append(fig)
-            self.transverse(fig, self.system.fields)
+            self.transverse(fig, fields, fans=[
+                [r["transverse", i, j] for j in range(nw)]
+                for i in range(nf)])
 
         if self.plot_longitudinal:
             fig, ax = plt.subplots(
                 1, 5, figsize=(self.figwidth, self.figwidth/5))
             self.figures.append(fig)
-            self.longitudinal(ax, max(self.system.fields))
+            self.longitudinal(ax, max(fields),
+                              curves=r["longitudinal", ])
 
         if self.plot_spots:
-            figheight = self.figwidth*len(self.system.fields)/self.defocus
-            fig, ax = plt.subplots(len(self.system.fields), self.defocus,
+            figheight = self.figwidth*nf/self.defocus
+            fig, ax = plt.subplots(nf, self.defocus,
                                    figsize=(self.figwidth, figheight),
                                    sharex=True, sharey=True, squeeze=False)
             self.figures.append(fig)
-            self.spots(ax[::-1], self.system.fields)
+            self.spots(ax[::-1], fields, spots=[
+                [r["spots", i, j] for j in range(nw)]
+                for i in range(nf)])
 
         if self.plot_opds:
-            figheight = self.figwidth*len(self.system.fields)/4
-            fig, ax = plt.subplots(len(self.system.fields), 4,
+            figheight = self.figwidth*nf/4
+            fig, ax = plt.subplots(nf, 4,
                                    figsize=(self.figwidth, figheight),
                                    squeeze=False)
             # , sharex=True, sharey=True)
             self.figures.append(fig)
-            self.opds(ax[::-1], self.system.fields)
+            self.opds(ax[::-1], fields, wavefronts=[
+                r["opds", i] for i in range(nf)])
 
         return self.text, self.figures
 
+    def units(self):
+        """yields the independent work units of the enabled analyses:
+        (result key, function, arguments)
+
+        The key is (analysis, field index[, wavelength index]), the
+        functions are from `rayopt.evaluation` and are called as
+        `function(system, *arguments)`.
+        """
+        fields, wavelengths = self.system.fields, self.system.wavelengths
+        yield ("paraxial", ), paraxial, ()
+        if self.plot_transverse:
+            for i, hi in enumerate(fields):
+                for j, wj in enumerate(wavelengths):
+                    yield ("transverse", i, j), transverse_fan, (hi, wj)
+        if self.plot_longitudinal:
+            yield ("longitudinal", ), longitudinal, (max(fields), )
+        if self.plot_spots:
+            for i, hi in enumerate(fields):
+                for j, wj in enumerate(wavelengths):
+                    yield ("spots", i, j), spot, (hi, wj)
+        if self.plot_opds:
+            for i, hi in enumerate(fields):
+                yield ("opds", i), wavefront, (hi, wavelengths[0])
+
+    def compute(self):
+        """computes the enabled analyses without plotting
+
+        Returns a dict mapping the unit keys (see `units()`) to the
+        results (namedtuples from `rayopt.evaluation`).
+
+        If `executor` is given (e.g. a
+        `concurrent.futures.ProcessPoolExecutor`), the units are
+        distributed with `executor.map()`, each with a serialized copy
+        of the system. The pupils are aimed in the parent beforehand.
+
+        With a `cache` (a `rayopt.result_cache.ResultCache`), only the
+        units not found in the cache are computed and then stored.
+        """
+        results, keys, units = {}, [], []
+        if self.cache is not None:
+            fp = fingerprint(self.system)
+        for k, func, args in self.units():
+            if self.cache is not None:
+                ck = self.cache.key(fp, func, args)
+                try:
+                    results[k] = self.cache.get(ck)
+                    continue
+                except KeyError:
+                    pass
+            keys.append(k)
+            units.append((func, args))
+        if not units:
+            values = []
+        elif self.executor is None:
+            values = [func(self.system, *args) for func, args in units]
+        else:
+            for hi in self.system.fields:
+                for wj in self.system.wavelengths:
+                    self.system.pupil((0, hi), wj)
+            text = json.dumps(self.system.dict())
+            pupils = pupil_solutions(self.system)
+            values = self.executor.map(compute_unit, [
+                (text, pupils, func, args) for func, args in units])
+        for k, (func, args), v in zip(keys, units, values):
+            if self.cache is not None:
+                self.cache.put(self.cache.key(fp, func, args), v)
+            results[k] = v
+        return results
+
     @staticmethod
     def setup_axes(ax, xlabel=None, ylabel=None, title=None,
                    xzero=True, yzero=True):
@@ -221,40 +311,35 @@ class Analysis(object):
 
     def transverse(self, fig, heights=[0., .707, 1.],
                    wavelengths=None, nrays_line=152,
-                   colors="grbcmyk"):
+                   colors="grbcmyk", fans=None):
         if wavelengths is None:
             wavelengths = self.system.wavelengths
+        if fans is None:
+            fans = [[transverse_fan(self.system, hi, wi, nrays_line)
+                     for wi in wavelengths] for hi in heights]
         ax = self.pre_setup_fanplot(fig, len(heights))
-        p = self.system.object.pupil.distance
-        for hi, axi in zip(heights, ax):
+        for hi, fi, axi in zip(heights, fans, ax):
             axm, axsm, axss = axi
             axm.text(-.1, .5, "OY=%s" % hi, rotation="vertical",
                      transform=axm.transAxes,
                      verticalalignment="center")
-            for wi, ci in zip(wavelengths, colors):
-                t = GeometricTrace(self.system)
-                t.rays_point((0, hi), wi, nrays=nrays_line,
-                             distribution="tee", clip=True)
-                # plot transverse image plane versus entrance pupil
-                # coordinates
-                y = t.y[-1, :, :2] - t.y[-1, t.ref, :2]
-                py = t.y[0, :, :2] + p*tanarcsin(t.u[0])
-                py -= py[t.ref]
-                axm.plot(py[:t.ref, 1], y[:t.ref, 1], "-%s" % ci,
-                         label="%s" % wi)
-                axsm.plot(py[t.ref:, 0], y[t.ref:, 1], "-%s" % ci,
-                          label="%s" % wi)
-                axss.plot(py[t.ref:, 0], y[t.ref:, 0], "-%s" % ci,
-                          label="%s" % wi)
+            for wi, fij, ci in zip(wavelengths, fi, colors):
+                axm.plot(fij.py, fij.ey, "-%s" % ci, label="%s" % wi)
+                axsm.plot(fij.px, fij.sey, "-%s" % ci, label="%s" % wi)
+                axss.plot(fij.px, fij.sex, "-%s" % ci, label="%s" % wi)
         for axi in ax:
             for axii in axi:
                 self.post_setup_axes(axii)
 
     def spots(self, ax, heights=[1., .707, 0.],
-              wavelengths=None, nrays=150, colors="grbcmyk"):
+              wavelengths=None, nrays=150, colors="grbcmyk",
+              spots=None):
         paraxial = self.system.paraxial
         if wavelengths is None:
             wavelengths = self.system.wavelengths
+        if spots is None:
+            spots = [[spot(self.system, hi, wi, nrays)
+                      for wi in wavelengths] for hi in heights]
         nd = ax.shape[1]
         for axi in ax.flat:
             self.pre_setup_xyplot(axi)
@@ -266,19 +351,13 @@ class Analysis(object):
         for zi, axi in zip(z, ax[-1, :]):
             axi.text(.5, -.1, "DZ=%.1g" % zi,
                      transform=axi.transAxes, horizontalalignment="center")
-        for hi, axi in zip(heights, ax):
-            for wi, ci in zip(wavelengths, colors):
-                r = paraxial.airy_radius[1]/paraxial.wavelength*wi
-                t = GeometricTrace(self.system)
-                t.rays_point((0, hi), wi, nrays=nrays,
-                             distribution="hexapolar", clip=True)
-                # plot transverse image plane hit pattern (ray spot)
-                y = t.y[-1, :, :2] - t.y[-1, t.ref, :2]
-                u = tanarcsin(t.i[-1])
+        for si, axi in zip(spots, ax):
+            for wi, sij, ci in zip(wavelengths, si, colors):
                 for axij, zi in zip(axi, z):
                     axij.add_patch(mpl.patches.Circle(
-                        (0, 0), r, edgecolor=ci, facecolor="none"))
-                    yi = y + zi*u
+                        (0, 0), sij.airy_radius, edgecolor=ci,
+                        facecolor="none"))
+                    yi = sij.at(zi)
                     axij.plot(yi[:, 0], yi[:, 1], ".%s" % ci,
                               markersize=1, markeredgewidth=1, label="%s" % wi)
         for axi in ax:
@@ -286,43 +365,38 @@ class Analysis(object):
                 self.post_setup_axes(axii)
 
     def opds(self, ax, heights=[0., .707, 1.],
-             wavelength=None, nrays=1000, colors="grbcmyk"):
-        paraxial = self.system.paraxial
+             wavelength=None, nrays=1000, colors="grbcmyk",
+             wavefronts=None):
         if wavelength is None:
             wavelength = self.system.wavelengths[0]
+        if wavefronts is None:
+            wavefronts = [wavefront(self.system, hi, wavelength, nrays)
+                          for hi in heights]
         mm = None
         rm = None
         for hi, axi in zip(heights, ax[:, 0]):
             axi.text(-.1, .5, "OY=%s" % hi, rotation="vertical",
                      transform=axi.transAxes, verticalalignment="center")
-        for hi, axi in reversed(list(zip(heights, ax))):
+        for wf, axi in reversed(list(zip(wavefronts, ax))):
             axo, axp, axe, axm = axi
             # TODO: link axes
             self.pre_setup_xyplot(axo)
             self.pre_setup_xyplot(axp)
             self.setup_axes(axe, "R", "E")
             self.setup_axes(axm, "F", "C")
-            t = GeometricTrace(self.system)
-            t.rays_point((0, hi), wavelength, nrays=nrays,
-                         distribution="hexapolar", clip=True)
-            try:
-                x, y, o = t.opd()
-            except ValueError:
+            if wf is None:
                 continue
-            og = o[np.isfinite(o)]
+            og = wf.opd[np.isfinite(wf.opd)]
             if mm is None:
                 mm = np.fabs(og).max()
                 v = np.linspace(-mm, mm, 21)
-            axo.contour(x, y, o, v, cmap=plt.cm.RdBu_r)
+            axo.contour(wf.x, wf.y, wf.opd, v, cmap=plt.cm.RdBu_r)
             axo.text(.5, -.1, "PTP: %.3g" % og.ptp(),
                      transform=axo.transAxes, horizontalalignment="center")
-            r = paraxial.airy_radius[1]/paraxial.wavelength*wavelength
+            r = wf.airy_radius
             axp.add_patch(mpl.patches.Circle(
                 (0, 0), r, edgecolor="green", facecolor="none"))
-            x, y, psf = map(np.fft.fftshift, t.psf())
-            x0 = (psf*x).sum()
-            y0 = (psf*y).sum()
-            x, y = x - x0, y - y0
+            x, y, psf = wf.px, wf.py, wf.psf
             dx = x[1, 0] - x[0, 0]
             psfl = np.log10(psf)
             levels = psfl.max() - 1 - np.arange(4)
@@ -330,24 +404,16 @@ class Analysis(object):
             axp.contour(x, y, psfl, levels, cmap=plt.cm.Reds, alpha=.2)
             levels = np.linspace(0, psf.max(), 21)
             axp.contour(x, y, psf, levels, cmap=plt.cm.Greys)
-            ee = polar_sum(psf, (psf.shape[0]/2 + x0/dx,
-                                 psf.shape[1]/2 + y0/dx), "azimuthal")
-            ee = np.cumsum(ee)
             if rm is None:
-                rm = np.searchsorted(ee, .9)*1.5*dx
+                rm = np.searchsorted(wf.ee, .9)*1.5*dx
             axp.set_xlim(-rm, rm)
             axp.set_ylim(-rm, rm)
-            xe = np.arange(ee.size)*dx
-            axe.plot(xe, ee, "k-")
+            axe.plot(wf.ee_radius, wf.ee, "k-")
             axe.set_xlim(0, rm)
             axe.set_ylim(0, 1)
             axe.set_aspect("auto")
-            for i, ci in enumerate(("-", "--")):
-                ot = np.fft.ifft(np.fft.ifftshift(psf.sum(i))*psf.size**.5)
-                of = np.fft.fftfreq(ot.size, dx)
-                ot, of = ot[:ot.size//2], of[:of.size//2]
-                axm.plot(of, np.absolute(ot), "k"+ci)
-                # axm.plot(of, ot.real, "k"+ci)
+            for mi, ci in zip(wf.mtf, ("-", "--")):
+                axm.plot(wf.frequency, mi, "k"+ci)
             axm.set_xlim(0, 1/r)
             axm.set_ylim(0, 1)
         for axi in ax:
@@ -355,12 +421,12 @@ class Analysis(object):
                 self.post_setup_axes(axij)
 
     def longitudinal(self, ax, height=1.,
-                     wavelengths=None, nrays=21, colors="grbcmyk"):
-        # lateral color: image relative to image at wl[0]
-        # focus shift paraxial focus vs wl
-        # longitudinal spherical: marginal focus vs height (vs wl)
+                     wavelengths=None, nrays=21, colors="grbcmyk",
+                     curves=None):
         if wavelengths is None:
             wavelengths = self.system.wavelengths
+        if curves is None:
+            curves = longitudinal(self.system, height, wavelengths, nrays)
         axd, axc, axf, axs, axa = ax
         for axi, xl, yl, tl in [
                 (axd, "EY", "REY", "DIST"),
@@ -370,44 +436,16 @@ class Analysis(object):
                 (axa, "L", "DEZ", "LCOLOR"),
                 ]:
             self.setup_axes(axi, xl, yl, tl, yzero=False, xzero=False)
-        h = np.linspace(0, height*self.system.image.radius, nrays)
-        h[0] = np.nan
+        c = curves
         for i, (wi, ci) in enumerate(zip(wavelengths, colors)):
-            t = GeometricTrace(self.system)
-            t.rays_line((0, height), wi, nrays=nrays)
-            a, b, c = np.split(t.y[-1].T, (nrays, 2*nrays), axis=1)
-            p, q, r = np.split(tanarcsin(t.i[-1]).T, (nrays, 2*nrays), axis=1)
             if i == 0:
-                xd = (a[1] - h)/h
-                xd[0] = np.nan
-                axd.plot(a[1], xd, ci+"-", label="%s" % wi)
-                a0 = a
+                axd.plot(c.ey[i], c.distortion, ci+"-", label="%s" % wi)
             else:
-                axc.plot(a[1], a[1] - a0[1], ci+"-", label="%s" % wi)
-            xt = -(b[1]-a[1])/(q[1]-p[1])
-            axf.plot(a[1], xt, ci+"-", label="EZt %s" % wi)
-            xs = -(c[0]-a[0])/(r[0]-p[0])
-            axf.plot(a[1], xs, ci+"--", label="EZs %s" % wi)
-            t = GeometricTrace(self.system)
-            t.rays_point((0, 0.), wi, nrays=nrays,
-                         distribution="half-meridional", clip=True)
-            p = self.system.object.pupil.distance
-            py = t.y[0, :, 1] + p*tanarcsin(t.u[0])[:, 1]
-            u = tanarcsin(t.i[-1])[:, 1]
-            u[t.ref] = np.nan
-            z = -t.y[-1, :, 1]/u
-            axs.plot(py, z, ci+"-", label="%s" % wi)
-        wl, wu = min(wavelengths), max(wavelengths)
-        ww = np.linspace(wl - (wu - wl)/4, wu + (wu - wl)/4, nrays)
-        zc = []
-        pd, ph = self.system.pupil((0, 0), wavelengths[0])
-        t = GeometricTrace(self.system)
-        for wwi in np.r_[wavelengths[0], ww]:
-            y, u = self.system.aim((0, 0), (0, 1e-3), pd, ph)
-            t.rays_given(y, u, wwi)
-            t.propagate(clip=False)
-            zc.append(-t.y[-1, 0, 1]/tanarcsin(t.i[-1, 0])[1])
-        zc = np.array(zc[1:]) - zc[0]
-        axa.plot(ww, zc, "-")
+                axc.plot(c.ey[i], c.lateral_color[i], ci+"-",
+                         label="%s" % wi)
+            axf.plot(c.ey[i], c.tangential[i], ci+"-", label="EZt %s" % wi)
+            axf.plot(c.ey[i], c.sagittal[i], ci+"--", label="EZs %s" % wi)
+            axs.plot(c.pupil[i], c.spherical[i], ci+"-", label="%s" % wi)
+        axa.plot(c.color_wavelengths, c.focus_shift, "-")
         for axi in ax:
             self.post_setup_axes(axi)
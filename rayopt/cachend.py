@@ -20,8 +20,6 @@ from __future__ import (absolute_import, print_function,
                         unicode_literals, division)
 
 import numpy as np
-from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
-from scipy.spatial.qhull import QhullError
 
 from .utils import public
 
@@ -61,6 +59,7 @@ class CacheND(object):
 @public
 class NearestCacheND(CacheND):
     def _update(self):
+        from scipy.interpolate import NearestNDInterpolator
         xy = list(self.cache.items())
         x = np.array([_[0] for _ in xy])
         y = np.array([_[1] for _ in xy])
@@ -71,6 +70,8 @@ class NearestCacheND(CacheND):
 @public
 class LinearCacheND(CacheND):
     def _update(self):
+        from scipy.interpolate import LinearNDInterpolator
+        from scipy.spatial.qhull import QhullError
         if len(self.cache) < 4:
             return
         xy = list(self.cache.items())
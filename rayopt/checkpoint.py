@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Checkpoints and evaluation history of long optimizations.
+
+A `Checkpoint` is a single compressed numpy file holding the variable
+vector, the optimizer state and the serialized system. It is replaced
+atomically, so a crash leaves the previous checkpoint intact. A
+`History` is an append-only file of json lines, one record per
+iteration, that is read back lazily.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from .utils import public
+
+
+@public
+class Checkpoint(object):
+    """Optimizer checkpoint at `path`, written every `every` iterations
+    and at most every `interval` seconds (if given)"""
+    def __init__(self, path, every=1, interval=None):
+        self.path = path
+        self.every = every
+        self.interval = interval
+        self.saved = None
+
+    def due(self, iteration):
+        if iteration % self.every:
+            return False
+        if self.interval is None or self.saved is None:
+            return True
+        return time.time() - self.saved >= self.interval
+
+    def save(self, x, state=None, system=None):
+        """write the variables `x`, the json serializable optimizer
+        `state` and the system (if it is a `System`)"""
+        text = ""
+        if hasattr(system, "dict"):
+            text = json.dumps(system.dict())
+        buf = io.BytesIO()
+        np.savez_compressed(buf, x=np.asarray(x, np.float64),
+                            state=np.array(json.dumps(state or {},
+                                                      default=_tolist)),
+                            system=np.array(text))
+        tmp = "%s.tmp" % self.path
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.saved = time.time()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """the saved variables and optimizer state"""
+        with np.load(self.path) as d:
+            return d["x"], json.loads(d["state"][()])
+
+    def system(self):
+        """the saved system (or None)"""
+        from .system import System
+        with np.load(self.path) as d:
+            text = d["system"][()]
+        if text:
+            return System(**json.loads(text))
+
+    def resume(self, variables):
+        """set and initialize the `variables` to the saved values and
+        return the optimizer state"""
+        x, state = self.load()
+        for v, xi in zip(variables, x):
+            v.set(xi)
+            v.init = xi
+        return state
+
+
+@public
+class History(object):
+    """append-only history of json records in the file at `path`
+
+    Records are written and flushed one by one and read back lazily,
+    a truncated last line (crash) is skipped.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def append(self, **record):
+        if self.file is None:
+            self.file = open(self.path, "a")
+        self.file.write(json.dumps(record, default=_tolist) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+    def column(self, key):
+        """array of the values of `key` over all records"""
+        return np.array([r[key] for r in self])
+
+
+def _tolist(v):
+    if isinstance(v, (np.ndarray, np.generic)):
+        return v.tolist()
+    raise TypeError(repr(v))
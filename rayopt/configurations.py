@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+from .utils import public
+from .paraxial_trace import ParaxialTrace, ParaxialBatch
+from .ensemble_trace import EnsembleTrace
+from .optimize import Variable, Operand
+
+
+@public
+class Configurations(object):
+    """Configurations (e.g. zoom or focus positions) of a system.
+
+    All configurations share the elements and materials of `system`.
+    Each configuration is a dict (or a list of pairs) mapping paths
+    (see `System.get_path()`) to the values they take in that
+    configuration. Paths that a configuration does not mention keep
+    the value they had when the `Configurations` were created (the
+    base value).
+
+    `select(i)` (or indexing) applies configuration i to the system
+    and swaps in its pupil cache, its paraxial matrix cache and its
+    paraxial trace such that these are kept per configuration.
+    `select(None)` restores the base values.
+
+    A configuration is marked dirty whenever the system is updated
+    while another configuration is selected and whenever one of its
+    values is `set()`. Selecting a dirty configuration runs
+    `System.update()` on it.
+    """
+    def __init__(self, system, configurations):
+        self.system = system
+        self.configurations = []
+        for c in configurations:
+            if isinstance(c, dict):
+                c = c.items()
+            self.configurations.append(
+                dict((tuple(p), v) for p, v in c))
+        self.base = {}
+        for c in self.configurations:
+            for p in c:
+                self.base[p] = system.get_path(p)
+        self._base_state = self._state()
+        self._states = [({}, {}, ParaxialTrace(system, update=False))
+                        for c in self.configurations]
+        self._dirty = dict((i, True) for i in range(len(self)))
+        self._dirty[None] = False
+        self._updates = system._updates
+        self.selected = None
+
+    def _state(self):
+        s = self.system
+        return s._pupil_cache, s._paraxial_cache, s.paraxial
+
+    def __len__(self):
+        return len(self.configurations)
+
+    def __getitem__(self, i):
+        return self.select(i)
+
+    def _sync(self):
+        # an update of the selected configuration changes the shared
+        # elements and invalidates all others
+        if self.system._updates != self._updates:
+            for j in self._dirty:
+                self._dirty[j] = j != self.selected
+            self._updates = self.system._updates
+
+    def select(self, i):
+        """apply configuration i and return the system"""
+        if i is not None:
+            i = range(len(self))[i]
+        self._sync()
+        s = self.system
+        if i != self.selected:
+            if i is None:
+                c, state = {}, self._base_state
+            else:
+                c, state = self.configurations[i], self._states[i]
+            for p, v in self.base.items():
+                s.set_path(p, c.get(p, v))
+            s._pupil_cache, s._paraxial_cache, s.paraxial = state
+            self.selected = i
+        if self._dirty[i]:
+            s.update()
+            self._updates = s._updates
+            self._dirty[i] = False
+        return s
+
+    def get(self, i, path):
+        return self.configurations[i].get(tuple(path),
+                                          self.base[tuple(path)])
+
+    def set(self, i, path, value):
+        """set the value of the (already configured) path in
+        configuration i"""
+        i = range(len(self))[i]
+        path = tuple(path)
+        if path not in self.base:
+            raise KeyError("path not configured", path)
+        self.configurations[i][path] = value
+        self._dirty[i] = True
+        if self.selected == i:
+            self.system.set_path(path, value)
+
+    def update(self):
+        """update all configurations"""
+        for i in range(len(self)):
+            self._dirty[i] = True
+            self.select(i)
+
+    def paraxial(self, wavelengths=None):
+        """paraxial traces of all configurations at all wavelengths
+        (see `ParaxialBatch`)"""
+        return ParaxialBatch(self, wavelengths)
+
+    def map(self, func, *args, **kwargs):
+        """`func(system, *args, **kwargs)` for each configuration,
+        e.g. the compute functions from `rayopt.evaluation`
+
+        This evaluates the configurations one after the other, see
+        `ensemble()` for a batched trace."""
+        return [func(s, *args, **kwargs) for s in self]
+
+    def ensemble(self):
+        """an `EnsembleTrace` of the base system with one trial per
+        configuration
+
+        Only configured curvatures and distances are supported. The
+        base values are selected."""
+        s = self.select(None)
+        p = {}
+        for path, v in self.base.items():
+            if len(path) != 2 or path[1] not in ("curvature", "distance"):
+                raise ValueError("can not batch %s" % (path,))
+            p[path] = [self.get(i, path) - v for i in range(len(self))]
+        return EnsembleTrace(s, p, trials=len(self))
+
+
+@public
+class ConfigVariable(Variable):
+    """the value of a configured path in configuration i"""
+    def __init__(self, configurations, i, path, *args, **kwargs):
+        self.configurations = configurations
+        self.index = i
+        self.path = tuple(path)
+        super(ConfigVariable, self).__init__(configurations.system,
+                                             *args, **kwargs)
+
+    def get(self):
+        return self.configurations.get(self.index, self.path)
+
+    def set(self, value):
+        self.configurations.set(self.index, self.path, value)
+
+
+@public
+class ConfigOperand(Operand):
+    """evaluates `operand` in configuration i"""
+    def __init__(self, configurations, i, operand):
+        self.configurations = configurations
+        self.index = i
+        self.operand = operand
+        super(ConfigOperand, self).__init__(
+            configurations.system, operand.weight, operand.offset,
+            operand.min, operand.max)
+
+    def prepare(self):
+        self.operand.prepare()
+
+    def get(self):
+        self.configurations.select(self.index)
+        return self.operand.get()
+
+    def get_objective(self):
+        return self.operand.get_objective()
+
+    def get_equality(self):
+        return self.operand.get_equality()
+
+    def get_inequality(self):
+        return self.operand.get_inequality()
@@ -20,13 +20,24 @@ from __future__ import (absolute_import, print_function,
                         unicode_literals, division)
 
 import numpy as np
-from scipy.optimize import newton
 
-from .utils import public
+from .utils import public, inv2
 from .transformations import (euler_matrix, euler_from_matrix,
                               rotation_matrix)
 from .name_mixin import NameMixin
-from .material import Material
+from .material import Material, PerturbedMaterial
+from .instrument import count
+
+
+_newton = None
+
+
+def newton(*args, **kwargs):
+    """`scipy.optimize.newton()`, imported on first use"""
+    global _newton
+    if _newton is None:
+        from scipy.optimize import newton as _newton
+    return _newton(*args, **kwargs)
 
 
 @public
@@ -220,7 +231,7 @@ class Element(NameMixin, TransformMixin):
         # takes the inverse q
         n, m = self.paraxial_matrix(n0, l)
         a, b, c, d = m[:2, :2], m[:2, 2:], m[2:, :2], m[2:, 2:]
-        qi = np.dot(c + np.dot(d, q0i), np.linalg.inv(a + np.dot(b, q0i)))
+        qi = np.dot(c + np.dot(d, q0i), inv2(a + np.dot(b, q0i)))
         return qi, n
 
     def paraxial_matrix(self, n0, l):
@@ -230,6 +241,10 @@ class Element(NameMixin, TransformMixin):
         m[0, 2] = m[1, 3] = d/n0
         return n0, m
 
+    def paraxial_state(self, l):
+        """the parameters that determine `paraxial_matrix()`"""
+        return type(self), self._distance
+
     def propagate(self, y0, u0, n0, l, clip=True):
         t = self.intercept(y0, u0)
         y = y0 + t[:, None]*u0
@@ -268,7 +283,7 @@ class Element(NameMixin, TransformMixin):
         xyz[:, axis] = -rad, rad
         return xyz
 
-    def aberration(self, *args):
+    def aberration(self, *args, **kwargs):
         return 0
 
     def dispersion(self, *args):
@@ -293,7 +308,9 @@ class Interface(Element):
 
     def dict(self):
         dat = super(Interface, self).dict()
-        if self.material is not None:
+        if isinstance(self.material, PerturbedMaterial):
+            dat["material"] = self.material.dict()
+        elif self.material is not None:
             dat["material"] = str(self.material)
         return dat
 
@@ -306,6 +323,12 @@ class Interface(Element):
             n = self.refractive_index(l)
         return n, m
 
+    def paraxial_state(self, l):
+        s = super(Interface, self).paraxial_state(l)
+        if self.material is not None:
+            s += self.material.mirror, self.refractive_index(l)
+        return s
+
     def propagate(self, y0, u0, n0, l, clip=True):
         t = self.intercept(y0, u0)
         y = y0 + t[:, None]*u0
@@ -335,6 +358,7 @@ class Interface(Element):
 
     def intercept(self, y, u):
         s = super(Interface, self).intercept(y, u)
+        count("intercept.newton", y.shape[0])
         for i in range(y.shape[0]):
             yi, ui = y[None, i], u[None, i]
 
@@ -348,6 +372,7 @@ class Interface(Element):
                 s[i] = newton(func=func, fprime=fprime, x0=s[i],
                               tol=1e-7, maxiter=5)
             except RuntimeError:
+                count("intercept.newton_failures")
                 s[i] = np.nan
         return s
 
@@ -543,6 +568,11 @@ class Spheroid(Interface):
 
         return n, m
 
+    def paraxial_state(self, l):
+        s = super(Spheroid, self).paraxial_state(l)
+        a = self.aspherics[0] if self.aspherics else None
+        return s + (self.curvature, a, tuple(self._angles))
+
     def reverse(self):
         super(Spheroid, self).reverse()
         self.curvature *= -1
@@ -556,8 +586,11 @@ class Spheroid(Interface):
             self.aspherics = [ai/scale**(2*i + 1) for i, ai in
                               enumerate(self.aspherics)]
 
-    def aberration(self, y, u0, u, n0, n, v0, v):
-        c = self.curvature
+    def aberration(self, y, u0, u, n0, n, v0, v, curvature=None):
+        if curvature is None:
+            c = self.curvature
+        else:
+            c = curvature
         k = self.conic*c**3/8
         if self.aspherics:
             a2, a4 = self.aspherics[:2]
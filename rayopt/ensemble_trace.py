@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import numpy as np
+
+from .elements import Spheroid
+from .utils import public, pupil_distribution
+from .raytrace import Trace
+
+
+def euler_rxyz(a):
+    """rotation matrices (..., 3, 3) for the rotating frame x-y-z
+    Euler angles a (..., 3), see `transformations.euler_matrix()`"""
+    a = np.asarray(a, dtype=np.float64)
+    c, s = np.cos(a), np.sin(a)
+    one, zero = np.ones_like(c[..., 0]), np.zeros_like(c[..., 0])
+    rx = np.array([[one, zero, zero],
+                   [zero, c[..., 0], -s[..., 0]],
+                   [zero, s[..., 0], c[..., 0]]])
+    ry = np.array([[c[..., 1], zero, s[..., 1]],
+                   [zero, one, zero],
+                   [-s[..., 1], zero, c[..., 1]]])
+    rz = np.array([[c[..., 2], -s[..., 2], zero],
+                   [s[..., 2], c[..., 2], zero],
+                   [zero, zero, one]])
+    r = [np.moveaxis(ri, (0, 1), (-2, -1)) for ri in (rx, ry, rz)]
+    return np.einsum("...ij,...jk,...kl->...il", *r)
+
+
+@public
+class EnsembleTrace(Trace):
+    """Geometric trace of the same rays through many perturbed copies
+    (trials) of a system at once.
+
+    `perturbations` maps `(element index, parameter)` to arrays with a
+    leading trial axis. They are added to the nominal element:
+
+        * "curvature" (trials,): curvature change
+        * "distance" (trials,): change of the distance from the
+          preceding element (moves all following elements)
+        * "decenter" (trials, 2): lateral displacement of the element
+          in its normal coordinates (only this element)
+        * "tilt" (trials, 3): rotation of the element about its vertex
+          (x-y-z Euler angles in its normal coordinates)
+        * "index" (trials,): refractive index change of the element's
+          material
+
+    Ray data is stored with a trial axis:
+    y[i, trial, ray], u, i, t as in `GeometricTrace`, in the nominal
+    normal coordinates of each element; n[i, trial].
+    """
+    parameters = "curvature distance decenter tilt index".split()
+
+    def __init__(self, system, perturbations=None, trials=None):
+        super(EnsembleTrace, self).__init__(system)
+        self.perturbations = {}
+        self.trials = trials
+        if perturbations:
+            for (i, name), value in perturbations.items():
+                self.perturb(i, name, value)
+        if self.trials is None:
+            self.trials = 1
+
+    def perturb(self, i, name, value):
+        if name not in self.parameters:
+            raise ValueError("unknown perturbation %r" % name)
+        value = np.asarray(value, dtype=np.float64)
+        if name in ("decenter", "tilt"):
+            value = np.atleast_2d(value)
+        else:
+            value = np.atleast_1d(value)
+        if self.trials is None:
+            self.trials = value.shape[0]
+        elif value.shape[0] not in (1, self.trials):
+            raise ValueError("trial number mismatch: %i != %i" %
+                             (value.shape[0], self.trials))
+        self.perturbations[i % len(self.system), name] = value
+
+    def allocate(self, nrays):
+        super(EnsembleTrace, self).allocate()
+        self.nrays = nrays
+        k, m = self.length, self.trials
+        self.n = np.empty((k, m))
+        self.y = np.empty((k, m, nrays, 3))
+        self.u = np.empty_like(self.y)
+        self.i = np.empty_like(self.y)
+        self.t = np.empty((k, m, nrays))
+        self.w = None
+        self.ref = None
+        self.l = 1.
+
+    def rays_given(self, y, u, l=None, w=None, ref=0):
+        y, u = np.atleast_2d(y, u)
+        y, u = np.broadcast_arrays(y, u)
+        n, m = y.shape
+        if (not hasattr(self, "y") or self.y.shape[1] != self.trials or
+                self.y.shape[2] != n):
+            self.allocate(n)
+        if l is None:
+            l = self.system.wavelengths[0]
+        if w is None:
+            w = np.ones(n)/n
+        self.w = w
+        self.ref = ref
+        self.l = l
+        self.y[0, :, :, :m] = y
+        self.y[0, :, :, m:] = 0
+        self.u[0, :, :, :m] = u
+        if m < 3:  # assumes forward rays
+            u2 = np.square(self.u[0, :, :, :2]).sum(-1)
+            self.u[0, :, :, 2] = np.sqrt(1 - u2)
+        self.i[0] = self.u[0]
+        self.n[0] = self.system.refractive_index(l, 0)
+        self.t[0] = 0
+
+    def rays(self, yo, yp, wavelength, stop=None, filter=None,
+             clip=False, weight=None, ref=0):
+        """rays aimed through the nominal system"""
+        if filter is None:
+            filter = not clip
+        z, p = self.system.pupil(yo, l=wavelength, stop=stop)
+        y, u = self.system.aim(yo, yp, z, p, filter=filter)
+        self.rays_given(y, u, wavelength, weight, ref)
+        self.propagate(clip=clip)
+
+    def rays_point(self, yo, wavelength=None, nrays=11,
+                   distribution="meridional", filter=None, stop=None,
+                   clip=False):
+        ref, yp, weight = pupil_distribution(distribution, nrays)
+        self.rays(yo, yp, wavelength, filter=filter, stop=stop,
+                  clip=clip, weight=weight, ref=ref)
+
+    def _get(self, i, name, default=None):
+        return self.perturbations.get((i, name), default)
+
+    def propagate(self, clip=False):
+        super(EnsembleTrace, self).propagate()
+        y, u = self.system[0].from_normal(self.y[0], self.u[0])
+        n = self.n[0][:, None]
+        for j in range(1, self.length):
+            e = self.system[j]
+            y = y - e.offset
+            dd = self._get(j, "distance")
+            if dd is not None:
+                y = y - dd[:, None, None]*e.direction
+            y, u = e.to_normal(y, u)
+            dy, r = self._get(j, "decenter"), self._get(j, "tilt")
+            if dy is not None:
+                y = y - np.concatenate(
+                    (dy, np.zeros_like(dy[:, :1])), axis=1)[:, None]
+            if r is not None:
+                r = euler_rxyz(r)
+                y = np.einsum("tnj,tij->tni", y, r)
+                u = np.einsum("tnj,tij->tni", u, r)
+            y, u, n, i, t = self._propagate_element(j, y, u, n, clip)
+            if r is not None:
+                y, u, i = (np.einsum("tnj,tji->tni", v, r)
+                           for v in (y, u, i))
+            if dy is not None:
+                y = y + np.concatenate(
+                    (dy, np.zeros_like(dy[:, :1])), axis=1)[:, None]
+            self.y[j], self.u[j], self.i[j], self.t[j] = y, u, i, t
+            self.n[j] = n[:, 0]
+            y, u = e.from_normal(y, u)
+
+    def _propagate_element(self, j, y, u0, n0, clip):
+        e, l = self.system[j], self.l
+        c = None
+        if isinstance(e, Spheroid):
+            c = e.curvature + self._get(j, "curvature", 0.)
+            c = np.broadcast_to(c, (self.trials,))[:, None]
+            s = self._intercept(e, c, y, u0)
+        else:
+            s = -y[..., 2]/u0[..., 2]
+        y = y + s[..., None]*u0
+        if clip:
+            good = np.square(y[..., :2]).sum(-1) <= e.radius**2
+            u0 = np.where(good[..., None], u0, np.nan)
+        u, n = u0, n0
+        material = getattr(e, "material", None)
+        if material is not None:
+            if material.mirror:
+                mu = -1.
+            else:
+                n = e.refractive_index(l) + self._get(j, "index", 0.)
+                n = np.broadcast_to(n, (self.trials,))[:, None]
+                mu = n0/n
+            if c is not None:
+                u = self._refract(e, c, y, u0, mu)
+        return y, u, n, u0, s*n0
+
+    @staticmethod
+    def _sag(e, c, xyz):
+        e0 = xyz[..., 2]
+        r2 = np.square(xyz[..., :2]).sum(-1)
+        e0 = e0 - c*r2/(1 + np.sqrt(1 - (1 + e.conic)*c**2*r2))
+        if e.aspherics is not None:
+            d = 0.
+            for ai in reversed(e.aspherics):
+                d += ai
+                d *= r2
+            e0 = e0 - d
+        return e0
+
+    @staticmethod
+    def _normal(e, c, xyz):
+        r2 = np.square(xyz[..., :2]).sum(-1)
+        g = -c/np.sqrt(1 - (1 + e.conic)*c**2*r2)
+        if e.aspherics is not None:
+            d = 0.
+            for i in reversed(range(len(e.aspherics))):
+                d *= r2
+                d += 2*(i + 1)*e.aspherics[i]
+            g = g - d
+        q = np.empty_like(xyz)
+        q[..., :2] = xyz[..., :2]*g[..., None]
+        q[..., 2] = 1
+        return q
+
+    def _intercept(self, e, c, y, u):
+        # Spheroid.intercept() with a curvature per trial
+        k = np.array([1, 1, 1 + e.conic])
+        uy = (u*y*k).sum(-1)
+        uu = (np.square(u)*k).sum(-1)
+        yy = (np.square(y)*k).sum(-1)
+        d = c*uy - u[..., 2]
+        f = c*yy - 2*y[..., 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            g = np.sqrt(np.square(d) - c*uu*f)
+            if e.alternate_intersection:
+                g *= -1
+            # -(d + g)/(c*uu) without cancellation (and for c == 0)
+            s = np.where(d*g < 0, f/(g - d), -(d + g)/(c*uu))
+            s = np.where(c == 0, -y[..., 2]/u[..., 2], s)  # flat
+        if e.aspherics is not None:
+            for i in range(5):
+                yi = y + s[..., None]*u
+                s = s - (self._sag(e, c, yi) /
+                         (self._normal(e, c, yi)*u).sum(-1))
+        return s
+
+    def _refract(self, e, c, y, u0, mu):
+        # Interface.refract() with mu and curvature per trial
+        r = self._normal(e, c, y)
+        r2 = np.square(r).sum(-1)
+        muf = np.fabs(mu)
+        a = muf*(u0*r).sum(-1)/r2
+        if np.all(mu == -1):
+            return u0 - 2*a[..., None]*r  # reflection
+        b = (np.square(mu) - 1)/r2
+        g = -a + np.sign(mu)*np.sqrt(np.square(a) - b)
+        return muf[..., None]*u0 + g[..., None]*r
+
+    def focus(self, at=-1):
+        """best (rms) focus shift after element `at` for each trial"""
+        y = self.y[at, :, :, :2]
+        u = self.i[at]
+        u = u[..., :2]/u[..., 2:]
+        good = np.all(np.isfinite(y) & np.isfinite(u), axis=-1)
+        w = np.where(good, self.w, 0.)
+        y, u = np.where(good[..., None], y, 0), np.where(
+            good[..., None], u, 0)
+        ws = w.sum(1)[:, None, None]
+        y = y - (w[..., None]*y).sum(1)[:, None]/ws
+        u = u - (w[..., None]*u).sum(1)[:, None]/ws
+        wu = w[..., None]*u
+        return -(wu*y).sum((1, 2))/(wu*u).sum((1, 2))
+
+    def rms(self, i=-1, ref=None, focus=0.):
+        """rms spot radius on element `i` (defocused by `focus`) for
+        each trial, relative to the centroid or to ray `ref`"""
+        y = self.y[i, :, :, :2]
+        if np.any(focus):
+            focus = np.broadcast_to(focus, (self.trials,))
+            u = self.i[i]
+            y = y + focus[:, None, None]*u[..., :2]/u[..., 2:]
+        good = np.all(np.isfinite(y), axis=-1)
+        w = np.where(good, self.w, 0.)
+        y = np.where(good[..., None], y, 0)
+        ws = w.sum(1)
+        if ref is None:
+            y0 = (w[..., None]*y).sum(1)/ws[:, None]
+        else:
+            y0 = y[:, ref]
+        r = np.square(y - y0[:, None]).sum(-1)
+        return np.sqrt((w*r).sum(1)/ws)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compute-only analyses.
+
+Every function traces the system and returns its numbers as a
+namedtuple of arrays. Nothing here depends on matplotlib;
+`rayopt.analysis.Analysis` plots these results.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from .system import System
+from .cachend import PolarCacheND
+from .geometric_trace import GeometricTrace
+from .utils import tanarcsin, public
+from .special_sums import polar_sum
+
+
+__all__ = "Paraxial Fan Spot Wavefront Longitudinal".split()
+
+
+Paraxial = namedtuple("Paraxial", "wavelength n y u c focal_length "
+                      "focal_distance principal_distance "
+                      "numerical_aperture f_number airy_radius "
+                      "magnification lagrange")
+Paraxial.__doc__ = """Paraxial data at the first wavelength: per
+surface refractive index `n`, marginal and chief ray heights `y` and
+reduced angles `u`, the Seidel coefficients `c` and the first order
+properties (object and image side pairs)."""
+
+
+Fan = namedtuple("Fan", "height wavelength py ey px sey sex")
+Fan.__doc__ = """Transverse ray fan: image plane intercepts relative to
+the chief ray versus entrance pupil coordinates. Tangential: ey over
+py, sagittal: sey and sex over px."""
+
+
+class Spot(namedtuple("Spot", "height wavelength y u airy_radius")):
+    """Spot diagram: image plane intercepts `y` relative to the chief
+    ray and the slopes `u` of the rays"""
+    __slots__ = ()
+
+    def at(self, z):
+        """intercepts defocused by `z`"""
+        return self.y + z*self.u
+
+
+def pupil_solutions(system):
+    """the solved pupil aims of the system (picklable)"""
+    return dict((k, dict(c.cache)) for k, c in system._pupil_cache.items())
+
+
+_unit_system = None, None
+
+
+def compute_unit(unit):
+    """executor work function for a `(system json, pupil solutions,
+    function, arguments)` unit: rebuilds the system (once per worker
+    and system) and returns `function(system, *arguments)`
+
+    The serialized system already carries the solved and updated
+    state of the parent; only the paraxial trace is redone (a full
+    `update()` could move the pupils of a refocused system). Reusing
+    the parent's pupil solutions makes the results independent of
+    which units a worker has aimed before.
+    """
+    global _unit_system
+    text, pupils, func, args = unit
+    key, system = _unit_system
+    if key != text:
+        system = System(**json.loads(text))
+        system.paraxial.update()
+        for (l, stop), cache in pupils.items():
+            c = PolarCacheND(system._aim_pupil, l=l, stop=stop)
+            if cache:
+                c.cache.update(cache)
+                c._update()
+            system._pupil_cache[l, stop] = c
+        _unit_system = text, system
+    return func(system, *args)
+
+
+Wavefront = namedtuple("Wavefront", "height wavelength x y opd "
+                       "px py psf airy_radius ee_radius ee "
+                       "frequency mtf")
+Wavefront.__doc__ = """Wavefront at the exit pupil (`opd` in waves
+over `x`, `y`), the diffraction point spread function `psf` over
+`px`, `py` (centered on its centroid), its encircled energy `ee` over
+`ee_radius` and the modulation transfer functions `mtf` (2, n) along
+the two axes over `frequency`."""
+
+
+Longitudinal = namedtuple("Longitudinal", "wavelengths height ey "
+                          "distortion lateral_color tangential sagittal "
+                          "pupil spherical color_wavelengths focus_shift")
+Longitudinal.__doc__ = """Field and aperture curves: for each
+wavelength (first axis) versus image height `ey`: relative
+`distortion` (first wavelength only), `lateral_color` relative to the
+first wavelength, `tangential` and `sagittal` focus; versus pupil
+height `pupil`: `spherical` focus; and the axial `focus_shift` over
+`color_wavelengths`."""
+
+
+@public
+def paraxial(system):
+    p = system.paraxial
+    return Paraxial(p.wavelength, p.n.copy(), p.y.copy(), p.u.copy(),
+                    p.c.copy(), p.focal_length, p.focal_distance,
+                    p.principal_distance, p.numerical_aperture,
+                    p.f_number, p.airy_radius, p.magnification,
+                    p.lagrange)
+
+
+@public
+def transverse_fan(system, height, wavelength=None, nrays=152):
+    if wavelength is None:
+        wavelength = system.wavelengths[0]
+    p = system.object.pupil.distance
+    t = GeometricTrace(system)
+    t.rays_point((0, height), wavelength, nrays=nrays,
+                 distribution="tee", clip=True)
+    # transverse image plane versus entrance pupil coordinates
+    y = t.y[-1, :, :2] - t.y[-1, t.ref, :2]
+    py = t.y[0, :, :2] + p*tanarcsin(t.u[0])
+    py -= py[t.ref]
+    r = t.ref
+    return Fan(height, wavelength, py[:r, 1], y[:r, 1],
+               py[r:, 0], y[r:, 1], y[r:, 0])
+
+
+@public
+def spot(system, height, wavelength=None, nrays=150):
+    paraxial = system.paraxial
+    if wavelength is None:
+        wavelength = system.wavelengths[0]
+    r = paraxial.airy_radius[1]/paraxial.wavelength*wavelength
+    t = GeometricTrace(system)
+    t.rays_point((0, height), wavelength, nrays=nrays,
+                 distribution="hexapolar", clip=True)
+    # transverse image plane hit pattern (ray spot)
+    y = t.y[-1, :, :2] - t.y[-1, t.ref, :2]
+    u = tanarcsin(t.i[-1])
+    return Spot(height, wavelength, y, u, r)
+
+
+@public
+def wavefront(system, height, wavelength=None, nrays=1000):
+    """returns None if no rays make it through"""
+    paraxial = system.paraxial
+    if wavelength is None:
+        wavelength = system.wavelengths[0]
+    t = GeometricTrace(system)
+    t.rays_point((0, height), wavelength, nrays=nrays,
+                 distribution="hexapolar", clip=True)
+    try:
+        x, y, o = t.opd()
+    except ValueError:
+        return None
+    r = paraxial.airy_radius[1]/paraxial.wavelength*wavelength
+    px, py, psf = map(np.fft.fftshift, t.psf())
+    x0 = (psf*px).sum()
+    y0 = (psf*py).sum()
+    px, py = px - x0, py - y0
+    dx = px[1, 0] - px[0, 0]
+    ee = polar_sum(psf, (psf.shape[0]/2 + x0/dx,
+                         psf.shape[1]/2 + y0/dx), "azimuthal")
+    ee = np.cumsum(ee)
+    er = np.arange(ee.size)*dx
+    mtf = []
+    for i in 0, 1:
+        ot = np.fft.ifft(np.fft.ifftshift(psf.sum(i))*psf.size**.5)
+        of = np.fft.fftfreq(ot.size, dx)
+        ot, of = ot[:ot.size//2], of[:of.size//2]
+        mtf.append(np.absolute(ot))
+    return Wavefront(height, wavelength, x, y, o, px, py, psf, r,
+                     er, ee, of, np.array(mtf))
+
+
+@public
+def longitudinal(system, height=1., wavelengths=None, nrays=21):
+    # lateral color: image relative to image at wl[0]
+    # focus shift paraxial focus vs wl
+    # longitudinal spherical: marginal focus vs height (vs wl)
+    if wavelengths is None:
+        wavelengths = system.wavelengths
+    h = np.linspace(0, height*system.image.radius, nrays)
+    h[0] = np.nan
+    ey, lc, xt, xs, py, zs = [], [], [], [], [], []
+    for i, wi in enumerate(wavelengths):
+        t = GeometricTrace(system)
+        t.rays_line((0, height), wi, nrays=nrays)
+        a, b, c = np.split(t.y[-1].T, (nrays, 2*nrays), axis=1)
+        p, q, r = np.split(tanarcsin(t.i[-1]).T, (nrays, 2*nrays), axis=1)
+        if i == 0:
+            xd = (a[1] - h)/h
+            xd[0] = np.nan
+            a0 = a
+        ey.append(a[1])
+        lc.append(a[1] - a0[1])
+        xt.append(-(b[1] - a[1])/(q[1] - p[1]))
+        xs.append(-(c[0] - a[0])/(r[0] - p[0]))
+        t = GeometricTrace(system)
+        t.rays_point((0, 0.), wi, nrays=nrays,
+                     distribution="half-meridional", clip=True)
+        p = system.object.pupil.distance
+        py.append(t.y[0, :, 1] + p*tanarcsin(t.u[0])[:, 1])
+        u = tanarcsin(t.i[-1])[:, 1]
+        u[t.ref] = np.nan
+        zs.append(-t.y[-1, :, 1]/u)
+    wl, wu = min(wavelengths), max(wavelengths)
+    ww = np.linspace(wl - (wu - wl)/4, wu + (wu - wl)/4, nrays)
+    zc = []
+    pd, ph = system.pupil((0, 0), wavelengths[0])
+    t = GeometricTrace(system)
+    for wwi in np.r_[wavelengths[0], ww]:
+        y, u = system.aim((0, 0), (0, 1e-3), pd, ph)
+        t.rays_given(y, u, wwi)
+        t.propagate(clip=False)
+        zc.append(-t.y[-1, 0, 1]/tanarcsin(t.i[-1, 0])[1])
+    zc = np.array(zc[1:]) - zc[0]
+    return Longitudinal(np.array(wavelengths), height, np.array(ey), xd,
+                        np.array(lc), np.array(xt), np.array(xs),
+                        np.array(py), np.array(zs), ww, zc)
@@ -23,7 +23,7 @@ import itertools
 
 import numpy as np
 
-from .utils import public
+from .utils import public, inv2
 from .raytrace import Trace
 
 
@@ -43,14 +43,7 @@ class GaussianTrace(Trace):
         self.n = np.empty(self.length)
 
     def make_qi(self, l, n, waist, position=(0, 0.), angle=0.):
-        z0 = np.pi*np.array(waist)**2*self.system.scale/l
-        z = np.array(position)/n
-        qi = 1/(z + 1j*z0)
-        qq = np.eye(2)*qi
-        ca, sa = np.cos(angle), np.sin(angle)
-        a = np.array([[ca, -sa], [sa, ca]])
-        qq = np.dot(a.T, np.dot(qq, a))
-        return qq
+        return make_qi(l, n, waist, position, angle, self.system.scale)
 
     def rays(self, qi=None, l=None):
         # 1/q = 1/R - i*lambda/(pi*n*w**2)
@@ -291,3 +284,158 @@ class GaussianTrace(Trace):
                             y = np.array([[h, h, v], [-h, -h, v]])
                             y = el.from_axis(y) + oi
                             ax.plot(y[:, 2], y[:, axis], cj, **kwargs)
+
+
+def make_qi(l, n, waist, position=0., angle=0., scale=1e-3):
+    """inverse complex beam parameters (..., 2, 2) of beams at
+    wavelengths `l` (...) in medium `n` (...) with `waist` radii (...,
+    [x, y]) at `position` (distance from the waist to the reference
+    plane, (..., [x, y])), rotated by `angle` (...)"""
+    l, n, angle = (np.asarray(_, dtype=np.float64) for _ in (l, n, angle))
+    w = np.asarray(waist, dtype=np.float64)*np.ones(2)
+    z = np.asarray(position, dtype=np.float64)*np.ones(2)
+    z0 = np.pi*w**2*scale/l[..., None]
+    qi = 1/(z/n[..., None] + 1j*z0)
+    ca, sa = np.cos(angle), np.sin(angle)
+    a = np.array([[ca, -sa], [sa, ca]])
+    a = np.moveaxis(a, (0, 1), (-2, -1))
+    qq = qi[..., :, None]*np.eye(2)
+    return np.einsum("...ji,...jk,...kl->...il", a, qq, a)
+
+
+@public
+class GaussianBatch(object):
+    """Many (simple astigmatic or general) Gaussian beams propagated at
+    once.
+
+    The beams are given by their `waist` radii (beams or (beams, [x,
+    y])), the `position` of the reference plane (the object surface)
+    relative to the waist, the wavelength `l` and the `angle` of the
+    beam axes, all broadcast against each other.
+
+    qi[i, beam] is the inverse complex beam parameter after element i
+    (as in `GaussianTrace`), n[i, beam] the refractive index. The
+    element matrices are taken from the cached paraxial matrices of
+    each distinct wavelength, the beams are transformed with closed
+    form 2x2 inverses.
+    """
+    def __init__(self, system, waist, position=0., l=None, angle=0.):
+        self.system = system
+        if l is None:
+            l = system.wavelengths[0]
+        w = np.asarray(waist, dtype=np.float64)
+        z = np.asarray(position, dtype=np.float64)
+        w = w[..., None] if w.ndim < 2 else w
+        z = z[..., None] if z.ndim < 2 else z
+        l, angle = np.atleast_1d(l, angle)
+        w, z, l, angle = np.broadcast_arrays(
+            w, z, l[..., None], angle[..., None])
+        self.wavelength = l[:, 0]
+        self.angle = angle[:, 0]
+        self.waist = w*np.ones(2)
+        self.position = z*np.ones(2)
+        self.propagate()
+
+    def propagate(self):
+        ls, j = np.unique(self.wavelength, return_inverse=True)
+        p = [self.system.paraxial_products(li) for li in ls]
+        m = np.array([pi.m for pi in p])[j].swapaxes(0, 1)
+        n = np.array([pi.n for pi in p])[j].T
+        k, b = n.shape
+        self.n = n
+        self.qi = np.empty((k, b, 2, 2), np.complex128)
+        self.qi[0] = make_qi(self.wavelength, n[0], self.waist,
+                             self.position, self.angle, self.system.scale)
+        qi = self.qi[0]
+        for i in range(1, k):
+            mi = m[i]
+            a, b, c, d = (mi[:, :2, :2], mi[:, :2, 2:],
+                          mi[:, 2:, :2], mi[:, 2:, 2:])
+            num = c + np.einsum("...ij,...jk->...ik", d, qi)
+            den = a + np.einsum("...ij,...jk->...ik", b, qi)
+            qi = np.einsum("...ij,...jk->...ik", num, inv2(den))
+            self.qi[i] = qi
+
+    def qi_at(self, i=-1):
+        return self.qi[i], self.n[i]
+
+    @property
+    def q(self):
+        """complex beam parameters (diagonal, for simple astigmatic
+        beams) after each element"""
+        return 1/np.diagonal(self.qi, 0, -2, -1)
+
+    @property
+    def spot_radius(self):
+        c = self.wavelength[:, None]/(self.system.scale*np.pi)
+        return np.sqrt(c/np.diagonal(-self.qi.imag, 0, -2, -1))
+
+    @property
+    def curvature_radius(self):
+        return self.n[..., None]/np.diagonal(self.qi.real, 0, -2, -1)
+
+    @property
+    def waist_position(self):
+        """after element relative to element"""
+        return -self.q.real*self.n[..., None]
+
+    @property
+    def rayleigh_range(self):
+        return self.q.imag*self.n[..., None]
+
+    @property
+    def waist_radius(self):
+        r = (self.rayleigh_range/np.pi/self.n[..., None] *
+             self.wavelength[:, None]/self.system.scale)
+        return r**.5
+
+    def overlap(self, waist, position=0., i=-1):
+        """power coupling efficiency of the beams after element i into
+        the simple astigmatic target mode with `waist` radii at
+        `position` relative to element i"""
+        qi, n = self.qi_at(i)
+        w = np.asarray(waist, dtype=np.float64)*np.ones(2)
+        p = np.asarray(position, dtype=np.float64)*np.ones(2)
+        t = make_qi(self.wavelength, n, w, -p, 0., self.system.scale)
+        return mode_overlap(qi, t)
+
+
+@public
+def mode_overlap(qi1, qi2):
+    """power coupling efficiency between simple astigmatic Gaussian
+    beams with inverse complex beam parameters qi1 and qi2 (..., 2, 2)
+    at the same plane"""
+    q1 = 1/np.diagonal(qi1, 0, -2, -1)
+    q2 = 1/np.diagonal(qi2, 0, -2, -1)
+    e = 2*np.sqrt(q1.imag*q2.imag)/np.absolute(q1.conj() - q2)
+    return e.prod(-1)
+
+
+@public
+def mode_match(system, waist, position=0., waists=None, positions=None,
+               l=None, i=-1, refine=3):
+    """find the input beam (waist radius and waist position relative to
+    the object surface) that best couples into the target mode with
+    `waist` radius at `position` after element `i`
+
+    `waists` and `positions` are the initial search grids. After each
+    scan, the grids are narrowed around the best beam `refine` times.
+    Returns the input waist radius, input position and efficiency.
+    """
+    if waists is None:
+        waists = np.logspace(-2, 1, 64)*system.object.pupil.radius
+    if positions is None:
+        positions = np.linspace(-1, 1, 64)*10*system[1].distance
+    waists, positions = np.asarray(waists), np.asarray(positions)
+    for j in range(refine + 1):
+        w, p = np.broadcast_arrays(waists[:, None], positions)
+        b = GaussianBatch(system, w.ravel(), p.ravel(), l)
+        e = b.overlap(waist, position, i)
+        k = np.nanargmax(e)
+        wk, pk = w.flat[k], p.flat[k]
+        dw = np.ptp(waists)/waists.shape[0]
+        dp = np.ptp(positions)/positions.shape[0]
+        waists = np.linspace(max(wk - 2*dw, dw/100), wk + 2*dw,
+                             waists.shape[0])
+        positions = np.linspace(pk - 2*dp, pk + 2*dp, positions.shape[0])
+    return wk, pk, e.flat[k]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import numpy as np
+
+from .utils import public
+
+
+@public
+class SpotHistogram(object):
+    """Weighted histograms of transverse ray intercepts.
+
+    The radial (encircled energy), square (ensquared energy) and
+    projected (line spread) distributions of the ray hits relative to
+    `center` are binned with `binsize` into `nbins` bins (`2*nbins` for
+    the line spread functions). Hits beyond the last bin are counted in
+    an overflow bin: they contribute to the total energy but never to
+    the (en)circled energies.
+
+    Rays can be added in chunks (`add()`), the cost is linear in the
+    number of rays and the memory footprint is independent of it.
+
+    `azimuths` are the directions onto which the line spread functions
+    are projected. For fields along y, azimuth 0 is sagittal and pi/2
+    is tangential.
+    """
+    def __init__(self, binsize, nbins=256, center=(0., 0.),
+                 azimuths=(0., np.pi/2)):
+        self.binsize = binsize
+        self.nbins = nbins
+        self.center = np.array(center, dtype=np.float64)
+        self.azimuths = np.atleast_1d(azimuths).astype(np.float64)
+        self.clear()
+
+    def clear(self):
+        n = self.nbins
+        self.weight = 0.
+        self.radial = np.zeros(n + 1)
+        self.square = np.zeros(n + 1)
+        self.line = np.zeros((self.azimuths.shape[0], 2*n + 1))
+
+    def _bin(self, r, offset=0):
+        k = np.floor(r/self.binsize).astype(np.intp) + offset
+        return np.where((k >= 0) & (k < offset + self.nbins), k,
+                        offset + self.nbins)
+
+    def add(self, y, w=None):
+        """add ray intercepts `y` (n, 2) with weights `w` (n,)"""
+        y = np.atleast_2d(y)[:, :2] - self.center
+        if w is None:
+            w = np.ones(y.shape[0])
+        good = np.all(np.isfinite(y), axis=1)
+        y, w = y[good], np.broadcast_to(w, good.shape)[good]
+        self.weight += w.sum()
+        n = self.nbins
+        r = np.hypot(y[:, 0], y[:, 1])
+        self.radial += np.bincount(self._bin(r), w, n + 1)
+        r = np.fabs(y).max(1)
+        self.square += np.bincount(self._bin(r), w, n + 1)
+        for i, a in enumerate(self.azimuths):
+            p = y[:, 0]*np.cos(a) + y[:, 1]*np.sin(a)
+            self.line[i] += np.bincount(self._bin(p, n), w, 2*n + 1)
+
+    @property
+    def radii(self):
+        """outer radii (half widths) of the radial (square) bins"""
+        return (np.arange(self.nbins) + 1.)*self.binsize
+
+    def encircled(self):
+        """radii and fraction of the energy within"""
+        return self.radii, np.cumsum(self.radial[:-1])/self.weight
+
+    def ensquared(self):
+        """half widths of the squares and fraction of the energy within"""
+        return self.radii, np.cumsum(self.square[:-1])/self.weight
+
+    def lsf(self):
+        """bin centers and line spread functions (azimuths, 2*nbins),
+        normalized to the total energy"""
+        n = self.nbins
+        x = (np.arange(-n, n) + .5)*self.binsize
+        return x, self.line[:, :-1]/self.weight
+
+    def mtf(self, f):
+        """geometric modulation transfer function at spatial
+        frequencies `f` for all azimuths (azimuths, f)
+
+        The line spread functions are piecewise constant; their
+        Fourier transform is the binned sum times the transform of a
+        bin (sinc).
+        """
+        f = np.atleast_1d(f)
+        x, lsf = self.lsf()
+        ot = np.dot(lsf, np.exp(-2j*np.pi*x[:, None]*f))
+        return np.absolute(ot*np.sinc(f*self.binsize))
+
+    def radius(self, fraction=.8):
+        """radius within which `fraction` of the energy is"""
+        r, ee = self.encircled()
+        i = np.searchsorted(ee, fraction)
+        if i >= r.shape[0]:
+            return np.nan
+        return r[i]
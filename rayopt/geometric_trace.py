@@ -22,11 +22,12 @@ from __future__ import (absolute_import, print_function,
 import itertools
 
 import numpy as np
-from scipy.interpolate import griddata
 
 from .elements import Spheroid
 from .utils import sinarctan, tanarcsin, public, pupil_distribution
 from .raytrace import Trace
+from .geometric_psf import SpotHistogram
+from .instrument import timed
 
 
 @public
@@ -72,6 +73,7 @@ class GeometricTrace(Trace):
         self.n[0] = self.system.refractive_index(l, 0)
         self.t[0] = 0
 
+    @timed("trace")
     def propagate(self, start=1, stop=None, clip=False):
         super(GeometricTrace, self).propagate()
         init = start - 1
@@ -82,6 +84,21 @@ class GeometricTrace(Trace):
             j += start
             self.y[j], self.u[j], self.n[j], self.i[j], self.t[j] = yunit
 
+    def view(self, rays, w=None, ref=0):
+        """a trace of the subset `rays` (a slice) of the rays that
+        shares the data of this trace (numpy views)"""
+        t = GeometricTrace(self.system)
+        for k in "length n l path track origins mirrored".split():
+            setattr(t, k, getattr(self, k))
+        t.y, t.u, t.i, t.t = (v[:, rays] for v in (self.y, self.u,
+                                                   self.i, self.t))
+        t.nrays = t.y.shape[1]
+        if w is None:
+            w = np.ones(t.nrays)/t.nrays
+        t.w = w
+        t.ref = ref
+        return t
+
     def refocus(self, at=-1):
         y = self.y[at, :, :2]
         u = tanarcsin(self.i[at])
@@ -134,6 +151,7 @@ class GeometricTrace(Trace):
         py -= py[self.ref]
         x, y, z = py.T
         if resample:
+            from scipy.interpolate import griddata
             pyt = np.vstack((x, y, t))
             x, y, t = pyt[:, np.all(np.isfinite(pyt), axis=0)]
             if not t.size:
@@ -185,6 +203,46 @@ class GeometricTrace(Trace):
         r = (r*w).sum()
         return np.sqrt(r)
 
+    def spot_histogram(self, binsize=None, nbins=256, i=-1, ref=None,
+                       azimuths=(0., np.pi/2)):
+        """weighted histogram of the ray hits on surface i, centered on
+        the centroid (or on ray ref), see SpotHistogram"""
+        y = self.y[i, :, :2]
+        if self.w is not None:
+            w = self.w
+        else:
+            w = np.ones(y.shape[0])
+        good = np.all(np.isfinite(y), axis=1)
+        if not np.any(good):
+            raise ValueError("no rays made it through")
+        if ref is None:
+            y0 = np.dot(w[good], y[good])/w[good].sum()
+        else:
+            y0 = y[ref]
+        if binsize is None:
+            r = np.hypot(*(y[good] - y0).T).max()
+            binsize = (r or 1.)/nbins*(1 + 1e-9)
+        h = SpotHistogram(binsize, nbins, y0, azimuths)
+        h.add(y, w)
+        return h
+
+    def encircled_energy(self, **kwargs):
+        """radii and geometric encircled energy fraction"""
+        return self.spot_histogram(**kwargs).encircled()
+
+    def ensquared_energy(self, **kwargs):
+        """square half widths and geometric ensquared energy
+        fraction"""
+        return self.spot_histogram(**kwargs).ensquared()
+
+    def geometric_mtf(self, f=None, **kwargs):
+        """spatial frequencies and geometric (spot density) MTF for the
+        azimuths (sagittal and tangential by default)"""
+        h = self.spot_histogram(**kwargs)
+        if f is None:
+            f = np.linspace(0, .25/h.binsize, h.nbins//2)
+        return f, h.mtf(f)
+
     def rays_paraxial(self, paraxial=None):
         if paraxial is None:
             paraxial = self.system.paraxial
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Glass map and glass substitution.
+
+The `GlassMap` indexes the solid materials of the library by their
+position in the glass map (refractive index nd, Abbe number vd and
+relative partial dispersion P_gF) in a KD-tree. `GlassSubstitution`
+uses it to treat the glass of an element as a discrete variable: the
+nearest glasses are evaluated (in parallel on an executor) with the
+rest of the system held fixed.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import copy
+import json
+import warnings
+
+import numpy as np
+
+from .system import System
+from .material import Material, fraunhofer
+from .utils import public
+
+
+def glass_coordinates(material):
+    """nd, vd and P_gF of a material"""
+    ng, nF, nd, nC = (material.refractive_index(fraunhofer[k])
+                      for k in "gFdC")
+    return nd, (nd - 1)/(nF - nC), (ng - nF)/(nF - nC)
+
+
+def normal_line(vd):
+    """P_gF of the normal glasses (Schott normal line through K7 and
+    F2)"""
+    return .6438 - .001682*vd
+
+
+@public
+class GlassMap(object):
+    """KD-tree of the library glasses over (nd, vd, P_gF)
+
+    Distances are measured in units of `scale`: by default a change of
+    .01 in nd counts as much as one in vd and .002 in P_gF. Only
+    glasses from `catalog` and `source` (if given) with a plausible
+    dispersion (1 < nd < 3, 10 < vd < 150) are indexed.
+    """
+    _one = None
+
+    @classmethod
+    def one(cls):
+        if cls._one is None:
+            cls._one = cls()
+        return cls._one
+
+    def __init__(self, library=None, catalog=None, source=None,
+                 scale=(.01, 1., .002)):
+        from scipy.spatial import cKDTree
+        from .library import Library
+        from .library_items import Material as Item, Catalog
+        if library is None:
+            library = Library.one()
+        self.scale = np.array(scale, dtype=np.float64)
+        q = library.session.query(Item).join(Catalog)
+        if catalog is not None:
+            q = q.filter(Catalog.name == catalog)
+        if source is not None:
+            q = q.filter(Catalog.source == source)
+        names, coords = [], []
+        with warnings.catch_warnings(), np.errstate(all="ignore"):
+            warnings.simplefilter("ignore")
+            for item in q.order_by(Item.id):
+                try:
+                    m = item.parse()
+                    c = glass_coordinates(m)
+                except Exception:
+                    continue
+                if (m.mirror or not m.solid or "/" in m.name or
+                        not np.all(np.isfinite(c)) or
+                        not (1 < c[0] < 3 and 10 < c[1] < 150)):
+                    continue
+                names.append(str(m))
+                coords.append(c)
+        self.names = names
+        self.coordinates = np.array(coords).reshape(-1, 3)
+        self.tree = cKDTree(self.coordinates/self.scale)
+
+    def __len__(self):
+        return len(self.names)
+
+    def nearest(self, nd, vd, pgf=None, k=8):
+        """names and distances of the k glasses nearest to (nd, vd,
+        P_gF), P_gF defaults to the normal line"""
+        if pgf is None:
+            pgf = normal_line(vd)
+        k = min(k, len(self))
+        d, i = self.tree.query(np.array([nd, vd, pgf])/self.scale, k)
+        d, i = np.atleast_1d(d, i)
+        return [self.names[j] for j in i], d
+
+    def near(self, material, k=8):
+        """names and distances of the k glasses nearest to a
+        material"""
+        return self.nearest(*glass_coordinates(Material.make(material)),
+                            k=k)
+
+
+_unit_system = None, None
+
+
+def run_substitution(unit):
+    """executor work function: the merit (sum of squares) of the
+    `(system json, element, material names, merit, compensators)` unit
+    for each material, nan for failures"""
+    global _unit_system
+    text, i, names, merit, compensators = unit
+    key, nominal = _unit_system
+    if key != text:
+        nominal = System(**json.loads(text))
+        nominal.update()
+        _unit_system = text, nominal
+    r = []
+    for name in names:
+        s = copy.deepcopy(nominal)
+        try:
+            s[i].material = Material.make(name)
+            s.update()
+            for c in compensators:
+                c(s)
+            s.update()
+            r.append(np.square(merit(s)).sum())
+        except (ValueError, KeyError, RuntimeError, FloatingPointError):
+            r.append(np.nan)
+    return np.array(r)
+
+
+@public
+class GlassSubstitution(object):
+    """Glass substitution: for each of the `elements`, the `candidates`
+    nearest glasses in the glass map are tried with the rest of the
+    system fixed (up to the `compensators`, see `rayopt.tolerance`)
+    and the one with the lowest `merit(system)` (an array, summed in
+    squares) is kept. The merit and the compensators must be picklable
+    to use an executor.
+    """
+    def __init__(self, system, elements, merit, glass_map=None,
+                 compensators=(), candidates=8):
+        self.system = system
+        self.elements = list(elements)
+        self.merit = merit
+        if glass_map is None:
+            glass_map = GlassMap.one()
+        self.glass_map = glass_map
+        self.compensators = list(compensators)
+        self.candidates = candidates
+
+    def evaluate(self, i, names, executor=None, chunksize=4):
+        """merits of the system with element i made from each of the
+        materials `names`"""
+        text = json.dumps(self.system.dict())
+        units = [(text, i, names[j:j + chunksize], self.merit,
+                  self.compensators)
+                 for j in range(0, len(names), chunksize)]
+        if executor is None:
+            r = map(run_substitution, units)
+        else:
+            r = executor.map(run_substitution, units)
+        return np.concatenate(list(r))
+
+    def step(self, i, executor=None):
+        """try the nearest glasses for element i, apply the best and
+        return the names and merits"""
+        e = self.system[i]
+        current = str(e.material)
+        names, d = self.glass_map.near(e.material, self.candidates + 1)
+        names = [current] + [n for n in names if n != current]
+        names = names[:self.candidates + 1]
+        merits = self.evaluate(i, names, executor)
+        best = np.nanargmin(np.where(np.isnan(merits), np.inf, merits))
+        if best:
+            e.material = Material.make(names[best])
+            self.system.update()
+        return names, merits
+
+    def run(self, rounds=2, executor=None, progress=None):
+        """substitute the glasses element by element for up to
+        `rounds` rounds (until no glass changes) and return the
+        changes `(element, old, new, merit)`; `progress(element, names,
+        merits)` is called after each element"""
+        changes = []
+        for k in range(rounds):
+            changed = False
+            for i in self.elements:
+                names, merits = self.step(i, executor)
+                if progress:
+                    progress(i, names, merits)
+                new = str(self.system[i].material)
+                if new != names[0]:
+                    changes.append((i, names[0], new,
+                                    np.nanmin(merits)))
+                    changed = True
+            if not changed:
+                break
+        return changes
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Global optimization.
+
+Many local optimizations (`dls()` or `optimize()`) are started from
+random points within the variable bounds, optionally continued by
+basin hopping. They run as independent units, each on its own copy of
+the system rebuilt from its json serialization, so that they can be
+distributed over worker processes. The local minima found are
+deduplicated and ranked by merit.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import copy
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .system import System
+from .optimize import PathVariable, FuncOp, optimize, dls
+from .utils import public
+
+
+__all__ = ["Solution", "SearchResult"]
+
+
+Solution = namedtuple("Solution", "x merit count nfev")
+Solution.__doc__ = """A local minimum: the parameter values `x`, the
+`merit` (sum of squares), the number of local optimizations that
+converged to it (`count`) and their merit evaluations (`nfev`)."""
+
+
+class SearchResult(namedtuple("SearchResult",
+                              "paths solutions starts elapsed complete")):
+    """The deduplicated `solutions` ranked by merit, the number of
+    units (`starts`, each with its basin hopping steps) that finished,
+    the wall-clock time and whether all units were run (not cut short
+    by the deadline or cancellation)"""
+    __slots__ = ()
+
+    @property
+    def best(self):
+        return self.solutions[0] if self.solutions else None
+
+    def apply(self, system, i=0):
+        """set the parameters of solution i on the system"""
+        for path, v in zip(self.paths, self.solutions[i].x):
+            system.set_path(path, v)
+        system.update()
+
+
+def local_minimum(system, paths, bounds, merit, x, method="dls",
+                  **kwargs):
+    """locally minimize `merit(system)` (an array of residuals) over
+    the parameters at `paths` within `bounds` starting from `x`;
+    returns the final parameters, merit and the number of evaluations
+    and leaves the system at the minimum"""
+    variables = [PathVariable(system, path, bounds=b, init=xi)
+                 for path, b, xi in zip(paths, bounds, x)]
+
+    def func(system):
+        system.update()  # pupils and solves follow the variables
+        return merit(system)
+
+    operands = [FuncOp(system, func, weight=1)]
+    if method == "dls":
+        r = dls(variables, operands, **kwargs)
+    else:
+        r = optimize(variables, operands, **kwargs)
+    r.accept()
+    system.update()
+    x = np.array([v.get() for v in variables])
+    return x, float(r.fun), int(r.nfev)
+
+
+_unit_system = None, None
+
+
+def run_search(unit):
+    """executor work function: local optimizations for a `(system json,
+    paths, bounds, merit, method, kwargs, start, hops, step,
+    temperature, seed, deadline)` unit
+
+    Basin hopping: after the first local minimum, `hops` times perturb
+    the current minimum by `step` (relative to the bounds) and
+    optimize again, accepting the new minimum with the Metropolis
+    criterion at `temperature` (relative merit change). Returns the
+    list of `(x, merit, nfev)` of all local minima, skipping failed
+    optimizations and stopping at the `deadline` (`time.time()`).
+    """
+    global _unit_system
+    (text, paths, bounds, merit, method, kwargs, start, hops, step,
+     temperature, seed, deadline) = unit
+    key, nominal = _unit_system
+    if key != text:
+        nominal = System(**json.loads(text))
+        nominal.update()
+        _unit_system = text, nominal
+    rng = np.random.RandomState(seed)
+    lo, hi = np.array(bounds).T
+    r, x, f = [], start, None
+    current = start, f, 0
+    for i in range(hops + 1):
+        if deadline is not None and time.time() > deadline:
+            break
+        if i:
+            dx = rng.normal(0, step, lo.shape)*(hi - lo)
+            x = np.clip(current[0] + dx, lo, hi)
+        s = copy.deepcopy(nominal)
+        try:
+            ri = local_minimum(s, paths, bounds, merit, x, method,
+                               **kwargs)
+        except (ValueError, RuntimeError, FloatingPointError,
+                np.linalg.LinAlgError):
+            continue
+        if not np.isfinite(ri[1]):
+            continue
+        r.append(ri)
+        if f is None or ri[1] <= f or rng.uniform() < np.exp(
+                -(ri[1] - f)/(temperature*f + 1e-300)):
+            current, f = ri, ri[1]
+    return r
+
+
+def unique(minima, xtol=1e-3, ftol=1e-3, bounds=None):
+    """merge the `(x, merit, nfev)` minima whose merits agree within
+    `ftol` (relative) and whose parameters agree within `xtol`
+    (relative to the bounds); returns `Solution`s ranked by merit"""
+    scale = 1.
+    if bounds is not None:
+        lo, hi = np.array(bounds).T
+        scale = np.where(np.isfinite(hi - lo), hi - lo, 1.)
+    solutions = []
+    for x, f, n in sorted(minima, key=lambda m: m[1]):
+        for j, s in enumerate(solutions):
+            if (abs(f - s.merit) <= ftol*(abs(s.merit) + ftol) and
+                    np.all(np.fabs(x - s.x)/scale <= xtol)):
+                solutions[j] = s._replace(count=s.count + 1,
+                                          nfev=s.nfev + n)
+                break
+        else:
+            solutions.append(Solution(x, f, 1, n))
+    return solutions
+
+
+@public
+class GlobalSearch(object):
+    """Multi-start and basin hopping global minimization of
+    `merit(system)` over the parameters at `paths` within `bounds`.
+
+    `method` is "dls" or "optimize", `kwargs` are passed on to it. The
+    merit function must be picklable to use an executor.
+    """
+    def __init__(self, system, paths, bounds, merit, method="dls",
+                 seed=None, **kwargs):
+        self.system = system
+        self.paths = [tuple(p) for p in paths]
+        self.bounds = np.array(bounds, dtype=np.float64).reshape(-1, 2)
+        assert self.bounds.shape[0] == len(self.paths)
+        assert np.all(np.isfinite(self.bounds))
+        self.merit = merit
+        self.method = method
+        self.seed = seed
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        """cooperative cancellation: no further units are started and
+        pending units on an executor are cancelled, units that are
+        already running in a worker finish (including their basin
+        hopping steps) but are not collected"""
+        self.cancelled = True
+
+    def starts(self, n, spread=None):
+        """n starting points: the current parameters followed by points
+        drawn uniformly within the bounds or, with `spread`, normally
+        around the current parameters (sigma relative to the bounds)"""
+        rng = np.random.RandomState(self.seed)
+        lo, hi = self.bounds.T
+        x0 = np.clip([self.system.get_path(p) for p in self.paths], lo, hi)
+        if spread is None:
+            x = rng.uniform(lo, hi, (n, lo.size))
+        else:
+            x = np.clip(x0 + rng.normal(0, spread, (n, lo.size))*(hi - lo),
+                        lo, hi)
+        x[0] = x0
+        return x
+
+    def units(self, starts, hops=0, step=.1, temperature=.1,
+              deadline=None):
+        text = json.dumps(self.system.dict())
+        seeds = np.random.RandomState(self.seed).randint(
+            2**31, size=len(starts))
+        for x, seed in zip(starts, seeds):
+            yield (text, self.paths, self.bounds.tolist(), self.merit,
+                   self.method, self.kwargs, x, hops, step, temperature,
+                   seed, deadline)
+
+    def run(self, n=16, spread=None, hops=0, step=.1, temperature=.1,
+            budget=None, executor=None, callback=None, xtol=1e-3,
+            ftol=1e-3, checkpoint=None, resume=False):
+        """run n units (multi-start with `hops` basin hopping steps
+        each) and return the ranked `SearchResult`, optionally on an
+        `executor` (e.g. a `concurrent.futures.ProcessPoolExecutor`)
+
+        `budget` is the wall-clock limit in seconds. `callback(minima)`
+        is called with the new minima of each finished unit, it may
+        call `cancel()` or return True to stop.
+
+        A `Checkpoint` records the minima and the finished units after
+        each unit, `resume` skips the units finished in an existing
+        checkpoint (the same `n`, `spread` and seed reproduce the same
+        units).
+        """
+        t0 = time.time()
+        deadline = None if budget is None else t0 + budget
+        self.cancelled = False
+        units = list(self.units(self.starts(n, spread), hops, step,
+                                temperature, deadline))
+        minima, done = [], set()
+        if resume and checkpoint is not None and checkpoint.exists():
+            x, state = checkpoint.load()
+            done.update(state["done"])
+            minima.extend((np.array(x), f, n) for x, f, n in state["minima"])
+
+        def finish(i, r):
+            minima.extend(r)
+            done.add(i)
+            if checkpoint is not None:
+                best = min(minima, key=lambda m: m[1])[0] if minima else []
+                checkpoint.save(best, {
+                    "done": sorted(done),
+                    "minima": [(x, f, n) for x, f, n in minima]},
+                    self.system)
+            if callback and callback(r):
+                self.cancel()
+
+        todo = [(i, u) for i, u in enumerate(units) if i not in done]
+        if executor is None:
+            for i, unit in todo:
+                if self.cancelled or (
+                        deadline is not None and time.time() > deadline):
+                    break
+                finish(i, run_search(unit))
+        else:
+            from concurrent.futures import wait, FIRST_COMPLETED
+            pending = dict((executor.submit(run_search, u), i)
+                           for i, u in todo)
+            while pending and not self.cancelled:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0., deadline - time.time())
+                finished = wait(pending, timeout,
+                                return_when=FIRST_COMPLETED)[0]
+                if not finished:
+                    break
+                for f in finished:
+                    finish(pending.pop(f), f.result())
+            for f in pending:
+                f.cancel()
+        solutions = unique(minima, xtol, ftol, self.bounds)
+        return SearchResult(self.paths, solutions, len(done),
+                            time.time() - t0, len(done) == len(units))
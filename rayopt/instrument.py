@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Opt-in instrumentation.
+
+While a `Profile` is active (`with Profile() as p:`) the instrumented
+phases (system update with pickups, solves and paraxial trace, pupil
+aiming, geometric tracing, operand evaluation) record their calls and
+wall time, and events (pupil cache hits and misses, Newton intercept
+solves, one per ray, and their failures in `Interface.intercept`) are
+counted. Without an active profile the hooks cost one list check.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import functools
+import time
+
+from .utils import public
+
+
+_active = []
+
+
+def enabled():
+    return bool(_active)
+
+
+def count(name, n=1):
+    """count `n` events `name` in the active profiles"""
+    for p in _active:
+        p.counters[name] = p.counters.get(name, 0) + n
+
+
+def timed(name):
+    """decorator timing the calls of a function as phase `name` in the
+    active profiles (nested phases are included in their parents)"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return func(*args, **kwargs)
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                dt = time.time() - t0
+                for p in _active[:]:
+                    p.add(name, dt)
+        return wrapper
+    return decorate
+
+
+def _lru_caches():
+    # the clru_cache'd refractive index methods of the materials
+    from . import material
+    caches = {}
+    todo = [material.Material]
+    while todo:
+        cls = todo.pop()
+        todo.extend(cls.__subclasses__())
+        f = cls.__dict__.get("refractive_index")
+        if hasattr(f, "cache_info"):
+            caches["%s.refractive_index" % cls.__name__] = f
+    return caches
+
+
+@public
+class Profile(object):
+    """Counters and phase timers of everything run while active.
+
+    `callback(name, elapsed)` is called at the end of each timed phase.
+    The hit rates of the material refractive index caches are taken
+    from their `cache_info()` differences over the active period.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counters = {}
+        self.timers = {}
+        self.caches = {}
+        self.elapsed = 0.
+        self._start = None
+
+    def add(self, name, dt):
+        n, t = self.timers.get(name, (0, 0.))
+        self.timers[name] = n + 1, t + dt
+        if self.callback:
+            self.callback(name, dt)
+
+    def __enter__(self):
+        self._caches = dict((k, f.cache_info()) for k, f
+                            in _lru_caches().items())
+        self._start = time.time()
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active.remove(self)
+        self.elapsed += time.time() - self._start
+        for k, f in _lru_caches().items():
+            info = f.cache_info()
+            h0, m0 = self.caches.get(k, (0, 0))
+            i0 = self._caches.get(k)
+            if i0 is not None:
+                h0 += info.hits - i0.hits
+                m0 += info.misses - i0.misses
+            if h0 or m0:
+                self.caches[k] = h0, m0
+
+    def hit_rates(self):
+        """cache name: (hits, misses, hit rate)"""
+        r = dict(self.caches)
+        for k in set(c.rsplit(".", 1)[0] for c in self.counters
+                     if c.endswith((".hits", ".misses"))):
+            r[k] = (self.counters.get(k + ".hits", 0),
+                    self.counters.get(k + ".misses", 0))
+        return dict((k, (h, m, h/(h + m) if h + m else 0.))
+                    for k, (h, m) in r.items())
+
+    def text(self):
+        yield "%-36s %8s %10s %10s %6s" % ("phase", "calls", "total/s",
+                                           "mean/ms", "%")
+        for k, (n, t) in sorted(self.timers.items(),
+                                key=lambda i: -i[1][1]):
+            yield "%-36s %8i %10.4g %10.4g %6.1f" % (
+                k, n, t, 1e3*t/n, 100*t/(self.elapsed or 1.))
+        yield "%-36s %8s %10.4g" % ("run", "", self.elapsed)
+        yield ""
+        yield "%-36s %8s %10s %6s" % ("cache", "hits", "misses", "%")
+        for k, (h, m, r) in sorted(self.hit_rates().items()):
+            yield "%-36s %8i %10i %6.1f" % (k, h, m, 100*r)
+        yield ""
+        yield "%-36s %8s" % ("event", "count")
+        for k, n in sorted(self.counters.items()):
+            if not k.endswith((".hits", ".misses")):
+                yield "%-36s %8i" % (k, n)
+
+    def __str__(self):
+        return "\n".join(self.text())
+
+
+def profiled(func):
+    """decorator: the optimizer takes a `profile` keyword argument (a
+    `Profile` or True), runs in it and returns it as `result.profile`"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = kwargs.pop("profile", None)
+        if not profile:
+            return func(*args, **kwargs)
+        if profile is True:
+            profile = Profile()
+        with profile:
+            r = func(*args, **kwargs)
+        r.profile = profile
+        return r
+    return wrapper
@@ -23,11 +23,18 @@ import os
 import shutil
 import site
 import warnings
+from collections import OrderedDict
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+import numpy as np
 
 from pkg_resources import Requirement, resource_filename
 
 from sqlalchemy.engine import Engine
-from sqlalchemy import event, create_engine, orm
+from sqlalchemy import event, create_engine, orm, inspect, text
 
 from .utils import public
 from .library_items import Material, Lens, Catalog, Base
@@ -43,14 +50,19 @@ codev.register_parsers()
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
-    cursor.execute("pragma page_size = 512")
     cursor.execute("pragma foreign_keys = on")
+    cursor.execute("pragma mmap_size = %i" % (1 << 26))
     cursor.close()
 
 
 @public
 class Library(object):
     _one = None
+    # process-wide LRU of parsed materials by (source, catalog, name)
+    _materials = OrderedDict()
+    cache_size = 1024
+    # names per IN (...) query, below the 999 variables of old sqlite
+    query_chunk = 500
 
     @classmethod
     def one(cls, *args, **kwargs):
@@ -63,28 +75,98 @@ class Library(object):
             warnings.warn("to guarantee consistency, Library should be "
                           "used as a singleton throughout: "
                           "use `Library.one()`", stacklevel=3)
+        self.readonly = False
         if db is None:
-            db = "sqlite:///%s" % self.find_db()
+            db = self.find_db()
+            if not os.path.exists(db):
+                # no user catalogs: use the bundled library in place
+                db = self.bundled_db()
+                self.readonly = True
+            db = self.db_url(db, self.readonly)
         self.db_get(db)
 
-    def find_db(self):
+    @staticmethod
+    def db_url(path, readonly=False):
+        # sqlalchemy unquotes the database part of its url
+        path = path.replace(os.sep, "/")
+        if readonly:
+            # the bundled file never changes: no locking, no journal
+            # the sqlite uri is quoted once more for sqlite itself
+            path = quote(quote(path, safe="/:"), safe="/:")
+            return "sqlite:///file:%s?mode=ro&immutable=1&uri=true" % path
+        return "sqlite:///%s" % quote(path, safe="/:")
+
+    def bundled_db(self):
         name = "library.sqlite"
-        dir = os.path.join(site.getuserbase(), "rayopt")
-        main = os.path.join(dir, name)
+        base = resource_filename(Requirement.parse("rayopt"), name)
+        if not os.path.exists(base):
+            base = os.path.join(os.path.split(__file__)[0], name)
+        return base
+
+    def find_db(self):
+        """the user library (a copy of the bundled library that
+        catalogs are loaded into)"""
+        return os.path.join(site.getuserbase(), "rayopt", "library.sqlite")
+
+    def make_writable(self):
+        """switch from the bundled library to the user library,
+        copying the bundled library there first"""
+        main = self.find_db()
         if not os.path.exists(main):
-            base = resource_filename(Requirement.parse("rayopt"), name)
-            if not os.path.exists(base):
-                base = os.path.join(os.path.split(__file__)[0], name)
+            dir = os.path.dirname(main)
             if not os.path.exists(dir):
                 os.makedirs(dir)
-            shutil.copy(base, main)
-        return main
+            shutil.copy(self.bundled_db(), main)
+        self.session.close()
+        self.engine.dispose()
+        self.readonly = False
+        self.db_get(self.db_url(main))
 
     def db_get(self, db):
         self.engine = create_engine(db)
-        Base.metadata.create_all(self.engine)
+        migrate = False
+        if not self.readonly:
+            Base.metadata.create_all(self.engine)
+            for table in Base.metadata.tables.values():
+                for index in table.indexes:
+                    index.create(self.engine, checkfirst=True)
+            migrate = self.add_columns()
         Session = orm.sessionmaker(bind=self.engine)
         self.session = Session()
+        if migrate:
+            self.pack_materials()
+            self.session.commit()
+
+    def add_columns(self):
+        """add the columns missing from the tables of an older
+        library, returns whether any were added"""
+        have = inspect(self.engine)
+        added = False
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                names = set(c["name"] for c in have.get_columns(table.name))
+                for c in table.columns:
+                    if c.name in names:
+                        continue
+                    conn.execute(text("alter table {} add column {} {}".format(
+                        table.name, c.name,
+                        c.type.compile(self.engine.dialect))))
+                    added = True
+        return added
+
+    def pack_materials(self):
+        """parse the materials that have no typed dispersion data yet
+        and store it (see `library_items.Material.pack()`)"""
+        res = self.session.query(Material).join(Catalog).options(
+            orm.contains_eager(Material.catalog)).filter(
+            Material.formula.is_(None), Material.data.isnot(None))
+        with warnings.catch_warnings(), np.errstate(all="ignore"):
+            warnings.simplefilter("ignore")
+            for item in res:
+                try:
+                    item.pack()
+                except Exception as e:
+                    print("error: {}: {}".format(item.name, e))
 
     def load_all(self, paths, **kwargs):
         for path in paths:
@@ -95,6 +177,8 @@ class Library(object):
                     pass
 
     def load(self, fil, mode="refresh"):
+        if self.readonly:
+            self.make_writable()
         if mode in ("refresh", "reload"):
             res = self.session.query(Catalog).filter(
                 Catalog.file == fil).first()
@@ -110,7 +194,10 @@ class Library(object):
 
         try:
             if Catalog.parse(fil, self.session):
+                self.session.flush()
+                self.pack_materials()
                 self.session.commit()
+                self._materials.clear()
                 print("added %s" % fil)
         except:
             self.session.rollback()
@@ -129,12 +216,64 @@ class Library(object):
             res = res.filter(Catalog.source == source)
         if name is not None:
             res = res.filter(Typ.name == name)
-        res = res.order_by(Typ.name)
-        if not res.count():
-            raise KeyError("{} {}/{}/{} not found".format(
-                typ, source, catalog, name))
+        res = res.order_by(Typ.name, Typ.catalog_id, Typ.id)
+        found = False
         for item in res:
+            found = True
             yield item.parse()
+        if not found:
+            raise KeyError("{} {}/{}/{} not found".format(
+                typ, source, catalog, name))
+
+    def get_many(self, typ, keys):
+        """the items for the `(source, catalog, name)` keys (source
+        and catalog may be None), resolved with one query per
+        `query_chunk` names"""
+        Typ = {"material": Material, "lens": Lens}[typ]
+        names = sorted(set(name.lower() for source, catalog, name in keys))
+        rows = {}
+        for i in range(0, len(names), self.query_chunk):
+            res = self.session.query(Typ).join(Catalog).options(
+                orm.contains_eager(Typ.catalog)).filter(
+                Typ.name.in_(names[i:i + self.query_chunk])).order_by(
+                Typ.name, Typ.catalog_id, Typ.id)
+            for item in res:
+                rows.setdefault(item.name.lower(), []).append(item)
+        items = []
+        for source, catalog, name in keys:
+            for item in rows.get(name.lower(), []):
+                c = item.catalog
+                if ((catalog is None or c.name.lower() == catalog.lower())
+                        and (source is None or
+                             c.source.lower() == source.lower())):
+                    items.append(item.parse())
+                    break
+            else:
+                raise KeyError("{} {}/{}/{} not found".format(
+                    typ, source, catalog, name))
+        return items
+
+    def materials(self, keys):
+        """the parsed materials for the `(source, catalog, name)` keys,
+        from the process-wide cache or with one query for the
+        missing ones"""
+        keys = [tuple(None if k is None else k.lower() for k in key)
+                for key in keys]
+        missing = [k for k in set(keys) if k not in self._materials]
+        if missing:
+            for k, m in zip(missing, self.get_many("material", missing)):
+                self._materials[k] = m
+        r = []
+        for k in keys:
+            m = self._materials.pop(k)
+            self._materials[k] = m
+            r.append(m)
+        while len(self._materials) > self.cache_size:
+            self._materials.popitem(last=False)
+        return r
+
+    def material(self, name, catalog=None, source=None):
+        return self.materials([(source, catalog, name)])[0]
 
 
 def _test(l):
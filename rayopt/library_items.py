@@ -24,8 +24,9 @@ import io
 import hashlib
 import time
 
-from sqlalchemy import (Column, Integer, String, Float,
-                        ForeignKey, Boolean)
+import numpy as np
+from sqlalchemy import (Column, Integer, String, Float, LargeBinary,
+                        ForeignKey, Boolean, Index)
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship
 
@@ -39,6 +40,15 @@ class Tablename(object):
 Base = declarative_base(cls=Tablename)
 
 
+def pack(a):
+    """float array as a little endian float64 blob"""
+    return np.asarray(a, dtype="<f8").tobytes()
+
+
+def unpack(b):
+    return np.frombuffer(b, dtype="<f8").astype(np.float64)
+
+
 class LoaderParser:
     parsers = {}
 
@@ -47,12 +57,21 @@ class LoaderParser:
             return self.obj
         except AttributeError:
             pass
-        obj = self.parsers[self.catalog.format](self.data, self)
+        obj = self.unpack()
+        if obj is None:
+            obj = self.parse_data()
         obj.item = self
         obj.catalog = self.catalog.name
         self.obj = obj
         return obj
 
+    def parse_data(self):
+        """the object parsed from the full raw catalog data"""
+        return self.parsers[self.catalog.format](self.data, self)
+
+    def unpack(self):
+        return None
+
 
 @public
 class Material(Base, LoaderParser):
@@ -71,11 +90,61 @@ class Material(Base, LoaderParser):
     density = Column(Float)
     tce = Column(Float)
     data = Column(String)
+    # dispersion data parsed from `data` at import, see `pack()`
+    formula = Column(String)
+    coefficients = Column(LargeBinary)
+    lambda_min = Column(Float)
+    lambda_max = Column(Float)
+    thermal = Column(LargeBinary)
     #  unique (name, catalog)
+    __table_args__ = (Index("ix_material_name_catalog", "name",
+                            "catalog_id"),)
 
     parsers = {
     }
 
+    def pack(self):
+        """store the dispersion formula, coefficients, validity range
+        and thermal data of `data` in the typed columns (and nd, vd if
+        missing)"""
+        obj = self.parse_data()
+        if not hasattr(obj, "coefficients"):
+            return
+        self.formula = obj.typ
+        self.coefficients = pack(obj.coefficients)
+        self.lambda_min = getattr(obj, "lambda_min", None)
+        self.lambda_max = getattr(obj, "lambda_max", None)
+        t = getattr(obj, "thermal", None)
+        if t is not None:
+            self.thermal = pack(list(t.d) + list(t.e) + [t.tref, t.lref])
+        if self.density is None:
+            self.density = getattr(obj, "density", None)
+        if self.nd is None:
+            try:
+                with np.errstate(all="ignore"):
+                    nd, vd = obj.nd, obj.vd
+            except (IndexError, ValueError):  # no formula at d
+                return
+            if np.isreal(nd) and np.isreal(vd) and np.isfinite([nd, vd]).all():
+                self.nd, self.vd = float(nd), float(vd)
+
+    def unpack(self):
+        """the material built from the typed columns, without parsing
+        `data` (comments, references and transmission data are only in
+        `parse_data()`)"""
+        if self.formula is None:
+            return None
+        from .material import CoefficientsMaterial, Thermal
+        obj = CoefficientsMaterial(name=self.name, typ=self.formula,
+                                   coefficients=unpack(self.coefficients))
+        obj.lambda_min, obj.lambda_max = self.lambda_min, self.lambda_max
+        if self.thermal is not None:
+            t = unpack(self.thermal)
+            obj.thermal = Thermal(t[:3], t[3:5], *t[5:])
+        if self.density is not None:
+            obj.density = self.density
+        return obj
+
 
 @public
 class Lens(Base, LoaderParser):
@@ -97,6 +166,8 @@ class Lens(Base, LoaderParser):
     enp = Column(Float)
     data = Column(String)
     #  unique (catalog, name)
+    __table_args__ = (Index("ix_lens_name_catalog", "name",
+                            "catalog_id"),)
 
     parsers = {
     }
@@ -116,6 +187,7 @@ class Catalog(Base):
     size = Column(Integer)
     sha1 = Column(String)
     imported = Column(Float)
+    __table_args__ = (Index("ix_catalog_name_source", "name", "source"),)
 
     lenses = relationship(Lens, lazy="dynamic", backref="catalog",
                           cascade="all, delete-orphan")
@@ -75,17 +75,36 @@ class Thermal(object):
         return dn
 
     def dict(self):
-        return {"d": self.d, "e": self.e, "tref": self.tref, "lref": self.lref}
+        return {"d": [float(d) for d in self.d],
+                "e": [float(e) for e in self.e],
+                "tref": float(self.tref), "lref": float(self.lref)}
+
+
+def library_key(name):
+    """`(source, catalog, name)` of a "[[source/]catalog/]name"
+    material name (lower case, None if not given)"""
+    parts = name.lower().split("/")
+    name = parts.pop()
+    source, catalog = None, None
+    if parts:
+        catalog = parts.pop()
+    if parts:
+        source = parts.pop()
+    return source, catalog, name
 
 
 @public
 class Material(NameMixin):
+    _type = _default_type = "material"
+
     def __init__(self, name="-", solid=True, mirror=False, catalog=None,
                  thermal=None):
         self.name = name
         self.solid = solid
         self.mirror = mirror
         self.catalog = catalog
+        if isinstance(thermal, dict):
+            thermal = Thermal(**thermal)
         self.thermal = thermal
 
     @classmethod
@@ -95,7 +114,7 @@ class Material(NameMixin):
         if isinstance(name, Material):
             return name
         if isinstance(name, dict):
-            return super(Material, self).make(name)
+            return super(Material, cls).make(dict(name))
         if type(name) is float:
             return ModelMaterial(n=name)
         if type(name) is tuple:
@@ -104,18 +123,33 @@ class Material(NameMixin):
             return AbbeMaterial.from_string(name)
         except ValueError:
             pass
-        parts = name.lower().split("/")
-        name = parts.pop()
-        source, catalog = None, None
-        if parts:
-            catalog = parts.pop()
-        if parts:
-            source = parts.pop()
+        source, catalog, name = library_key(name)
         if catalog in (None, "basic") and name in basic:
             return basic[name]
         from .library import Library
         lib = Library.one()
-        return lib.get("material", name, catalog, source)
+        return lib.material(name, catalog, source)
+
+    @staticmethod
+    def prefetch(names):
+        """resolve all library materials among `names` (as accepted
+        by `make()`) with one library query"""
+        keys = []
+        for name in names:
+            if not isinstance(name, str):
+                continue
+            try:
+                AbbeMaterial.from_string(name)
+                continue
+            except ValueError:
+                pass
+            source, catalog, name = library_key(name)
+            if catalog in (None, "basic") and name in basic:
+                continue
+            keys.append((source, catalog, name))
+        if keys:
+            from .library import Library
+            Library.one().materials(keys)
 
     def __str__(self):
         if self.catalog is not None:
@@ -125,6 +159,8 @@ class Material(NameMixin):
 
     def dict(self):
         dat = {}
+        if self._type != self._default_type:
+            dat["type"] = self._type
         if self.name:
             dat["name"] = self.name
         if not self.solid:
@@ -160,8 +196,14 @@ class Material(NameMixin):
         return self.dispersion(lambda_F, lambda_d, lambda_C)
 
 
+Material.register(Material)
+
+
 @public
+@Material.register
 class ModelMaterial(Material):
+    _type = "model"
+
     def __init__(self, n=1., **kwargs):
         super(ModelMaterial, self).__init__(**kwargs)
         self.n = n
@@ -176,7 +218,10 @@ class ModelMaterial(Material):
 
 
 @public
+@Material.register
 class AbbeMaterial(Material):
+    _type = "abbe"
+
     def __init__(self, n=1., v=np.inf, lambda_ref=lambda_d,
                  lambda_long=lambda_C, lambda_short=lambda_F, **kwargs):
         super(AbbeMaterial, self).__init__(**kwargs)
@@ -221,7 +266,45 @@ class AbbeMaterial(Material):
 
 
 @public
+@Material.register
+class PerturbedMaterial(Material):
+    """`material` with the index changed by `dn` and the Abbe number
+    changed by `dv` (the dispersion around lambda_d is scaled)"""
+    _type = "perturbed"
+
+    def __init__(self, material, dn=0., dv=0., **kwargs):
+        material = Material.make(material)
+        kwargs.setdefault("name", material.name)
+        kwargs.setdefault("solid", material.solid)
+        kwargs.setdefault("mirror", material.mirror)
+        kwargs.setdefault("catalog", material.catalog)
+        super(PerturbedMaterial, self).__init__(**kwargs)
+        self.material = material
+        self.dn = dn
+        self.dv = dv
+
+    def refractive_index(self, wavelength):
+        n = self.material.refractive_index(wavelength)
+        if not self.dn and not self.dv:
+            return n
+        nd = self.material.nd
+        # keep the Abbe number (up to dv)
+        f = (nd + self.dn - 1)/(nd - 1)
+        if self.dv:
+            v = self.material.vd
+            f *= v/(v + self.dv)
+        return nd + self.dn + (n - nd)*f
+
+    def dict(self):
+        return {"type": self._type, "material": self.material.dict(),
+                "dn": float(self.dn), "dv": float(self.dv)}
+
+
+@public
+@Material.register
 class CoefficientsMaterial(Material):
+    _type = "coefficients"
+
     def __init__(self, coefficients, typ="sellmeier", **kwargs):
         super(CoefficientsMaterial, self).__init__(**kwargs)
         if not hasattr(self, "n_%s" % typ):
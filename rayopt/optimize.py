@@ -19,9 +19,14 @@
 from __future__ import (absolute_import, print_function,
                         unicode_literals, division)
 
-from fastcache import clru_cache
+import time
+from collections import OrderedDict
+
 import numpy as np
-from scipy.optimize import minimize
+
+from .utils import pupil_distribution
+from .geometric_trace import GeometricTrace
+from .instrument import timed, profiled
 
 
 class Variable:
@@ -66,6 +71,10 @@ class Operand:
         self.min = min
         self.max = max
 
+    def prepare(self):
+        """called after the variables have changed, before `get()`"""
+        pass
+
     def get(self):
         raise NotImplementedError
 
@@ -93,15 +102,55 @@ class FuncOp(Operand):
         return np.atleast_1d(self.func(self.system)).ravel()
 
 
-def optimize(variables, operands, callback=None, tol=1e-4, options={},
-             trace=False, **kwargs):
-    assert variables
-    assert operands
-    s = np.array([v.scale for v in variables])
-    x0 = np.array([v.get() for v in variables])/s
-    x1 = np.array([v.init for v in variables])/s
-    bounds = np.array([v.bounds for v in variables])/s[:, None]
+class MeritCache(object):
+    """LRU cache of the operand values `func(x)` keyed on the variable
+    vector `x` quantized to `quantum`.
 
+    Objective, constraint, callback and Jacobian evaluations at the
+    same point share one evaluation and one system update. The cache
+    holds `size` entries and grows (up to `maxsize`) whenever a
+    recently evicted point is requested again.
+    """
+    def __init__(self, func, size=4, maxsize=256, quantum=1e-10):
+        self.func = func
+        self.size = size
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self.cache = OrderedDict()
+        self.evicted = OrderedDict()
+        self.hits = self.misses = 0
+
+    def key(self, x):
+        # rounded floats do not overflow (+ 0. merges -0. and 0.)
+        return (np.round(np.asarray(x, np.float64)/self.quantum) +
+                0.).tobytes()
+
+    def __call__(self, x):
+        k = self.key(x)
+        try:
+            v = self.cache.pop(k)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            if self.evicted.pop(k, False) and self.size < self.maxsize:
+                self.size += 1
+            v = self.func(x)
+            while len(self.cache) >= self.size:
+                self.evicted[self.cache.popitem(last=False)[0]] = True
+                if len(self.evicted) > self.maxsize:
+                    self.evicted.popitem(last=False)
+        self.cache[k] = v
+        return v
+
+
+@timed("operands")
+def _evaluate(operands):
+    for op in operands:
+        op.prepare()
+    return [op.get() for op in operands]
+
+
+def _collect(operands):
     ob, eq, ineq = [], [], []
     for i, op in enumerate(operands):
         for obi in op.get_objective():
@@ -110,28 +159,54 @@ def optimize(variables, operands, callback=None, tol=1e-4, options={},
             eq.append((i, eqi))
         for ineqi in op.get_inequality():
             ineq.append((i, ineqi))
+    return ob, eq, ineq
+
+
+@profiled
+def optimize(variables, operands, callback=None, tol=1e-4, options={},
+             trace=False, checkpoint=None, history=None, resume=False,
+             **kwargs):
+    """Minimize the operands with `scipy.optimize.minimize()`.
+
+    With a `Checkpoint` the variables are saved periodically, `resume`
+    warm-starts from an existing checkpoint (the state of the scipy
+    method is not saved). A `History` receives one record per
+    iteration.
+    """
+    assert variables
+    assert operands
+    s = np.array([v.scale for v in variables])
+    x0 = np.array([v.get() for v in variables])/s
+    it = 0
+    if resume and checkpoint is not None and checkpoint.exists():
+        it = checkpoint.resume(variables).get("iteration", 0)
+    x1 = np.array([v.init for v in variables])/s
+    bounds = np.array([v.bounds for v in variables])/s[:, None]
+
+    ob, eq, ineq = _collect(operands)
     assert ob
 
     def up(x):
         for xi, vi in zip(x*s, variables):
             vi.set(xi)
 
-    @clru_cache(maxsize=len(variables) + 1)
-    def ex(*x):
+    def evaluate(x):
         up(x)
-        return [op.get() for op in operands]
+        return _evaluate(operands)
+
+    ex = MeritCache(evaluate, len(variables) + 1)
 
     def fun(x):
-        v = ex(*x)
+        v = ex(x)
         o = np.concatenate([obi(v[i]) for i, obi in ob])
         return np.square(o).sum()
 
     def feq(x):
-        v = ex(*x)
+        v = ex(x)
         return np.concatenate([eqi(v[i]) for i, eqi in eq])
 
     def fineq(x):
-        v = ex(*x)
+        v = ex(x)
         return np.concatenate([ineqi(v[i]) for i, ineqi in ineq])
 
     cons = []
@@ -141,16 +216,26 @@ def optimize(variables, operands, callback=None, tol=1e-4, options={},
         cons.append({"type": "ineq", "fun": fineq})
 
     xi, vi, fi = [], [], []
+    it = [it]
 
     def cb(x):
+        it[0] += 1
         if trace:
-            v = ex(*x)
+            v = ex(x)
             xi.append(x*s)
             vi.append(v)
             fi.append([obi(v[i]) for i, obi in ob])
+        if history is not None:
+            history.append(iteration=it[0], time=time.time(), x=x*s,
+                           merit=fun(x), nfev=ex.misses)
+        if checkpoint is not None and checkpoint.due(it[0]):
+            up(x)
+            checkpoint.save(x*s, {"iteration": it[0]},
+                            variables[0].system)
         if callback:
             return callback(x)
 
+    from scipy.optimize import minimize
     opts = dict(maxiter=100, eps=1e-5)
     opts.update(options)
     r = minimize(fun, x1, bounds=bounds, constraints=cons, callback=cb,
@@ -161,4 +246,345 @@ def optimize(variables, operands, callback=None, tol=1e-4, options={},
     r.trace_v = vi
     r.trace_f = [(i, np.array([fj[j] for fj in fi]))
                  for j, (i, obi) in enumerate(ob)]
+    r.cache = ex
     return r
+
+
+@profiled
+def dls(variables, operands, callback=None, tol=1e-6, maxiter=50,
+        damping=1e-3, eps=1e-5, penalty=1e2, trace=False,
+        checkpoint=None, history=None, resume=False):
+    """Damped least squares (Levenberg-Marquardt) optimization.
+
+    Works on the residual vector of the objectives and its forward
+    difference Jacobian (in units of the variable scales). Variables
+    pushed against their bounds are held there (active set), the other
+    steps are projected onto the bounds. The damping adapts to the
+    ratio of actual to predicted improvement. Equality and inequality
+    operands are quadratic penalties with weight `penalty` that is
+    increased tenfold (up to three times) while they are violated by
+    more than `tol` at convergence.
+
+    With a `Checkpoint` the variables, the damping and the penalty are
+    saved periodically, `resume` continues from an existing checkpoint.
+    A `History` receives one record per iteration.
+
+    Returns a `scipy.optimize.OptimizeResult` like `optimize()` with
+    the additional per iteration `trace_time` (elapsed time) and
+    `trace_nfev`.
+    """
+    assert variables
+    assert operands
+    s = np.array([v.scale for v in variables])
+    x0 = np.array([v.get() for v in variables])/s
+    state = {}
+    if resume and checkpoint is not None and checkpoint.exists():
+        state = checkpoint.resume(variables)
+    x = np.array([v.init for v in variables])/s
+    lo, hi = (np.array([v.bounds for v in variables])/s[:, None]).T
+    ob, eq, ineq = _collect(operands)
+    assert ob
+
+    def up(x):
+        for xi, vi in zip(x*s, variables):
+            vi.set(xi)
+
+    def evaluate(x):
+        up(x)
+        return _evaluate(operands)
+
+    ex = MeritCache(evaluate, len(variables) + 2)
+
+    def violation(v):
+        c = [eqi(v[i]) for i, eqi in eq]
+        c.extend(np.minimum(ineqi(v[i]), 0) for i, ineqi in ineq)
+        if c:
+            return np.concatenate(c)
+        return np.zeros(0)
+
+    def res(x, mu):
+        v = ex(x)
+        r = np.concatenate([obi(v[i]) for i, obi in ob])
+        return np.r_[r, mu**.5*violation(v)]
+
+    @timed("dls.jacobian")
+    def jac(x, r, mu):
+        j = np.empty((r.size, x.size))
+        for k in range(x.size):
+            h = eps if x[k] + eps <= hi[k] else -eps
+            xk = x.copy()
+            xk[k] += h
+            j[:, k] = (res(xk, mu) - r)/h
+        return j
+
+    x = np.clip(x, lo, hi)
+    t0 = time.time()
+    xi, vi, fi, ti, ni = [], [], [], [], []
+    lam = state.get("damping", damping)
+    nu = state.get("nu", 2.)
+    mu = state.get("penalty", penalty)
+    start = state.get("iteration", 0)
+    r = res(x, mu)
+    f = np.square(r).sum()
+    it, status, message = 0, 1, "maximum number of iterations"
+    for rounds in range(4):
+        while it < maxiter:
+            j = jac(x, r, mu)
+            g = np.dot(j.T, r)
+            a = np.dot(j.T, j)
+            d = np.diag(a).copy()
+            d = np.maximum(d, 1e-12*(d.max() or 1.))
+            # variables held at their bounds by the gradient
+            free = ~(((x <= lo) & (g > 0)) | ((x >= hi) & (g < 0)))
+            if not np.any(free) or np.fabs(g[free]).max() <= tol*(1 + f):
+                status, message = 0, "gradient below tolerance"
+                break
+            af = a[free][:, free] + lam*np.diag(d[free])
+            it += 1
+            while True:
+                dx = np.zeros_like(x)
+                dx[free] = np.linalg.solve(af, -g[free])
+                xn = np.clip(x + dx, lo, hi)
+                dx = xn - x
+                rn = res(xn, mu)
+                fn = np.square(rn).sum()
+                # predicted reduction of the linearized model
+                pred = f - np.square(r + np.dot(j, dx)).sum()
+                rho = (f - fn)/pred if pred > 0 else -1.
+                if np.isfinite(fn) and fn < f:
+                    lam *= max(1/3., 1 - (2*rho - 1)**3)
+                    nu = 2.
+                    break
+                af += (nu - 1)*lam*np.diag(d[free])
+                lam *= nu
+                nu *= 2
+                if np.all(np.fabs(dx) <= tol*(np.fabs(x) + tol)):
+                    break
+            step = np.fabs(dx).max()
+            improved = fn < f
+            if improved:
+                x, r, fp, f = xn, rn, f, fn
+            xi.append(x*s)
+            ti.append(time.time() - t0)
+            ni.append(ex.misses)
+            if history is not None:
+                history.append(iteration=start + it, time=time.time(),
+                               x=x*s, merit=f, nfev=ex.misses,
+                               damping=lam)
+            if checkpoint is not None and checkpoint.due(start + it):
+                up(x)
+                checkpoint.save(x*s, {"iteration": start + it,
+                                      "damping": lam, "nu": nu,
+                                      "penalty": mu},
+                                variables[0].system)
+            if trace:
+                v = ex(x)
+                vi.append(v)
+                fi.append([obi(v[i]) for i, obi in ob])
+            if callback and callback(x):
+                status, message = 2, "stopped by callback"
+                break
+            if not improved or step <= tol*(np.fabs(x).max() + tol):
+                status, message = 0, "step below tolerance"
+                break
+            if fp - f <= tol*f:
+                status, message = 0, "improvement below tolerance"
+                break
+        if status == 2 or not np.any(
+                np.fabs(violation(ex(x))) > tol) or it >= maxiter:
+            break
+        mu *= 10
+        r = res(x, mu)
+        f = np.square(r).sum()
+
+    from scipy.optimize import OptimizeResult
+    v = ex(x)
+    c = violation(v)
+    rr = OptimizeResult(
+        x=x, fun=np.square(np.concatenate(
+            [obi(v[i]) for i, obi in ob])).sum(),
+        maxcv=np.fabs(c).max() if c.size else 0.,
+        nit=it, nfev=ex.misses, status=status, message=message,
+        success=status == 0, damping=lam, penalty=mu)
+    rr.accept = lambda: up(rr.x)
+    rr.reject = lambda: up(x0)
+    rr.trace_x = np.array(xi)
+    rr.trace_v = vi
+    rr.trace_f = [(i, np.array([fj[k] for fj in fi]))
+                  for k, (i, obi) in enumerate(ob)]
+    rr.trace_time = np.array(ti)
+    rr.trace_nfev = np.array(ni)
+    rr.cache = ex
+    return rr
+
+
+class MeritEvaluator(object):
+    """Shared geometric trace for `RayOperand`s.
+
+    Operands declare the rays they need (field, wavelength, pupil
+    coordinates). Once per evaluation the rays are aimed once per
+    field and wavelength and traced in one batch per wavelength. Every
+    operand then evaluates a `GeometricTrace.view()` of its rays.
+
+    Use one evaluator per configuration.
+    """
+    def __init__(self, system, update=True, clip=False, stop=None):
+        self.system = system
+        self.update = update
+        self.clip = clip
+        self.stop = stop
+        self.requests = []
+        self.traces = {}
+        self.valid = False
+        self.count = 0
+        self._groups = None
+
+    def add(self, field, wavelength, yp, weight=None, ref=0):
+        """register rays at pupil coordinates yp (n, 2) and return the
+        request index"""
+        if wavelength is None:
+            wavelength = self.system.wavelengths[0]
+        field = tuple(float(f) for f in np.broadcast_to(field, (2,)))
+        yp = np.atleast_2d(yp).astype(np.float64)
+        if weight is None:
+            weight = np.ones(yp.shape[0])/yp.shape[0]
+        self.requests.append((field, float(wavelength), yp,
+                              np.asarray(weight), ref))
+        self._groups = None
+        self.valid = False
+        return len(self.requests) - 1
+
+    def invalidate(self):
+        self.valid = False
+
+    def _layout(self):
+        # wavelength: field: request indices
+        groups = {}
+        for j, (field, l, yp, w, ref) in enumerate(self.requests):
+            groups.setdefault(l, {}).setdefault(field, []).append(j)
+        self._groups = []
+        self._slices = {}
+        for l in sorted(groups):
+            fields, n = [], 0
+            for field in sorted(groups[l]):
+                yp = []
+                for j in groups[l][field]:
+                    m = self.requests[j][2].shape[0]
+                    self._slices[j] = l, slice(n, n + m)
+                    yp.append(self.requests[j][2])
+                    n += m
+                fields.append((field, np.concatenate(yp)))
+            self._groups.append((l, fields, n))
+
+    def trace(self):
+        """aim and trace all requested rays unless already done for the
+        current state"""
+        if not self.valid:
+            self._trace()
+
+    @timed("merit.trace")
+    def _trace(self):
+        if self._groups is None:
+            self._layout()
+        if self.update:
+            self.system.update()
+        for l, fields, n in self._groups:
+            y, u = np.empty((n, 3)), np.empty((n, 3))
+            k = 0
+            for field, yp in fields:
+                z, p = self.system.pupil(field, l=l, stop=self.stop)
+                m = yp.shape[0]
+                y[k:k + m], u[k:k + m] = self.system.aim(
+                    field, yp, z, p, filter=False)
+                k += m
+            t = self.traces.get(l)
+            if t is None:
+                t = self.traces[l] = GeometricTrace(self.system)
+            t.rays_given(y, u, l)
+            t.propagate(clip=self.clip)
+            self.count += 1
+        self.valid = True
+
+    def view(self, j):
+        """the trace of the rays of request j"""
+        self.trace()
+        field, l, yp, w, ref = self.requests[j]
+        l, rays = self._slices[j]
+        return self.traces[l].view(rays, w, ref)
+
+
+class RayOperand(Operand):
+    """operand evaluated on rays of a shared `MeritEvaluator` trace"""
+    def __init__(self, evaluator, *args, **kwargs):
+        super(RayOperand, self).__init__(evaluator.system, *args, **kwargs)
+        self.evaluator = evaluator
+        self.requests = [evaluator.add(*r) for r in self.rays()]
+
+    def rays(self):
+        """the ray requests `(field, wavelength, yp, weight, ref)`"""
+        raise NotImplementedError
+
+    def prepare(self):
+        self.evaluator.invalidate()
+
+    def get(self):
+        return np.atleast_1d(self.evaluate(
+            *[self.evaluator.view(j) for j in self.requests])).ravel()
+
+    def evaluate(self, *traces):
+        raise NotImplementedError
+
+
+class PupilOperand(RayOperand):
+    """ray operand for a pupil distribution at one field and
+    wavelength"""
+    def __init__(self, evaluator, field=(0, 0), wavelength=None,
+                 distribution="hexapolar", nrays=30, *args, **kwargs):
+        self.field = field
+        self.wavelength = wavelength
+        self.distribution = distribution
+        self.nrays = nrays
+        super(PupilOperand, self).__init__(evaluator, *args, **kwargs)
+
+    def rays(self):
+        ref, yp, weight = pupil_distribution(self.distribution, self.nrays)
+        yield self.field, self.wavelength, yp, weight, ref
+
+
+def _weighted_rms(v, w):
+    # rms of v (n, ...) about the weighted mean, ignoring lost rays
+    good = np.all(np.isfinite(v.reshape(v.shape[0], -1)), axis=1)
+    v, w = v[good], w[good]
+    if not w.size:
+        return np.nan
+    v = v - np.dot(w, v.reshape(v.shape[0], -1)).reshape(
+        v.shape[1:])/w.sum()
+    r = np.square(v).reshape(v.shape[0], -1).sum(1)
+    return np.sqrt(np.dot(w, r)/w.sum())
+
+
+class RmsSpotOp(PupilOperand):
+    """rms spot radius on the image about the centroid"""
+    def evaluate(self, t):
+        return _weighted_rms(t.y[-1, :, :2], t.w)
+
+
+class RmsWavefrontOp(PupilOperand):
+    """rms wavefront error (in waves, piston removed) with respect to
+    the chief ray"""
+    def evaluate(self, t):
+        x, y, o = t.opd(resample=False)
+        return _weighted_rms(o, t.w)
+
+
+def default_merit(evaluator, fields=(0., .7, 1.), wavelengths=None,
+                  kind="spot", nrays=30, weight=1., **kwargs):
+    """Zemax-style default merit function: rms spot radius or rms
+    wavefront error operands over a pupil grid for each (relative
+    meridional) field height and wavelength, all evaluated on one
+    shared trace"""
+    op = {"spot": RmsSpotOp, "wavefront": RmsWavefrontOp}[kind]
+    if wavelengths is None:
+        wavelengths = evaluator.system.wavelengths
+    return [op(evaluator, (0, h), l, nrays=nrays, weight=weight, **kwargs)
+            for h in fields for l in wavelengths]
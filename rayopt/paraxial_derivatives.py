@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import numpy as np
+
+from .utils import public
+from .paraxial_trace import object_rays
+
+
+@public
+class ParaxialDerivatives(object):
+    """Derivatives of the paraxial rays, first order properties and
+    Seidel coefficients with respect to the construction parameters.
+
+    `parameters` is a list of `(element index, kind)` with kind one of
+    "curvature", "distance" (the thickness before the element) or
+    "index" (the refractive index after the element at the first
+    wavelength). By default these are all curvatures, distances and
+    (non-mirror) indices of all elements after the object.
+
+    All derivatives are computed in a single forward pass through the
+    coaxial paraxial matrices with one complex step lane per
+    parameter. Complex step differentiation involves no subtraction
+    and is exact to machine precision.
+
+    The chief ray is re-aimed through the center of the stop if the
+    object pupil distance is updated and the marginal ray is scaled to
+    the stop radius if the object pupil radius is updated (as
+    `System.update()` does). The object field and the remaining
+    aperture specification are held fixed.
+
+    As in the paraxial matrices, decenters are ignored. Tilted
+    elements are not supported.
+
+    Results have the parameter as the last axis:
+    n[i], y[i, ray], u[i, ray] with ray (marginal, chief),
+    c[i, seidel], focal_length[2], magnification[2],
+    transverse3[i, seidel]. Their values are in `value`, a dict of the
+    same names.
+    """
+    def __init__(self, system, parameters=None, h=1e-20, update=True):
+        self.system = system
+        if parameters is None:
+            parameters = list(self.default_parameters(system))
+        self.parameters = parameters
+        self.h = h
+        if update:
+            self.update()
+
+    @staticmethod
+    def default_parameters(system):
+        for i, el in enumerate(system[1:]):
+            i += 1
+            if hasattr(el, "curvature"):
+                yield i, "curvature"
+            yield i, "distance"
+            if (getattr(el, "material", None) is not None and
+                    not el.material.mirror):
+                yield i, "index"
+
+    def update(self):
+        self.propagate()
+        self.aim()
+        self.aberrations()
+        self.properties()
+        self.value = {}
+        for k in "n y u c focal_length magnification transverse3".split():
+            v = getattr(self, k)
+            self.value[k] = v[..., 0].real
+            setattr(self, k, v.imag/self.h)
+
+    def perturbation(self, i, kind):
+        p = np.zeros(len(self.parameters), np.complex128)
+        for j, pj in enumerate(self.parameters):
+            if pj == (i, kind):
+                p[j] = 1j*self.h
+        return p
+
+    def propagate(self):
+        s = self.system
+        l = s.wavelengths[0]
+        k, m = len(s), len(self.parameters)
+        self.n = np.empty((k, m), np.complex128)
+        self.y = np.empty((k, 3, m), np.complex128)
+        self.u = np.empty_like(self.y)
+        self.curvature = np.zeros((k, m), np.complex128)
+        n = s.refractive_index(l, 0)*np.ones(m, np.complex128)
+        # marginal, chief, pupil distance auxiliary
+        (y0, y1), (u0, u1) = object_rays(s.object, n[0].real)
+        aux = (0., 1.) if s.object.finite else (1., 0.)
+        y = np.array([y0, y1, aux[0]])[:, None]*np.ones(m)
+        u = np.array([u0, u1, aux[1]])[:, None]*np.ones(m)
+        self.n[0], self.y[0], self.u[0] = n, y, u
+        for i, el in enumerate(s[1:]):
+            i += 1
+            if not el.normal:
+                raise ValueError("element %i is tilted" % i)
+            d = el.distance + self.perturbation(i, "distance")
+            y = y + d/n*u
+            n0 = n
+            material = getattr(el, "material", None)
+            if material is not None:
+                n = (el.refractive_index(l) +
+                     self.perturbation(i, "index"))
+            if hasattr(el, "curvature"):
+                c = el.curvature + self.perturbation(i, "curvature")
+                self.curvature[i] = c
+                if el.aspherics:
+                    c = c + 2*el.aspherics[0]
+                if material is not None and material.mirror:
+                    u = u + 2*c*y
+                else:
+                    u = u + c*(n0 - n)*y
+            self.n[i], self.y[i], self.u[i] = n, y, u
+
+    def aim(self):
+        s, i = self.system.object, self.system.stop
+        y, u = self.y, self.u
+        if s.pupil.update_distance:
+            a = -y[i, 1]/y[i, 2]
+            y[:, 1] += a*y[:, 2]
+            u[:, 1] += a*u[:, 2]
+        if s.pupil.update_radius:
+            r = self.system[i].radius*np.sign(y[i, 0].real)
+            b = r/y[i, 0]
+            y[:, 0] *= b
+            u[:, 0] *= b
+        self.y, self.u = y[:, :2], u[:, :2]
+
+    def aberrations(self):
+        s = self.system
+        self.c = np.zeros((len(s), 7, len(self.parameters)),
+                          np.complex128)
+        v = 0
+        l1, l2 = min(s.wavelengths), max(s.wavelengths)
+        for i, el in enumerate(s[1:]):
+            i += 1
+            v0, v = v, el.dispersion(l1, l2)
+            c = el.aberration(self.y[i], self.u[i - 1], self.u[i],
+                              self.n[i - 1], self.n[i], v0, v,
+                              curvature=self.curvature[i])
+            if np.ndim(c):
+                self.c[i] = np.broadcast_arrays(*c)
+
+    def properties(self):
+        y, u, n = self.y, self.u, self.n
+        lagrange = u[0, 0]*y[0, 1] - u[0, 1]*y[0, 0]
+        f = lagrange/(u[0, 1]*u[-2, 0] - u[0, 0]*u[-2, 1])
+        self.focal_length = f*n[(-2, 0), ]*np.array([-1, 1])[:, None]
+        mt = u[0, 0]/u[-2, 0]
+        ma = u[-2, 1]*n[0]/(u[0, 1]*n[-2])
+        self.magnification = np.array([mt, ma])
+        # |image height|, analytically continued
+        h = y[-1, 1]*np.sign(y[-1, 1].real)
+        self.transverse3 = self.c*h
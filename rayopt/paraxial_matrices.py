@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import numpy as np
+
+from .utils import public
+
+
+@public
+class ParaxialMatrices(object):
+    """Stacked paraxial matrices of the elements of a system at one
+    wavelength and their cumulative products.
+
+    m[i]: matrix of element i (the identity for the object)
+    n[i]: refractive index after element i
+    prefix[i]: m[i]...m[1], transfer from after the object to after i
+    suffix[i]: m[-1]...m[i], transfer from before i to the image
+
+    After the O(N) construction, the transfer matrix of a range of
+    elements starting after the object or ending at the image is
+    obtained in O(1) with `product()`, other ranges are multiplied
+    from the stored element matrices.
+
+    `state` is a list of the element states (`paraxial_state()`)
+    that the matrices were built with. It allows checking whether the
+    matrices are still valid.
+    """
+    def __init__(self, system, l):
+        k = len(system)
+        self.state = [e.paraxial_state(l) for e in system]
+        self.n = np.empty(k)
+        self.m = np.empty((k, 4, 4))
+        self.n[0] = n = system.refractive_index(l, 0)
+        self.m[0] = np.eye(4)
+        for i in range(1, k):
+            n, self.m[i] = system[i].paraxial_matrix(n, l)
+            self.n[i] = n
+        self.prefix = np.empty_like(self.m)
+        self.prefix[0] = self.m[0]
+        for i in range(1, k):
+            self.prefix[i] = np.dot(self.m[i], self.prefix[i - 1])
+        self.suffix = np.empty((k + 1, 4, 4))
+        self.suffix[k] = np.eye(4)
+        for i in range(k - 1, 0, -1):
+            self.suffix[i] = np.dot(self.suffix[i + 1], self.m[i])
+        self.suffix[0] = self.suffix[1]
+
+    def valid(self, system, l):
+        return self.state == [e.paraxial_state(l) for e in system]
+
+    def product(self, start=1, stop=None):
+        """refractive index after and transfer matrix through the
+        elements `start:stop` (slice semantics, `start >= 1`)"""
+        start, stop, step = slice(start, stop).indices(self.n.shape[0])
+        if start >= stop:
+            return 1., np.eye(4)
+        assert start >= 1, start
+        n = self.n[stop - 1]
+        if start == 1:
+            return n, self.prefix[stop - 1].copy()
+        if stop == self.n.shape[0]:
+            return n, self.suffix[start].copy()
+        m = self.m[start]
+        for mi in self.m[start + 1:stop]:
+            m = np.dot(mi, m)
+        return n, m.copy()
@@ -25,6 +25,23 @@ import numpy as np
 
 from .utils import sinarctan, tanarcsin, public
 from .raytrace import Trace
+from .instrument import timed
+
+
+def object_rays(o, n0):
+    """paraxial marginal and chief ray heights and reduced angles
+    `(y, u)` at object `o` in medium `n0`"""
+    if o.finite:
+        y = 0, -o.radius
+        u = n0*o.pupil.slope, n0*o.slope
+    else:
+        if o.wideangle:
+            c = 1.
+        else:
+            c = np.tan(o.angle)
+        y = o.pupil.radius, -o.slope*o.pupil.distance
+        u = 0, n0*c
+    return y, u
 
 
 @public
@@ -46,6 +63,7 @@ class ParaxialTrace(Trace):
         if update:
             self.update()
 
+    @timed("paraxial")
     def update(self):
         self.allocate()
         self.rays()
@@ -68,18 +86,7 @@ class ParaxialTrace(Trace):
 
     def rays(self):
         self.n[0] = n0 = self.system.refractive_index(self.wavelength, 0)
-        y, u = self.y, self.u
-        o = self.system.object
-        if o.finite:
-            y[0] = 0, -o.radius
-            u[0] = n0*o.pupil.slope, n0*o.slope
-        else:
-            if o.wideangle:
-                c = 1.
-            else:
-                c = np.tan(o.angle)
-            y[0] = o.pupil.radius, -o.slope*o.pupil.distance
-            u[0] = 0, n0*c
+        self.y[0], self.u[0] = object_rays(self.system.object, n0)
 
     def propagate(self, start=1, stop=None):
         super(ParaxialTrace, self).propagate()
@@ -322,6 +329,83 @@ class ParaxialTrace(Trace):
               )/(m0[1, 1]*m2[0, 0])
         self.system[i].curvature = c/(n0 - n)*n
 
+    def solve(self, kind, path=None, target=0., at=None):
+        """closed form paraxial solve: sets the curvature or distance of
+        an element (`path` is `(i, "curvature")` or `(i, "distance")`)
+        such that the quantity `kind` equals `target`
+
+        `kind` is one of "marginal_height", "chief_height" (ray height
+        at element `at`, default `i`), "marginal_angle", "chief_angle"
+        (reduced angle after element `at`, default `i`),
+        "focal_length" (image side, as `focal_length[1]`) or
+        "image_distance" (marginal height at the image, `path`
+        defaults to the image distance).
+
+        All these are affine in the element's curvature and distance.
+        They are evaluated with the cached paraxial matrices and the
+        object rays at the current conjugates. If pickups depend on
+        `path`, they are run for each evaluation and the solution is
+        found with Newton's method.
+        """
+        system = self.system
+        if kind == "image_distance":
+            kind, at = "marginal_height", -1
+            if path is None:
+                path = -1, "distance"
+        i, name = path
+        if name not in ("curvature", "distance"):
+            raise ValueError("can not solve for %s" % name)
+        k = len(system)
+        i %= k
+        if kind == "focal_length":
+            at = -2
+        elif at is None:
+            at = i
+        at %= k
+        if not 1 <= i <= at:
+            raise ValueError("element %i does not affect %i" % (i, at))
+        l = self.wavelength
+        n0 = system.refractive_index(l, 0)
+        y0, u0 = object_rays(system.object, n0)
+        ray0 = np.zeros((4, 2))
+        ray0[self.axis], ray0[2 + self.axis] = y0, u0
+        p = system.paraxial_products(l)
+        ray = np.dot(p.prefix[i - 1], ray0)
+        after = p.product(i + 1, at + 1)[1]
+        if kind == "focal_length":
+            target = (u0[0]*y0[1] - u0[1]*y0[0])*n0/target
+        e = system[i]
+        pickups = system.dependent_pickups((i, name))
+
+        def value(x):
+            setattr(e, name, x)
+            if pickups:
+                for run in pickups:
+                    run(system)
+                yu = np.dot(system.paraxial_products(l).prefix[at], ray0)
+            else:
+                m = e.paraxial_matrix(p.n[i - 1], l)[1]
+                yu = np.dot(after, np.dot(m, ray))
+            y, u = yu[self.axis], yu[2 + self.axis]
+            if kind == "focal_length":
+                return u0[1]*u[0] - u0[0]*u[1]
+            r, q = kind.split("_")
+            return {"height": y, "angle": u}[q][
+                ("marginal", "chief").index(r)]
+
+        x0 = getattr(e, name)
+        v0 = value(x0)
+        slope = value(x0 + 1.) - v0
+        if not abs(slope) > 1e-12*max(1., abs(v0)):
+            value(x0)
+            raise ValueError("%s does not depend on %s" % (kind, path))
+        x = x0 + (target - v0)/slope
+        if pickups:
+            from scipy.optimize import newton
+            x = newton(lambda x: value(x) - target, x, tol=1e-12)
+        value(x)
+        return x
+
     def refocus(self, idx=-1):
         self.system[idx].distance = \
             -self.n[idx - 1]*self.y[idx - 1, 0]/self.u[idx - 1, 0]
@@ -358,3 +442,133 @@ class ParaxialTrace(Trace):
         u = tanarcsin(u)
         y, u = np.dot(m, (y[0, 1], u[0, 1]))
         self.system[ai].radius = y
+
+
+@public
+class ParaxialBatch(object):
+    """Paraxial marginal and chief ray traces, first order properties
+    and Seidel coefficients of one or several systems
+    (configurations, all of the same length) at several wavelengths at
+    once.
+
+    The arrays have leading (configuration, wavelength) axes and are
+    otherwise laid out as in `ParaxialTrace`: n[c, w, i], y[c, w, i,
+    (marginal, chief)], u[c, w, i, (marginal, chief)] (reduced
+    angles), c[c, w, i, seidel]. The first order properties have the
+    (object, image) pair as last axis.
+
+    All rays are propagated in one vectorized product with the cached
+    cumulative paraxial matrices of the systems
+    (`System.paraxial_products()`). The Seidel coefficients at each
+    wavelength use the rays traced at that wavelength.
+    """
+    def __init__(self, systems, wavelengths=None, axis=1, update=True):
+        if hasattr(systems, "wavelengths"):
+            systems = [systems]
+        # any sequence, e.g. Configurations
+        self.systems = systems
+        if wavelengths is None:
+            wavelengths = self.systems[0].wavelengths
+        self.wavelengths = np.atleast_1d(wavelengths).astype(np.float64)
+        self.axis = axis
+        if update:
+            self.update()
+
+    def update(self):
+        self.propagate()
+        self.aberrations()
+
+    def propagate(self):
+        k = len(self.systems[0])
+        assert all(len(s) == k for s in self.systems), \
+            "configurations differ in length"
+        shape = len(self.systems), self.wavelengths.shape[0]
+        self.n = np.empty(shape + (k, ))
+        p = np.empty(shape + (k, 4, 4))
+        yu = np.empty(shape + (4, 2))
+        for i, s in enumerate(self.systems):
+            for j, l in enumerate(self.wavelengths):
+                m = s.paraxial_products(l)
+                p[i, j] = m.prefix
+                self.n[i, j] = m.n
+                y, u = object_rays(s.object, m.n[0])
+                # FIXME not really round for gen astig...
+                yu[i, j] = y, y, u, u
+        yu = np.einsum("...kij,...jl->...kil", p, yu)
+        self.y = yu[..., self.axis, :]
+        self.u = yu[..., 2 + self.axis, :]
+
+    def aberrations(self):
+        self.c = np.zeros(self.y.shape[:3] + (7, ))
+        for k, s in enumerate(self.systems):
+            v = 0
+            l1, l2 = min(s.wavelengths), max(s.wavelengths)
+            y, u, n = self.y[k].T, self.u[k].T, self.n[k].T
+            for i, el in enumerate(s[1:]):
+                i += 1
+                v0, v = v, el.dispersion(l1, l2)
+                c = el.aberration(y[:, i], u[:, i - 1], u[:, i],
+                                  n[i - 1], n[i], v0, v)
+                if np.ndim(c):
+                    self.c[k, :, i] = np.array(
+                        np.broadcast_arrays(*c)).T
+
+    @property
+    def seidel(self):
+        """sums of the Seidel coefficients"""
+        return self.c.sum(-2)
+
+    @property
+    def lagrange(self):
+        u, y = self.u[..., 0, :], self.y[..., 0, :]
+        return u[..., 0]*y[..., 1] - u[..., 1]*y[..., 0]
+
+    @property
+    def focal_length(self):
+        u = self.u
+        f = self.lagrange/(u[..., 0, 1]*u[..., -2, 0] -
+                           u[..., 0, 0]*u[..., -2, 1])
+        return f[..., None]*self.n[..., (-2, 0)]*(-1, 1)
+
+    @property
+    def focal_distance(self):
+        y, u = self.y, self.u
+        c = (self.focal_length/self.lagrange[..., None] /
+             self.n[..., (-2, 0)])
+        return (y[..., (1, -2), 1]*u[..., (-2, 0), 0] -
+                y[..., (1, -2), 0]*u[..., (-2, 0), 1])*c
+
+    @property
+    def principal_distance(self):
+        return self.focal_distance - self.focal_length
+
+    @property
+    def pupil_distance(self):
+        return (-self.y[..., (1, -2), 1]/self.u[..., (0, -2), 1] *
+                self.n[..., (0, -2)])
+
+    @property
+    def pupil_height(self):
+        p = self.pupil_distance
+        return np.fabs(self.y[..., (1, -2), 0] + p *
+                       self.u[..., (0, -2), 0]/self.n[..., (0, -2)])
+
+    @property
+    def magnification(self):
+        u, n = self.u, self.n
+        mt = u[..., 0, 0]/u[..., -2, 0]
+        ma = u[..., -2, 1]*n[..., 0]/(u[..., 0, 1]*n[..., -2])
+        return np.stack((mt, ma), -1)
+
+    @property
+    def focal_shift(self):
+        """axial color: back focal distance relative to the first
+        wavelength"""
+        f = self.focal_distance[..., 1]
+        return f - f[:, :1]
+
+    @property
+    def lateral_color(self):
+        """chief ray image height relative to the first wavelength"""
+        y = self.y[..., -1, 1]
+        return y - y[:, :1]
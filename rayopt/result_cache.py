@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Content addressed on-disk cache of analysis results.
+
+Results (the namedtuples from `rayopt.evaluation`) are keyed on a hash
+of the system prescription (`System.dict()`), the function and its
+parameters and are stored as compressed `.npz` files. The least
+recently used entries are evicted once the cache exceeds `max_size`
+bytes.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import os
+import io
+import json
+import site
+import hashlib
+import importlib
+
+import numpy as np
+
+from .utils import public
+from . import evaluation
+
+
+def _hash(dat):
+    dat = json.dumps(dat, sort_keys=True, default=float)
+    return hashlib.sha1(dat.encode("utf-8")).hexdigest()
+
+
+@public
+def fingerprint(system):
+    """stable hash of the system prescription"""
+    return _hash(system.dict())
+
+
+@public
+class ResultCache(object):
+    version = 1
+
+    def __init__(self, path=None, max_size=256*2**20):
+        if path is None:
+            path = os.path.join(site.getuserbase(), "rayopt", "cache")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        # running estimate of the size, None until the first put()
+        self._size = None
+
+    def key(self, system, func, args=()):
+        """cache key for `func(system, *args)`, `system` can also be
+        its fingerprint"""
+        if hasattr(system, "dict"):
+            system = fingerprint(system)
+        return _hash([system, self.version, func.__module__,
+                      func.__name__, list(args)])
+
+    def filename(self, key):
+        return os.path.join(self.path, "%s.npz" % key)
+
+    def get(self, key):
+        """the cached result for `key`, raises KeyError if absent"""
+        fil = self.filename(key)
+        try:
+            with np.load(fil, allow_pickle=False) as dat:
+                dat = dict(dat.items())
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            raise KeyError(key)
+        os.utime(fil, None)
+        self.hits += 1
+        typ = str(dat.pop("type")[()])
+        if not typ:
+            return None
+        module, _, typ = typ.rpartition(".")
+        if not module:
+            module = evaluation
+        elif module.startswith("rayopt."):
+            module = importlib.import_module(module)
+        else:
+            raise KeyError(key)
+        typ = getattr(module, typ)
+        return typ(**dict((k, v[()] if v.ndim == 0 else v)
+                          for k, v in dat.items()))
+
+    def put(self, key, value):
+        """store the result `value` (a namedtuple of arrays from
+        `rayopt.evaluation` or another rayopt module, or None)"""
+        if value is None:
+            dat = {"type": ""}
+        else:
+            dat = value._asdict()
+            typ = type(value)
+            dat["type"] = typ.__name__
+            if typ.__module__ != evaluation.__name__:
+                dat["type"] = "%s.%s" % (typ.__module__, typ.__name__)
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **dat)
+        fil = self.filename(key)
+        tmp = "%s.%i.tmp" % (fil, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        if self._size is None:
+            self._size = self.size
+        try:
+            self._size -= os.stat(fil).st_size
+        except OSError:
+            pass
+        os.replace(tmp, fil)
+        self._size += len(buf.getvalue())
+        if self._size > self.max_size:
+            self.evict()
+
+    def __call__(self, func, system, *args):
+        """`func(system, *args)`, cached"""
+        key = self.key(system, func, args)
+        try:
+            return self.get(key)
+        except KeyError:
+            value = func(system, *args)
+            self.put(key, value)
+            return value
+
+    def entries(self):
+        """(mtime, size, filename) of all entries, oldest first"""
+        e = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".npz"):
+                continue
+            fil = os.path.join(self.path, name)
+            try:
+                st = os.stat(fil)
+            except OSError:
+                continue
+            e.append((st.st_mtime, st.st_size, fil))
+        e.sort()
+        return e
+
+    @property
+    def size(self):
+        return sum(s for t, s, f in self.entries())
+
+    def evict(self, max_size=None):
+        """remove the least recently used entries until the cache is
+        smaller than `max_size`
+
+        `put()` only evicts once its running size estimate exceeds
+        `max_size`."""
+        if max_size is None:
+            max_size = self.max_size
+        e = self.entries()
+        size = sum(s for t, s, f in e)
+        for t, s, f in e:
+            if size <= max_size:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            size -= s
+        self._size = size
+
+    def clear(self):
+        self.evict(0)
@@ -20,18 +20,205 @@ from __future__ import (absolute_import, print_function,
                         unicode_literals, division)
 
 import itertools
+import re
 
 import numpy as np
-from scipy.optimize import newton, brentq
 from fastcache import clru_cache
 
 from .elements import Element
 from .conjugates import Conjugate, FiniteConjugate, InfiniteConjugate
-from .material import fraunhofer
+from .material import Material, fraunhofer
 from .utils import public
 from .cachend import PolarCacheND
 from .paraxial_trace import ParaxialTrace
+from .paraxial_matrices import ParaxialMatrices
 from .pupils import RadiusPupil
+from .instrument import timed, count, enabled
+
+
+def _path_code(path):
+    code = "self"
+    for k in path:
+        if isinstance(k, str):
+            if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", k):
+                return None
+            code += ".%s" % k
+        else:
+            code += "[%i]" % k
+    return code
+
+
+def _getter(path):
+    """compiled `system.get_path(path)`"""
+    code = _path_code(path)
+    if code is None:
+        return lambda self: self.get_path(path)
+    return eval("lambda self: %s" % code)
+
+
+def _setter(path):
+    """compiled `system.set_path(path, value)`"""
+    code = _path_code(path)
+    if code is None:
+        return lambda self, value: self.set_path(path, value)
+    ns = {}
+    exec("def setter(self, value):\n    %s = value\n" % code, ns)
+    return ns["setter"]
+
+
+def _normalize_path(path, n):
+    path = tuple(path)
+    if path and not isinstance(path[0], str):
+        path = (path[0] % n,) + path[1:]
+    return path
+
+
+def _overlap(a, b):
+    """whether changing path a can change path b or vice versa
+
+    Paths are compared per element (or per system attribute) as
+    different attributes of an element may alias the same state
+    (e.g. `distance`, `offset` and `direction`)."""
+    return a[:1] == b[:1]
+
+
+def _compile_pickup(pickup, n):
+    """returns the pickup function and the paths it reads and writes
+    (None if unknown)"""
+    get = ev = func = put = ex = None
+    reads = writes = None
+    if "get" in pickup:
+        get = _getter(pickup["get"])
+        reads = _normalize_path(pickup["get"], n)
+        if not reads or isinstance(reads[0], str):
+            reads = None  # derived from the entire system
+    if "get_eval" in pickup:
+        ev = compile(pickup["get_eval"], "<pickup>", "eval")
+        reads = None
+    if "get_func" in pickup:
+        func = eval(pickup["get_func"])
+        reads = None
+    if "set" in pickup:
+        put = _setter(pickup["set"])
+        writes = _normalize_path(pickup["set"], n)
+    if "set_exec" in pickup:
+        ex = compile(pickup["set_exec"], "<pickup>", "exec")
+        writes = None
+
+    def run(self):
+        value = None
+        if get:
+            value = get(self)
+        if ev:
+            value = eval(ev, globals(),
+                         dict(self=self, pickup=pickup, value=value))
+        if func:
+            value = func(self, pickup, value)
+        if "factor" in pickup:
+            value = value * pickup["factor"]
+        if "offset" in pickup:
+            value = value + pickup["offset"]
+        if put:
+            put(self, value)
+        if ex:
+            exec(ex, globals(), dict(self=self, pickup=pickup, value=value))
+    return run, reads, writes
+
+
+def _compile_solve(solve, n):
+    if "paraxial" in solve:
+        changed = solve.get("set")
+        if changed is None and solve["paraxial"] == "image_distance":
+            changed = -1, "distance"
+
+        def run(self):
+            self.paraxial.solve(solve["paraxial"], changed,
+                                solve.get("target", 0.), solve.get("at"))
+            self.pickup(changed)
+        return run
+    changed = init = None
+    if "get" in solve:
+        getter = _getter(solve["get"])
+    elif "get_eval" in solve:
+        code = compile(solve["get_eval"], "<solve>", "eval")
+
+        def getter(self):
+            return eval(code, globals(), dict(self=self, solve=solve))
+    elif "get_func" in solve:
+        def getter(self):
+            return solve["get_func"](self, solve)
+    if "set" in solve:
+        setter = _setter(solve["set"])
+        init = _getter(solve["set"])
+        changed = solve["set"]
+    elif "set_exec" in solve:
+        code = compile(solve["set_exec"], "<solve>", "exec")
+
+        def setter(self, value):
+            exec(code, globals(), dict(value=value, self=self, solve=solve))
+    elif "set_func" in solve:
+        def setter(self, x):
+            solve["set_func"](self, solve, x)
+
+    def run(self):
+        target = solve.get("target", 0.)
+        if "init" in solve:
+            x0 = solve["init"]
+        elif init is not None:
+            x0 = init(self)
+        else:
+            x0 = 0.
+
+        def func(x):
+            setter(self, x)
+            self.pickup(changed)
+            return getter(self) - target
+
+        from scipy.optimize import newton
+        x = newton(func, x0, tol=solve.get("tol", 1e-8),
+                   maxiter=solve.get("maxiter", 20))
+        func(x)
+        if "init_current" in solve:
+            solve["init"] = float(x)
+    return run
+
+
+def _compile_validator(validator):
+    get = ev = func = ex = put = None
+    if "get" in validator:
+        get = _getter(validator["get"])
+        put = _setter(validator["get"])
+    if "get_eval" in validator:
+        ev = compile(validator["get_eval"], "<validator>", "eval")
+    if "get_func" in validator:
+        func = eval(validator["get_func"])
+    if "exec" in validator:
+        ex = compile(validator["exec"], "<validator>", "exec")
+
+    def run(self, fix):
+        value = None
+        if get:
+            value = get(self)
+        if ev:
+            value = eval(ev, globals(), dict(
+                self=self, validator=validator, value=value, fix=fix))
+        if func:
+            value = func(self, validator, value)
+        if ex:
+            exec(ex, globals(), dict(
+                self=self, validator=validator, value=value, fix=fix))
+        for k, op in ("minimum", "<"), ("maximum", ">"), ("equality", "!="):
+            if k not in validator:
+                continue
+            v = validator[k]
+            if ((op == "<" and value < v) or (op == ">" and value > v) or
+                    (op == "!=" and value != v)):
+                if fix and put:
+                    put(self, v)
+                else:
+                    raise ValueError("%s %s %s (%s)" %
+                                     (value, op, v, validator))
+    return run
 
 
 @public
@@ -40,7 +227,10 @@ class System(list):
                  wavelengths=None, stop=1, fields=None,
                  object=None, image=None,
                  pickups=None, validators=None, solves=None):
-        elements = [Element.make(_) for _ in elements or []]
+        elements = elements or []
+        Material.prefetch(e.get("material") for e in elements
+                          if isinstance(e, dict))
+        elements = [Element.make(_) for _ in elements]
         super(System, self).__init__(elements)
         self.description = description
         self.scale = scale
@@ -68,14 +258,24 @@ class System(list):
         self.validators = validators or []
         self.solves = solves or []
         self._pupil_cache = {}
+        self._paraxial_cache = {}
+        self._compiled_specs = None, None
+        self._updates = 0
         self.paraxial = ParaxialTrace(self, update=False)
 
+    def __getstate__(self):
+        # the compiled specs are closures
+        state = self.__dict__.copy()
+        state["_compiled_specs"] = None, None
+        return state
+
     def dict(self):
         return {
             "description": self.description,
             "stop": self.stop,
             "scale": float(self.scale),
             "wavelengths": [float(w) for w in self.wavelengths],
+            "fields": [float(f) for f in self.fields],
             "object": self.object.dict(),
             "image": self.image.dict(),
             "pickups": [dict(p) for p in self.pickups],
@@ -134,64 +334,55 @@ class System(list):
         else:
             v[k] = value
 
-    def pickup(self):
-        for pickup in self.pickups:
-            value = None
-            if "get" in pickup:
-                value = self.get_path(pickup["get"])
-            if "get_eval" in pickup:
-                value = eval(pickup["get_eval"])
-            if "get_func" in pickup:
-                value = eval(pickup["get_func"])(self, pickup, value)
-            if "factor" in pickup:
-                value = value * pickup["factor"]
-            if "offset" in pickup:
-                value = value + pickup["offset"]
-            if "set" in pickup:
-                self.set_path(pickup["set"], value)
-            if "set_exec" in pickup:
-                exec(pickup["set_exec"])
+    def _compiled(self):
+        """the compiled pickups, solves and validators
 
+        They are recompiled when the lists change. Changes to the
+        paths and expressions of a spec require replacing its dict.
+        The compiled functions keep the dicts alive, their ids are
+        not reused.
+        """
+        key = (len(self), tuple(map(id, self.pickups)),
+               tuple(map(id, self.solves)), tuple(map(id, self.validators)))
+        if self._compiled_specs[0] != key:
+            n = len(self)
+            self._compiled_specs = key, (
+                [_compile_pickup(p, n) for p in self.pickups],
+                [_compile_solve(p, n) for p in self.solves],
+                [_compile_validator(p) for p in self.validators])
+        return self._compiled_specs[1]
+
+    def dependent_pickups(self, changed=None):
+        """the compiled pickups that depend on the path `changed`
+        (directly or through other pickups), all if it is None"""
+        pickups = self._compiled()[0]
+        if changed is None:
+            return [run for run, reads, writes in pickups]
+        dirty = [_normalize_path(changed, len(self))]
+        runs = []
+        for run, reads, writes in pickups:
+            if (dirty is not None and reads is not None and
+                    not any(_overlap(reads, d) for d in dirty)):
+                continue
+            runs.append(run)
+            if dirty is not None:
+                if writes is None:
+                    dirty = None  # unknown effect, run all that follow
+                else:
+                    dirty.append(writes)
+        return runs
+
+    @timed("update.pickup")
+    def pickup(self, changed=None):
+        """run the pickups, if the path `changed` is given, only those
+        that depend on it (directly or through other pickups)"""
+        for run in self.dependent_pickups(changed):
+            run(self)
+
+    @timed("update.solve")
     def solve(self):
-        for solve in self.solves:
-            if "get" in solve:
-                def getter():
-                    return self.get_path(solve["get"])
-            elif "get_eval" in solve:
-                def getter():
-                    loc = dict(self=self, solve=solve)
-                    return eval(solve["get_eval"], loc, globals())
-            elif "get_func" in solve:
-                def getter():
-                    return solve["get_func"](self, solve)
-            if "set" in solve:
-                def setter(x):
-                    self.set_path(solve["set"], x)
-            elif "set_exec" in solve:
-                def setter(value):
-                    loc = dict(value=value, self=self, solve=solve)
-                    exec(solve["set_exec"], globals(), loc)
-            elif "set_func" in solve:
-                def setter(x):
-                    solve["set_func"](self, solve, x)
-            target = solve.get("target", 0.)
-            if "init" in solve:
-                init = solve["init"]
-            elif "set" in solve:
-                init = self.get_path(solve["set"])
-            else:
-                init = 0.
-
-            def func(x):
-                setter(x)
-                self.pickup()
-                return getter() - target
-
-            x = newton(func, init, tol=solve.get("tol", 1e-8),
-                       maxiter=solve.get("maxiter", 20))
-            func(x)
-            if "init_current" in solve:
-                solve["init"] = float(x)
+        for run in self._compiled()[1]:
+            run(self)
 
     def refractive_index(self, wavelength, index):
         for element in self[index::-1]:
@@ -201,8 +392,11 @@ class System(list):
                 pass
         return 1.
 
+    @timed("update")
     def update(self):
+        self._updates += 1
         self._pupil_cache.clear()
+        self._paraxial_cache.clear()
         self.pickup()
         self.solve()
         self.object.pupil.refractive_index = \
@@ -214,40 +408,8 @@ class System(list):
         self.validate()
 
     def validate(self, fix=False):
-        for validator in self.validators:
-            value = None
-            if "get" in validator:
-                value = self.get_path(validator["get"])
-            if "get_eval" in validator:
-                value = eval(validator["get_eval"])
-            if "get_func" in validator:
-                value = eval(validator["get_func"])(self, validator, value)
-            if "exec" in validator:
-                exec(validator["exec"])
-            if "minimum" in validator:
-                v = validator["minimum"]
-                if value < v:
-                    if fix and "get" in validator:
-                        self.set_path(validator["get"], v)
-                    else:
-                        raise ValueError("%s < %s (%s)" %
-                                         (value, v, validator))
-            if "maximum" in validator:
-                v = validator["maximum"]
-                if value > v:
-                    if fix and "get" in validator:
-                        self.set_path(validator["get"], v)
-                    else:
-                        raise ValueError("%s > %s (%s)" %
-                                         (value, v, validator))
-            if "equality" in validator:
-                v = validator["equality"]
-                if value != v:
-                    if fix and "get" in validator:
-                        self.set_path(validator["get"], v)
-                    else:
-                        raise ValueError("%s != %s (%s)" %
-                                         (value, v, validator))
+        for run in self._compiled()[2]:
+            run(self, fix)
 
     def reverse(self):
         # i-1|material_i-1,distance_i|i|material_i,distance_i+1|i+1
@@ -406,7 +568,21 @@ class System(list):
             n, m = e.paraxial_matrix(n, l)
             yield n, m
 
+    def paraxial_products(self, l):
+        """the `ParaxialMatrices` at wavelength l, rebuilt if any
+        element has changed"""
+        try:
+            p = self._paraxial_cache[l]
+            if p.valid(self, l):
+                return p
+        except KeyError:
+            pass
+        p = self._paraxial_cache[l] = ParaxialMatrices(self, l)
+        return p
+
     def paraxial_matrix(self, l, start=1, stop=None):
+        if slice(start, stop).indices(len(self))[0] >= 1:
+            return self.paraxial_products(l).product(start, stop)
         n = 1.
         m = np.eye(4)
         for n, mi in self.paraxial_matrices(l, start, stop):
@@ -467,6 +643,8 @@ class System(list):
             y, u = e.from_normal(y, u)
 
     def solve_newton(self, merit, a=0., tol=1e-3, maxiter=30):
+        from scipy.optimize import newton
+
         def find_start(fun, a0):
             f0 = fun(a0)
             if not np.isnan(f0):
@@ -484,6 +662,8 @@ class System(list):
         return a
 
     def solve_brentq(self, merit, a=0., b=1., tol=1e-3, maxiter=30):
+        from scipy.optimize import brentq
+
         for i in range(maxiter):
             fb = merit(b)
             if abs(fb) <= tol:
@@ -585,6 +765,7 @@ class System(list):
                 a[:, 0] = a[:, 1]
         return np.r_[z, a.flat]
 
+    @timed("pupil")
     def pupil(self, yo, l=None, stop=None, **kwargs):
         k = l, stop
         try:
@@ -592,5 +773,8 @@ class System(list):
         except KeyError:
             c = self._pupil_cache[k] = PolarCacheND(self._aim_pupil,
                                                     l=l, stop=stop, **kwargs)
+        if enabled():
+            count("pupil_cache.hits" if tuple(yo) in c.cache
+                  else "pupil_cache.misses")
         q = c(*yo)
         return q[0], q[1:].reshape(2, 2)
@@ -21,7 +21,11 @@ from __future__ import (absolute_import, print_function,
 
 import unittest
 
+import numpy as np
+from numpy import testing as nptest
+
 from rayopt import system_from_yaml, Analysis
+from rayopt.evaluation import Fan, Spot, Wavefront, Longitudinal
 from .test_raytrace import cooke
 
 
@@ -37,3 +41,32 @@ class DemotripCase(unittest.TestCase):
             print(_)
         for i, _ in enumerate(a.figures):
             _.savefig("analysis_%i.pdf" % i)
+
+    def test_headless(self):
+        a = Analysis(self.s, plot=False, print=False)
+        self.assertEqual(a.figures, [])
+        r = a.results
+        nf, nw = len(self.s.fields), len(self.s.wavelengths)
+        self.assertEqual(len(r), 2*nf*nw + nf + 2)
+        self.assertIsInstance(r["transverse", 0, 0], Fan)
+        self.assertIsInstance(r["spots", nf - 1, nw - 1], Spot)
+        self.assertIsInstance(r["opds", 1], Wavefront)
+        l = r["longitudinal", ]
+        self.assertIsInstance(l, Longitudinal)
+        self.assertEqual(l.ey.shape, (nw, 21))
+        s = r["spots", 0, 0]
+        nptest.assert_allclose(s.y[0], 0)
+        self.assertEqual(s.at(.1).shape, s.y.shape)
+
+    def test_executor(self):
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            raise unittest.SkipTest("no concurrent.futures")
+        a = Analysis(self.s, plot=False, print=False)
+        with ProcessPoolExecutor(2) as a.executor:
+            r = a.compute()
+        self.assertEqual(sorted(a.results), sorted(r))
+        for k in r:
+            for u, v in zip(a.results[k], r[k]):
+                nptest.assert_allclose(u, v, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import unittest
+
+import numpy as np
+from numpy import testing as nptest
+
+from rayopt import (system_from_yaml, ParaxialTrace, Configurations,
+                    ConfigVariable, ConfigOperand, FuncOp, optimize,
+                    MeritEvaluator, RmsSpotOp, GeometricTrace)
+from rayopt.evaluation import spot
+from .test_raytrace import cooke
+
+
+class ZoomCase(unittest.TestCase):
+    def setUp(self):
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+        self.c = Configurations(self.s, [
+            {}, {(6, "distance"): 7.}, [[(6, "distance"), 5.5],
+                                        [(8, "distance"), 43.5]]])
+        self.c.update()
+
+    def test_select(self):
+        s = self.c[2]
+        self.assertEqual(s[6].distance, 5.5)
+        self.assertEqual(s[8].distance, 43.5)
+        p = s.paraxial
+        self.assertEqual(self.c[1][8].distance, 42.95)
+        self.assertIsNot(self.c[0].paraxial, p)
+        self.assertIs(self.c[2].paraxial, p)
+        self.c.select(None)
+        self.assertEqual(s[6].distance, 6.)
+
+    def test_paraxial(self):
+        b = self.c.paraxial()
+        self.assertEqual(b.y.shape[:2], (3, 3))
+        for i, s in enumerate(self.c):
+            p = ParaxialTrace(s)
+            nptest.assert_allclose(b.y[i, 0], p.y, atol=1e-12)
+            nptest.assert_allclose(b.focal_length[i, 0], p.focal_length)
+        self.assertNotAlmostEqual(b.focal_length[0, 0, 1],
+                                  b.focal_length[1, 0, 1])
+
+    def test_products_reused(self):
+        l = self.s.wavelengths[0]
+        p = self.c[1].paraxial_products(l)
+        self.c.select(2)
+        self.assertIsNot(self.s.paraxial_products(l), p)
+        self.c.select(0)
+        self.assertIs(self.c[1].paraxial_products(l), p)
+
+    def test_ensemble(self):
+        l = self.s.wavelengths[0]
+        e = self.c.ensemble()
+        t = GeometricTrace(self.s)
+        t.rays_point((0, .7), l, nrays=20, distribution="hexapolar")
+        e.rays_given(t.y[0], t.u[0], l)
+        e.propagate()
+        for i in range(len(self.c)):
+            t = GeometricTrace(self.c[i])
+            t.rays_given(e.y[0, i], e.u[0, i], l)
+            t.propagate()
+            nptest.assert_allclose(e.y[-1, i], t.y[-1], atol=1e-12)
+
+    def test_map(self):
+        r = self.c.map(spot, 1.)
+        self.assertEqual(len(r), 3)
+        self.assertFalse(np.allclose(r[0].y, r[2].y))
+
+    def test_optimize(self):
+        def marginal(s):
+            s.paraxial.update()
+            return s.paraxial.y[-1, 0]
+        v = [ConfigVariable(self.c, i, (8, "distance"), (40., 46.))
+             for i in (1, 2)]
+        o = [ConfigOperand(self.c, i, FuncOp(self.s, marginal, 1.))
+             for i in (1, 2)]
+        r = optimize(v, o, tol=1e-12)
+        r.accept()
+        for i in 1, 2:
+            s = self.c[i]
+            s.paraxial.update()
+            nptest.assert_allclose(s.paraxial.y[-1, 0], 0, atol=1e-4)
+        self.assertNotAlmostEqual(self.c.get(1, (8, "distance")),
+                                  self.c.get(2, (8, "distance")))
+
+    def test_stale(self):
+        self.c.select(0)
+        self.s[1].curvature *= 1.05
+        self.s.update()
+        f = self.c[1].paraxial.focal_length
+        self.s.update()
+        nptest.assert_allclose(f, self.s.paraxial.focal_length)
+        self.c.select(0)
+        self.c.set(2, (8, "distance"), 44.)
+        f = self.c[2].paraxial.focal_length
+        self.s.update()
+        nptest.assert_allclose(f, self.s.paraxial.focal_length)
+
+    def test_optimize_merit(self):
+        c = Configurations(self.s, [{(2, "distance"): 2.},
+                                    {(2, "distance"): 2.5}])
+        v = [ConfigVariable(c, i, (2, "distance"), (1., 4.))
+             for i in (0, 1)]
+        o = [ConfigOperand(c, i, RmsSpotOp(
+            MeritEvaluator(self.s, update=False), (0, .7), nrays=12,
+            weight=1.)) for i in (0, 1)]
+        r = optimize(v, o, tol=1e-12)
+        r.accept()
+        for i, oi in enumerate(o):
+            oi.prepare()
+            a = oi.get()
+            c[i].update()
+            oi.prepare()
+            nptest.assert_allclose(oi.operand.get(), a)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+import unittest
+
+import numpy as np
+from numpy import testing as nptest
+
+from rayopt import system_from_yaml, GlassMap, GlassSubstitution
+from rayopt.glass_map import glass_coordinates
+from rayopt.tolerance import rms_spot
+from .test_raytrace import cooke
+
+
+class GlassMapCase(unittest.TestCase):
+    def setUp(self):
+        self.g = GlassMap.one()
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+
+    def test_near(self):
+        m = self.s[1].material
+        names, d = self.g.near(m, 5)
+        self.assertEqual(names[0], str(m))
+        self.assertEqual(d[0], 0)
+        self.assertTrue(np.all(np.diff(d) >= 0))
+        nd, vd, pgf = glass_coordinates(m)
+        n1, d1 = self.g.nearest(nd, vd, k=3)
+        self.assertEqual(len(n1), 3)
+
+    def test_substitution(self):
+        g = GlassSubstitution(self.s, [1, 3], rms_spot, self.g,
+                              candidates=3)
+        m0 = np.square(rms_spot(self.s)).sum()
+        names, merits = g.step(1)
+        self.assertEqual(len(names), 4)
+        nptest.assert_allclose(merits[0], m0)
+        nptest.assert_allclose(np.square(rms_spot(self.s)).sum(),
+                               np.nanmin(merits))
+        for i, old, new, merit in g.run(rounds=1):
+            self.assertNotEqual(old, new)
+            self.assertLessEqual(merit, m0)
+
+    def test_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        g = GlassSubstitution(self.s, [3], rms_spot, self.g, candidates=3)
+        names = self.g.near(self.s[3].material, 4)[0]
+        m = g.evaluate(3, names)
+        with ProcessPoolExecutor(2) as executor:
+            m1 = g.evaluate(3, names, executor, chunksize=2)
+        nptest.assert_allclose(m1, m)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import sys
+import subprocess
+import unittest
+
+
+heavy = ("matplotlib", "sqlalchemy", "yaml", "pkg_resources",
+         "scipy.interpolate", "scipy.optimize", "scipy.special",
+         "scipy.spatial")
+
+
+def run(code):
+    return subprocess.check_output([sys.executable, "-c", code]).decode()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "eager imports before PEP 562")
+class ImportCase(unittest.TestCase):
+    def test_lazy(self):
+        loaded = run("import sys, rayopt; "
+                     "print(' '.join(m for m in %r if m in sys.modules))"
+                     % (heavy,))
+        self.assertEqual(loaded.split(), [])
+
+    def test_time(self):
+        # lenient, catches eager imports of the heavy dependencies
+        out = run("import sys, time; t = time.time(); import rayopt; "
+                  "print(time.time() - t, "
+                  "' '.join(m for m in ('scipy', 'matplotlib', "
+                  "'sqlalchemy') if m in sys.modules))").split()
+        self.assertLess(float(out[0]), 10.)
+        self.assertEqual(out[1:], [])
+
+    def test_first_use(self):
+        loaded = run("import sys, rayopt; rayopt.Analysis; "
+                     "print('matplotlib' in sys.modules)")
+        self.assertEqual(loaded.strip(), "True")
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import warnings
+
+from sqlalchemy import event, text
+
+from rayopt.library import Library
+from rayopt.library_items import Material
+
+
+class LibraryCase(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.l = Library(Library.db_url(Library.one().bundled_db(),
+                                            readonly=True))
+
+    def test_indexes(self):
+        r = self.l.session.execute(text(
+            "select name from sqlite_master where type = 'index'"))
+        self.assertTrue(set(["ix_material_name_catalog",
+                             "ix_lens_name_catalog",
+                             "ix_catalog_name_source"]) <=
+                        set(i for i, in r))
+
+    def test_get(self):
+        m = self.l.get("material", "SCHOTT-SK|N-SK16", "glass")
+        self.assertEqual(str(m), "glass/SCHOTT-SK|N-SK16")
+        self.assertRaises(KeyError, self.l.get, "material", "SK16",
+                          "glass")
+        with self.assertRaises(KeyError):
+            next(self.l.get_all("material", "SCHOTT-SK|N-SK16",
+                                source="missing"))
+
+    def test_get_many(self):
+        keys = [(None, "glass", "SCHOTT-SK|N-SK16"),
+                ("rii", None, "schott-bk|n-bk7")]
+        ms = self.l.get_many("material", keys)
+        self.assertEqual([str(m) for m in ms],
+                         ["glass/SCHOTT-SK|N-SK16", "glass/SCHOTT-BK|N-BK7"])
+        self.assertRaises(KeyError, self.l.get_many, "material",
+                          keys + [(None, "glass", "SK16")])
+
+    def test_get_many_chunks(self):
+        queries = []
+
+        def before(conn, cursor, statement, *args):
+            queries.append(statement)
+        keys = [(None, None, m.name) for m in
+                self.l.session.query(Material).limit(1200)]
+        event.listen(self.l.engine, "before_cursor_execute", before)
+        try:
+            ms = self.l.get_many("material", keys)
+        finally:
+            event.remove(self.l.engine, "before_cursor_execute", before)
+        self.assertEqual(len(ms), len(keys))
+        n = len(set(k[2].lower() for k in keys))
+        self.assertEqual(len(queries), -(-n//Library.query_chunk))
+
+    def test_materials(self):
+        queries = []
+
+        def before(conn, cursor, statement, *args):
+            queries.append(statement)
+        keys = [(None, "glass", "SCHOTT-F|N-F2"),
+                (None, "glass", "SCHOTT-SF|N-SF5"),
+                (None, "glass", "SCHOTT-F|N-F2")]
+        Library._materials.clear()
+        event.listen(self.l.engine, "before_cursor_execute", before)
+        try:
+            a, b, c = self.l.materials(keys)
+            self.assertEqual(len(queries), 1)
+            self.assertIs(a, c)
+            self.assertIs(self.l.material("schott-f|n-f2", "GLASS"), a)
+            self.assertEqual(len(queries), 1)
+        finally:
+            event.remove(self.l.engine, "before_cursor_execute", before)
+
+    def test_prefetch(self):
+        from rayopt import System
+        Library._materials.clear()
+        calls = []
+        get_many = Library.get_many
+
+        def counted(self, *args):
+            calls.append(args)
+            return get_many(self, *args)
+        Library.get_many = counted
+        try:
+            s = System(elements=[
+                dict(type="spheroid", material="glass/SCHOTT-F|N-F2"),
+                dict(type="spheroid", material="glass/SCHOTT-SF|N-SF5"),
+                dict(type="spheroid", material="air"),
+                dict(type="spheroid", material="1.5/60")])
+        finally:
+            Library.get_many = get_many
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(str(s[1].material), "glass/SCHOTT-SF|N-SF5")
+
+    def test_unpack(self):
+        item = self.l.session.query(Material).filter(
+            Material.name == "SCHOTT-SK|N-SK16").one()
+        self.assertEqual(item.formula, "sellmeier_squared_offset")
+        a, b = item.unpack(), item.parse_data()
+        self.assertEqual(a.name, b.name)
+        self.assertEqual((a.lambda_min, a.lambda_max),
+                         (b.lambda_min, b.lambda_max))
+        for l in 450e-9, 587e-9, 1e-6:
+            self.assertEqual(a.refractive_index(l), b.refractive_index(l))
+        self.assertAlmostEqual(item.nd, b.nd)
+        self.assertAlmostEqual(item.vd, b.vd)
+
+    def test_readonly_url(self):
+        d = tempfile.mkdtemp(suffix=" a#b?c%20d")
+        try:
+            fil = os.path.join(d, "library.sqlite")
+            shutil.copy(self.l.bundled_db(), fil)
+            for readonly in True, False:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    l = Library(Library.db_url(fil, readonly))
+                try:
+                    item = l.session.query(Material).filter(
+                        Material.name == "SCHOTT-SK|N-SK16").one()
+                    self.assertEqual(item.formula,
+                                     "sellmeier_squared_offset")
+                finally:
+                    l.session.close()
+                    l.engine.dispose()
+            self.assertEqual(os.listdir(d), ["library.sqlite"])
+        finally:
+            shutil.rmtree(d)
+
+    def test_add_columns(self):
+        d = tempfile.mkdtemp()
+        try:
+            fil = os.path.join(d, "library.sqlite")
+            shutil.copy(self.l.bundled_db(), fil)
+            # a library without the parsed columns (and without nd)
+            c = sqlite3.connect(fil)
+            new = "formula coefficients lambda_min lambda_max thermal nd"
+            cols = [(r[1], r[2]) for r in
+                    c.execute("pragma table_info(material)")
+                    if r[1] not in new.split()]
+            c.execute("alter table material rename to material_new")
+            c.execute("create table material ({}, primary key (id))".format(
+                ", ".join("{} {}".format(*ci) for ci in cols)))
+            names = ", ".join(n for n, t in cols)
+            c.execute("insert into material ({0}) select {0} "
+                      "from material_new".format(names))
+            c.execute("drop table material_new")
+            c.commit()
+            c.close()
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                l = Library(Library.db_url(fil))
+            try:
+                item = l.session.query(Material).filter(
+                    Material.name == "SCHOTT-SK|N-SK16").one()
+                self.assertEqual(item.formula, "sellmeier_squared_offset")
+                self.assertIsNotNone(item.nd)
+            finally:
+                l.session.close()
+                l.engine.dispose()
+        finally:
+            shutil.rmtree(d)
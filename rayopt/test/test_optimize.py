@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy import testing as nptest
+
+from rayopt import (system_from_yaml, GeometricTrace, MeritEvaluator,
+                    RmsSpotOp, RmsWavefrontOp, PathVariable, default_merit,
+                    optimize, dls, Variable, FuncOp, GlobalSearch,
+                    MeritCache, Checkpoint, History, Profile)
+from rayopt.global_search import unique
+from rayopt.tolerance import rms_spot
+from .test_raytrace import cooke
+
+
+class ArrayVariable(Variable):
+    def __init__(self, x, k, *args, **kwargs):
+        self.x, self.k = x, k
+        super(ArrayVariable, self).__init__(None, *args, **kwargs)
+
+    def get(self):
+        return self.x[self.k]
+
+    def set(self, value):
+        self.x[self.k] = value
+
+
+class CacheCase(unittest.TestCase):
+    def test_quantize(self):
+        x = []
+        c = MeritCache(lambda xi: x.append(xi) or len(x), size=2)
+        self.assertEqual(c([1., 2.]), 1)
+        self.assertEqual(c([1. + 1e-13, 2.]), 1)
+        self.assertEqual(c([1. + 1e-6, 2.]), 2)
+        self.assertEqual((c.hits, c.misses), (1, 2))
+
+    def test_large(self):
+        c = MeritCache(lambda xi: xi[0], size=4)
+        self.assertEqual(c([1e10]), 1e10)
+        self.assertEqual(c([2e10]), 2e10)
+        self.assertEqual(c([-0.]), 0.)
+        self.assertEqual(c([0.]), 0.)
+        self.assertEqual((c.hits, c.misses), (1, 3))
+
+    def test_grow(self):
+        c = MeritCache(lambda xi: xi[0], size=2)
+        for i in range(3):
+            for xi in [0.], [1.], [2.]:
+                c(xi)
+        self.assertEqual(c.size, 3)
+        self.assertEqual(c.misses, 4)
+
+
+class DlsCase(unittest.TestCase):
+    def setUp(self):
+        self.x = np.array([-1.2, 1.])
+        self.o = [FuncOp(self.x, lambda x: [10*(x[1] - x[0]**2), 1 - x[0]],
+                         1.)]
+
+    def variables(self, upper=2.):
+        return [ArrayVariable(self.x, 0, (-2., upper)),
+                ArrayVariable(self.x, 1, (-2., 2.))]
+
+    def test_rosenbrock(self):
+        v = self.variables()
+        r = dls(v, self.o)
+        self.assertTrue(r.success)
+        nptest.assert_allclose(r.x*4, [1, 1], atol=1e-5)
+        self.assertLess(r.nfev, 100)
+        self.assertEqual(r.trace_time.shape, (r.nit,))
+        self.assertLessEqual(r.trace_nfev[-1], r.nfev)
+        r.reject()
+        nptest.assert_allclose(self.x, [-1.2, 1.])
+        r.accept()
+        nptest.assert_allclose(self.x, [1, 1], atol=1e-5)
+
+    def test_bounds(self):
+        r = dls(self.variables(.5), self.o)
+        nptest.assert_allclose(r.x*[2.5, 4], [.5, .25], atol=1e-5)
+
+    def test_checkpoint(self):
+        d = tempfile.mkdtemp()
+        try:
+            c = Checkpoint(os.path.join(d, "c.npz"), every=2)
+            h = History(os.path.join(d, "h.jsonl"))
+            r = dls(self.variables(), self.o, maxiter=6, checkpoint=c,
+                    history=h)
+            h.close()
+            self.assertEqual(list(h.column("iteration")), list(range(1, 7)))
+            nptest.assert_allclose(h.column("x"), r.trace_x)
+            x, state = c.load()
+            self.assertEqual(state["iteration"], 6)
+            nptest.assert_allclose(x, r.x*4)
+            self.assertIsNone(c.system())
+            r1 = dls(self.variables(), self.o, checkpoint=c, resume=True,
+                     history=h)
+            h.close()
+            self.assertEqual(h.column("iteration")[6], 7)
+            self.assertLess(r1.nit, 18)
+            nptest.assert_allclose(r1.x*4, [1, 1], atol=1e-5)
+        finally:
+            shutil.rmtree(d)
+
+    def test_inequality(self):
+        o = self.o + [FuncOp(self.x, lambda x: x[0], max=.8)]
+        r = dls(self.variables(), o, tol=1e-8)
+        self.assertLess(r.maxcv, 1e-5)
+        nptest.assert_allclose(r.x*4, [.8, .64], atol=1e-4)
+
+
+class MeritCase(unittest.TestCase):
+    def setUp(self):
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+
+    def test_shared(self):
+        m = MeritEvaluator(self.s)
+        o = default_merit(m, fields=(0, .7), nrays=20)
+        o.append(RmsWavefrontOp(m, (0, .7), nrays=20))
+        v = [op.get() for op in o]
+        self.assertEqual(m.count, len(self.s.wavelengths))
+        for op, vi in zip(o, v):
+            r = m.view(op.requests[0])
+            t = GeometricTrace(self.s)
+            t.rays_given(r.y[0], r.u[0], r.l)
+            t.propagate()
+            if isinstance(op, RmsWavefrontOp):
+                x, y, w = t.opd(resample=False)
+                nptest.assert_allclose(vi, np.sqrt(np.var(w)), rtol=1e-9)
+            else:
+                nptest.assert_allclose(vi, t.rms(), rtol=1e-9)
+        self.assertEqual(m.count, len(self.s.wavelengths))
+        for op in o:
+            op.prepare()
+        self.assertEqual(m.count, len(self.s.wavelengths))
+        [op.get() for op in o]
+        self.assertEqual(m.count, 2*len(self.s.wavelengths))
+
+    def test_optimize(self):
+        m = MeritEvaluator(self.s)
+        o = [RmsSpotOp(m, (0, 0), nrays=20, weight=1.)]
+        v = [PathVariable(self.s, (-1, "distance"), (40., 46.))]
+        v0 = o[0].get()
+        r = optimize(v, o)
+        r.accept()
+        o[0].prepare()
+        self.assertLess(o[0].get(), v0)
+        self.assertLess(m.count, r.nfev + 3)
+
+    def test_dls(self):
+        m = MeritEvaluator(self.s)
+        o = [RmsSpotOp(m, (0, h), nrays=20, weight=1.) for h in (0, .7)]
+        v = [PathVariable(self.s, (-1, "distance"), (40., 46.))]
+        v0 = np.square([op.get() for op in o]).sum()
+        r = dls(v, o)
+        self.assertLess(r.fun, v0)
+        self.assertEqual(m.count, r.nfev + 1)
+
+    def test_profile(self):
+        m = MeritEvaluator(self.s)
+        o = [RmsSpotOp(m, (0, h), nrays=20, weight=1.) for h in (0, .7)]
+        v = [PathVariable(self.s, (-1, "distance"), (40., 46.))]
+        phases = []
+        p = Profile(callback=lambda name, dt: phases.append(name))
+        r = dls(v, o, profile=p)
+        self.assertIs(r.profile, p)
+        for k in "update pupil trace operands merit.trace".split():
+            self.assertIn(k, p.timers)
+        self.assertEqual(p.timers["merit.trace"][0], r.nfev)
+        self.assertEqual(len(phases), sum(n for n, t in p.timers.values()))
+        h, n, f = p.hit_rates()["pupil_cache"]
+        self.assertEqual(h + n, 2*r.nfev)
+        self.assertIn("pupil_cache", str(p))
+        self.s[1].aspherics = [0, 1e-6]
+        self.s.update()
+        t = GeometricTrace(self.s)
+        t.rays_point((0, 1.), None, nrays=20, distribution="hexapolar")
+        with Profile() as p:
+            t.propagate()
+        self.assertEqual(p.counters["intercept.newton"], t.nrays)
+        dls(v, o, maxiter=1)
+        self.assertEqual(p.counters["intercept.newton"], t.nrays)
+
+
+class GlobalCase(unittest.TestCase):
+    def setUp(self):
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+        self.g = GlobalSearch(self.s, [(-1, "distance"), (1, "curvature")],
+                              [(40., 46.), (.03, .06)], rms_spot, seed=1)
+
+    def test_unique(self):
+        m = [(np.array([1., 2.]), 1., 3), (np.array([0., 0.]), .5, 2),
+             (np.array([1., 2.001]), 1.0001, 4)]
+        u = unique(m, bounds=[(0, 10), (0, 10)])
+        self.assertEqual([si.merit for si in u], [.5, 1.])
+        self.assertEqual(u[1].count, 2)
+        self.assertEqual(u[1].nfev, 7)
+
+    def test_run(self):
+        r = self.g.run(3, hops=1)
+        self.assertTrue(r.complete)
+        self.assertEqual(r.starts, 3)
+        self.assertLessEqual(sum(si.count for si in r.solutions), 6)
+        f = [si.merit for si in r.solutions]
+        self.assertEqual(f, sorted(f))
+        self.assertLess(r.best.merit, np.square(rms_spot(self.s)).sum())
+        r.apply(self.s)
+        nptest.assert_allclose(np.square(rms_spot(self.s)).sum(),
+                               r.best.merit)
+
+    def test_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        r = self.g.run(2)
+        with ProcessPoolExecutor(2) as executor:
+            r1 = self.g.run(2, executor=executor)
+        self.assertEqual(len(r1.solutions), len(r.solutions))
+        for a, b in zip(r.solutions, r1.solutions):
+            nptest.assert_allclose(a.x, b.x)
+
+    def test_resume(self):
+        d = tempfile.mkdtemp()
+        try:
+            c = Checkpoint(os.path.join(d, "c.npz"))
+            r = self.g.run(2, checkpoint=c)
+            self.assertEqual(c.system()[-1].distance, self.s[-1].distance)
+            n = []
+            r1 = self.g.run(2, checkpoint=c, resume=True,
+                            callback=lambda m: n.append(m))
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual(n, [])
+        self.assertTrue(r1.complete)
+        nptest.assert_allclose(r1.best.x, r.best.x)
+
+    def test_cancel(self):
+        r = self.g.run(3, budget=0.)
+        self.assertFalse(r.complete)
+        self.assertEqual(r.starts, 0)
+        r = self.g.run(3, callback=lambda m: True)
+        self.assertFalse(r.complete)
+        self.assertEqual(r.starts, 1)
@@ -26,7 +26,10 @@ from numpy import testing as nptest
 
 
 from rayopt import (system_from_yaml, ParaxialTrace, GeometricTrace,
-                    system_to_yaml)
+                    SpotHistogram, ParaxialBatch, system_to_yaml,
+                    GaussianTrace, GaussianBatch, EnsembleTrace,
+                    ModelMaterial, PerturbedMaterial)
+from rayopt.gaussian_trace import mode_match
 from rayopt.utils import tanarcsin
 
 
@@ -108,6 +111,186 @@ class DemotripCase(unittest.TestCase):
         self.s.mirrored
         self.s.align(np.ones_like(self.s.track))
 
+    def test_paraxial_products(self):
+        l = self.s.wavelengths[1]
+
+        def loop(start, stop):
+            m = np.eye(4)
+            for n, mi in self.s.paraxial_matrices(l, start, stop):
+                m = np.dot(mi, m)
+            return n, m
+        k = len(self.s)
+        for start in range(1, k):
+            for stop in list(range(start + 1, k)) + [None]:
+                n, m = self.s.paraxial_matrix(l, start, stop)
+                n1, m1 = loop(start, stop)
+                self.assertEqual(n, n1)
+                nptest.assert_allclose(m, m1, atol=1e-12)
+        p = self.s.paraxial_products(l)
+        self.assertIs(self.s.paraxial_products(l), p)
+        self.s[2].curvature *= 1.1
+        self.s[3].distance += .1
+        self.assertIsNot(self.s.paraxial_products(l), p)
+        nptest.assert_allclose(self.s.paraxial_matrix(l, 2, 5)[1],
+                               loop(2, 5)[1], atol=1e-12)
+        # in place changes
+        self.s[2].aspherics = [0., 0.]
+        p = self.s.paraxial_products(l)
+        self.s.set_path((2, "aspherics", 0), 1e-3)
+        self.assertIsNot(self.s.paraxial_products(l), p)
+        p = self.s.paraxial_products(l)
+        self.s[3].material = PerturbedMaterial(self.s[3].material)
+        p = self.s.paraxial_products(l)
+        self.s[3].material.dn += 1e-3
+        self.assertIsNot(self.s.paraxial_products(l), p)
+        nptest.assert_allclose(self.s.paraxial_matrix(l, 2, 5)[1],
+                               loop(2, 5)[1], atol=1e-12)
+
+    def test_paraxial_batch(self):
+        t = system_from_yaml(cooke)
+        t[-1].distance += 1.
+        t.update()
+        b = ParaxialBatch([self.s, t])
+        wl = self.s.wavelengths
+        self.assertEqual(b.y.shape, (2, len(wl), len(self.s), 2))
+        for i, s in enumerate((self.s, t)):
+            for j in range(len(wl)):
+                s.wavelengths = wl[j:] + wl[:j]
+                p = ParaxialTrace(s)
+                for k in "y u n c".split():
+                    nptest.assert_allclose(getattr(b, k)[i, j],
+                                           getattr(p, k), atol=1e-12)
+                for k in ("focal_length focal_distance pupil_distance "
+                          "pupil_height magnification").split():
+                    nptest.assert_allclose(getattr(b, k)[i, j],
+                                           getattr(p, k), atol=1e-12)
+                nptest.assert_allclose(b.seidel[i, j], p.c.sum(0),
+                                       atol=1e-12)
+            s.wavelengths = wl
+        nptest.assert_allclose(b.focal_shift[:, 0], 0)
+        nptest.assert_allclose(b.focal_shift[0], b.focal_shift[1],
+                               atol=1e-6)
+
+    def test_gaussian_batch(self):
+        g = GaussianTrace(self.s)
+        o = self.s.object
+        b = GaussianBatch(self.s, [o.pupil.radius, 2.],
+                          [-o.pupil.distance, 5.])
+        self.assertEqual(b.qi.shape, (len(self.s), 2, 2, 2))
+        nptest.assert_allclose(b.qi[:, 0], g.qi, rtol=1e-12)
+        nptest.assert_allclose(b.waist_radius[:, 0], g.waist_radius,
+                               rtol=1e-12)
+        w, z = b.waist_radius[-1, 1, 0], b.waist_position[-1, 1, 0]
+        e = b.overlap(w, z)
+        nptest.assert_allclose(e[1], 1)
+        self.assertLess(e[0], 1)
+        w, z, e = mode_match(self.s, w, z, np.linspace(.5, 5, 32),
+                             np.linspace(-20, 20, 32))
+        nptest.assert_allclose((w, z, e), (2., 5., 1.), rtol=1e-3)
+
+    def test_ensemble_trace(self):
+        l = self.s.wavelengths[0]
+        dc = [-1e-3, 0, 2e-3]
+        dd = [.1, 0, -.2]
+        dn = [1e-3, -2e-3, 0]
+        da = [[.01, .02, .03], [0, 0, 0], [-.02, 0, .01]]
+        e = EnsembleTrace(self.s, {(1, "curvature"): dc,
+                                   (3, "distance"): dd,
+                                   (6, "index"): dn,
+                                   (4, "tilt"): da})
+        e.rays_point((0, .7), l, nrays=30, distribution="hexapolar")
+        for k in range(e.trials):
+            s = system_from_yaml(system_to_yaml(self.s))
+            s.update()
+            s[1].curvature += dc[k]
+            s[3].distance += dd[k]
+            s[6].material = ModelMaterial(n=s[6].refractive_index(l) +
+                                          dn[k])
+            s[4].angles = da[k]
+            t = GeometricTrace(s)
+            t.rays_given(e.y[0, k], e.u[0, k], l, e.w, e.ref)
+            t.propagate()
+            # the tilted element is stored in its nominal coordinates
+            m = np.arange(len(s)) != 4
+            for j in "y u i t".split():
+                nptest.assert_allclose(getattr(e, j)[m, k],
+                                       getattr(t, j)[m], atol=1e-12)
+            nptest.assert_allclose(e.rms()[k], t.rms())
+            f = e.focus()[k]
+            t.refocus()
+            nptest.assert_allclose(e.rms(focus=f)[k], t.rms())
+        # a decentered flat image plane does not change the intercepts
+        e = EnsembleTrace(self.s, {(-1, "decenter"): [[.1, .2], [0, 0]],
+                                   (1, "decenter"): [[0, 0], [0, .1]]})
+        e.rays_point((0, .7), l, nrays=30, distribution="hexapolar")
+        t = GeometricTrace(self.s)
+        t.rays_given(e.y[0, 0], e.u[0, 0], l)
+        t.propagate()
+        nptest.assert_allclose(e.y[-1, 0], t.y[-1], atol=1e-12)
+        self.assertGreater(np.fabs(e.y[-1, 1] - t.y[-1]).max(), 1e-3)
+
+    def test_pickup_dependencies(self):
+        s = self.s
+        s.pickups.append({"get": [2, "radius"], "set": [5, "radius"]})
+        s.pickups.append({"get": [8, "distance"], "set": [4, "radius"],
+                          "factor": .1})
+        s[1].radius = 6.
+        s.pickup([1, "radius"])
+        self.assertEqual((s[2].radius, s[4].radius, s[5].radius),
+                         (6., 5., 6.))
+        s.pickup([-1])
+        nptest.assert_allclose(s[4].radius, .1*s[8].distance)
+        s.pickups.append({"get": [2, "offset", 2], "set": [5, "distance"]})
+        s[2].distance = 9.
+        s.pickup((2, "distance"))
+        self.assertEqual(s[5].distance, 9.)
+
+    def test_solve(self):
+        s = self.s
+        s.solves.append({"get_eval": "self.edge_thickness()[2]",
+                         "set": [2, "distance"], "target": 1.})
+        s.validators.append({"get": [2, "distance"], "maximum": 3.})
+        s.update()
+        nptest.assert_allclose(s.edge_thickness()[2], 1.)
+        s.solves[0] = dict(s.solves[0], target=2.5)
+        self.assertRaises(ValueError, s.update)
+        s.validate(fix=True)
+        self.assertEqual(s[2].distance, 3.)
+
+    def test_paraxial_solves(self):
+        s = self.s
+        p = s.paraxial
+        s.solves.append({"paraxial": "focal_length", "set": [7, "curvature"],
+                         "target": 52.})
+        s.solves.append({"paraxial": "image_distance"})
+        s.update()
+        nptest.assert_allclose(p.focal_length, (-52., 52.))
+        nptest.assert_allclose(p.y[-1, 0], 0, atol=1e-12)
+        for kind, path, target, at in [
+                ("marginal_height", (3, "distance"), 5., 6),
+                ("chief_height", (1, "distance"), 1., 4),
+                ("marginal_angle", (6, "curvature"), -.1, 6),
+                ("chief_angle", (2, "curvature"), .1, 5)]:
+            p.solve(kind, path, target, at)
+            p.update()
+            r, q = kind.split("_")
+            v = {"height": p.y, "angle": p.u}[q][at, int(r == "chief")]
+            nptest.assert_allclose(v, target)
+        c = s[2].curvature
+        self.assertRaises(ValueError, p.solve, "marginal_height",
+                          (2, "curvature"))
+        self.assertEqual(s[2].curvature, c)
+
+    def test_paraxial_solve_pickup(self):
+        s = self.s
+        s.pickups.append({"get": [1, "curvature"], "set": [2, "curvature"],
+                          "factor": -.5})
+        s.solves.append({"paraxial": "focal_length", "set": [1, "curvature"],
+                         "target": 52.})
+        s.update()
+        nptest.assert_allclose(s.paraxial.focal_length, (-52., 52.))
+        self.assertEqual(s[2].curvature, -.5*s[1].curvature)
+
     def test_paraxial(self):
         p = self.s.paraxial
         # print(str(p))
@@ -200,3 +383,42 @@ class DemotripCase(unittest.TestCase):
                      clip=False, filter=True)
         b = g.rms()
         nptest.assert_allclose(a, b, rtol=5e-2)
+
+    def test_geometric_psf(self):
+        p, g = self.traces()
+        g.rays_point((0, 1.), nrays=500, distribution="hexapolar",
+                     clip=True)
+        r, ee = g.encircled_energy()
+        nptest.assert_allclose(ee[-1], 1)
+        self.assertTrue(np.all(np.diff(ee) >= 0))
+        r, es = g.ensquared_energy()
+        self.assertTrue(np.all(es >= ee))
+        f, m = g.geometric_mtf()
+        nptest.assert_allclose(m[:, 0], 1)
+        self.assertEqual(m.shape, (2, f.shape[0]))
+        # direct evaluation of the characteristic function
+        h = g.spot_histogram()
+        y = g.y[-1, :, :2] - h.center
+        good = np.all(np.isfinite(y), axis=1)
+        w = g.w[good]/g.w[good].sum()
+        m0 = np.absolute(np.dot(w, np.exp(
+            -2j*np.pi*y[good, 1:2]*f[:10])))
+        nptest.assert_allclose(m[1, :10], m0, atol=2e-2)
+
+    def test_encircled_corners(self):
+        p, g = self.traces()
+        g.rays_point((0, .7), nrays=300, distribution="hexapolar")
+        y = np.random.RandomState(0).uniform(-1, 1, (g.y.shape[1], 2))
+        g.y[-1, :, :2] = y
+        r, ee = g.encircled_energy()
+        nptest.assert_allclose(ee[-1], 1)
+
+    def test_spot_histogram_chunks(self):
+        p, g = self.traces()
+        g.rays_point((0, .7), nrays=300, distribution="hexapolar")
+        h = g.spot_histogram(nbins=64)
+        h1 = SpotHistogram(h.binsize, h.nbins, h.center)
+        for sl in np.array_split(np.arange(g.y.shape[1]), 3):
+            h1.add(g.y[-1, sl, :2], g.w[sl])
+        nptest.assert_allclose(h1.encircled()[1], h.encircled()[1])
+        nptest.assert_allclose(h1.mtf([0, 10.]), h.mtf([0, 10.]))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import shutil
+import tempfile
+import unittest
+
+from numpy import testing as nptest
+
+from rayopt import system_from_yaml, Analysis
+from rayopt.evaluation import paraxial, spot, Spot
+from rayopt.result_cache import ResultCache, fingerprint
+from .test_raytrace import cooke
+
+
+class ResultCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+        self.path = tempfile.mkdtemp()
+        self.c = ResultCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fingerprint(self):
+        f = fingerprint(self.s)
+        s = system_from_yaml(cooke)
+        s.update()
+        self.assertEqual(f, fingerprint(s))
+        self.s[1].curvature *= 1.01
+        self.assertNotEqual(f, fingerprint(self.s))
+
+    def test_roundtrip(self):
+        a = self.c(spot, self.s, 1., self.s.wavelengths[1])
+        b = self.c(spot, self.s, 1., self.s.wavelengths[1])
+        self.assertEqual((self.c.hits, self.c.misses), (1, 1))
+        self.assertIsInstance(b, Spot)
+        self.assertEqual(a.height, b.height)
+        nptest.assert_equal(a.y, b.y)
+        self.c(spot, self.s, .5, self.s.wavelengths[1])
+        self.assertEqual(self.c.misses, 2)
+        k = self.c.key(self.s, paraxial)
+        self.c.put(k, None)
+        self.assertIsNone(self.c.get(k))
+
+    def test_evict(self):
+        for h in 0, .5, 1.:
+            self.c(spot, self.s, h)
+        e = self.c.entries()
+        self.assertEqual(len(e), 3)
+        self.c.evict(self.c.size - 1)
+        self.assertEqual(self.c.entries(), e[1:])
+        self.c.clear()
+        self.assertEqual(self.c.size, 0)
+
+    def test_evict_on_put(self):
+        self.c.max_size = 0
+        self.c(spot, self.s, 0.)
+        self.assertEqual(self.c.size, 0)
+        self.c.max_size = 2**20
+        for h in 0, .5, 1.:
+            self.c(spot, self.s, h)
+        self.assertEqual(self.c._size, self.c.size)
+        self.assertEqual(len(self.c.entries()), 3)
+
+    def test_analysis(self):
+        a = Analysis(self.s, plot=False, print=False, cache=self.c)
+        self.assertEqual(self.c.hits, 0)
+        n = self.c.misses
+        self.assertEqual(n, len(a.results))
+        r = a.compute()
+        self.assertEqual(self.c.hits, n)
+        nptest.assert_equal(r["paraxial", ].c, a.results["paraxial", ].c)
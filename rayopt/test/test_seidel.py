@@ -58,3 +58,62 @@ class ParabolicCase(unittest.TestCase):
         self.s.update()
         hyp = self.s.paraxial.transverse3[1, 0]
         nptest.assert_allclose(sph, -hyp)
+
+
+class DerivativesCase(unittest.TestCase):
+    def setUp(self):
+        from .test_raytrace import cooke
+        self.s = ro.system_from_yaml(cooke)
+        self.s.update()
+
+    def values(self):
+        self.s.update()
+        p = self.s.paraxial
+        return np.r_[p.focal_length, p.magnification,
+                     p.transverse3[:, :5].ravel()]
+
+    def test_values(self):
+        d = ro.ParaxialDerivatives(self.s)
+        p = self.s.paraxial
+        for k in "y u n c focal_length magnification".split():
+            nptest.assert_allclose(d.value[k], getattr(p, k), atol=1e-12)
+
+    def test_finite_difference(self):
+        par = [(1, "curvature"), (3, "curvature"), (4, "distance"),
+               (8, "distance"), (5, "distance")]
+        d = ro.ParaxialDerivatives(self.s, par)
+        for j, (i, k) in enumerate(par):
+            x = getattr(self.s[i], k)
+            h = 1e-6*(abs(x) or 1e-2)
+            setattr(self.s[i], k, x + h)
+            a = self.values()
+            setattr(self.s[i], k, x)
+            b = self.values()
+            an = np.r_[d.focal_length[:, j], d.magnification[:, j],
+                       d.transverse3[:, :5, j].ravel()]
+            nptest.assert_allclose(an, (a - b)/h, rtol=1e-3,
+                                   atol=1e-4*np.fabs(an).max())
+
+    def test_index(self):
+        par = [(1, "index"), (3, "index")]
+        d = ro.ParaxialDerivatives(self.s, par)
+        for j, (i, k) in enumerate(par):
+            m = self.s[i].material
+            h = 1e-6
+            self.s[i].material = ro.PerturbedMaterial(m, dn=h)
+            a = self.values()
+            self.s[i].material = m
+            b = self.values()
+            an = np.r_[d.focal_length[:, j], d.magnification[:, j],
+                       d.transverse3[:, :5, j].ravel()]
+            nptest.assert_allclose(an, (a - b)/h, rtol=1e-3,
+                                   atol=1e-4*np.fabs(an).max())
+
+    def test_rotated(self):
+        a = ro.ParaxialDerivatives(self.s)
+        self.s[4].direction = 0, .01, 1.
+        self.s[4].distance = 1.
+        b = ro.ParaxialDerivatives(self.s)
+        nptest.assert_allclose(a.focal_length, b.focal_length)
+        self.s[4].angles = .1, 0, 0
+        self.assertRaises(ValueError, ro.ParaxialDerivatives, self.s)
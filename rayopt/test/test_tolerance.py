@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy import testing as nptest
+
+from rayopt import (system_from_yaml, GeometricTrace, EnsembleTrace,
+                    MonteCarlo, RadiusTolerance, ThicknessTolerance,
+                    TiltTolerance, DecenterTolerance, IndexTolerance,
+                    AbbeTolerance, Refocus, PerturbedMaterial,
+                    system_from_json, system_to_json, Material,
+                    ModelMaterial, AbbeMaterial)
+from rayopt.result_cache import fingerprint
+from .test_raytrace import cooke
+
+
+class MonteCarloCase(unittest.TestCase):
+    def setUp(self):
+        self.s = system_from_yaml(cooke)
+        self.s.update()
+        self.t = [RadiusTolerance(1, .2), ThicknessTolerance(3, .05),
+                  TiltTolerance(6, 1e-3, distribution="normal"),
+                  DecenterTolerance(7, .02), IndexTolerance(1, 1e-3),
+                  AbbeTolerance(3, .5, distribution="end")]
+
+    def test_material(self):
+        m = self.s[3].material
+        p = PerturbedMaterial(m, dn=1e-3, dv=2.)
+        nptest.assert_allclose(p.nd, m.nd + 1e-3)
+        nptest.assert_allclose(p.vd, m.vd + 2.)
+
+    def test_material_dict(self):
+        s = copy.deepcopy(self.s)
+        IndexTolerance(3, 1e-3).apply(s, 1e-3)
+        self.assertNotEqual(fingerprint(s), fingerprint(self.s))
+        s1 = system_from_json(system_to_json(s))
+        self.assertIsInstance(s1[3].material, PerturbedMaterial)
+        l = s.wavelengths[0]
+        nptest.assert_allclose(s1[3].refractive_index(l),
+                               self.s[3].refractive_index(l) + 1e-3)
+        for m in ModelMaterial(n=1.6), AbbeMaterial(n=1.6, v=40.):
+            p = PerturbedMaterial(m, dn=1e-3, dv=1.)
+            p1 = Material.make(json.loads(json.dumps(p.dict())))
+            self.assertIsInstance(p1.material, type(m))
+            nptest.assert_allclose(p1.refractive_index(l),
+                                   p.refractive_index(l))
+
+    def test_decenter(self):
+        s = copy.deepcopy(self.s)
+        d = .05, -.02
+        DecenterTolerance(3, .1).apply(s, d)
+        s.update()
+        l = s.wavelengths[0]
+        e = EnsembleTrace(self.s, {(3, "decenter"): [d]})
+        e.rays_point((0, .7), l, nrays=30, distribution="hexapolar")
+        t = GeometricTrace(s)
+        t.rays_given(e.y[0, 0], e.u[0, 0], l)
+        t.propagate()
+        nptest.assert_allclose(t.y[4:], e.y[4:, 0], atol=1e-12)
+
+    def test_run(self):
+        mc = MonteCarlo(self.s, self.t, [Refocus()], seed=3)
+        p = []
+        r = mc.run(12, chunksize=5, progress=lambda i, n: p.append(i))
+        self.assertEqual(p, [5, 10, 12])
+        self.assertEqual(r.criteria.shape, (12, 3))
+        self.assertEqual(r.values[2].shape, (12, 2))
+        self.assertFalse(np.any(r.failed))
+        self.assertTrue(np.all(r.change[:, 0] > 0))
+        nptest.assert_array_less(r.percentile(50), r.percentile(90))
+        r1 = MonteCarlo(self.s, self.t, [Refocus()], seed=3).run(12)
+        nptest.assert_allclose(r1.criteria, r.criteria)
+
+    def test_compensator_solves(self):
+        s = copy.deepcopy(self.s)
+        s.solves.append({"paraxial": "image_distance"})
+        s.update()
+        d = s[-1].distance
+        Refocus((0, .7))(s)
+        self.assertNotAlmostEqual(s[-1].distance, d)
+        r = MonteCarlo(s, self.t[:1], [Refocus((0, .7))],
+                       lambda s: s[-1].distance).evaluate(
+                           [np.zeros(1)])
+        nptest.assert_allclose(r[0], s[-1].distance)
+
+    def test_empty(self):
+        r = MonteCarlo(self.s, self.t, seed=3).run(0)
+        self.assertEqual(r.criteria.shape, (0, 3))
+        r1 = MonteCarlo(self.s, []).run(5)
+        self.assertEqual(r1.criteria.shape, (0, 3))
+        nptest.assert_allclose(r1.nominal, r.nominal)
+
+    def test_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        mc = MonteCarlo(self.s, self.t, [Refocus()], seed=4)
+        r = mc.run(8, chunksize=2)
+        with ProcessPoolExecutor(2) as executor:
+            r1 = mc.run(8, executor=executor, chunksize=2)
+        nptest.assert_allclose(r1.criteria, r.criteria)
+
+    def test_sensitivity(self):
+        from rayopt.result_cache import ResultCache
+        path = tempfile.mkdtemp()
+        try:
+            c = ResultCache(path)
+            mc = MonteCarlo(self.s, self.t, [Refocus()])
+            s = mc.sensitivity(cache=c)
+            s1 = mc.sensitivity(cache=c)
+            self.assertEqual(c.hits, 1)
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(s.minus.shape, (8, 3))
+        self.assertEqual(list(s.names[2:4]), ["tilt 6 x", "tilt 6 y"])
+        nptest.assert_equal(s1.plus, s.plus)
+        w = [t.max for t in self.t]
+        nptest.assert_allclose(s.predict(w), s.predict())
+        l = s.allocate(.005)
+        nptest.assert_allclose(s.predict(l)[0], .005)
+        l = s.allocate(.005, maximum=.01)
+        self.assertLessEqual(l.max(), .01)
+        nptest.assert_allclose(s.predict(l)[0], .005)
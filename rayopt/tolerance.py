@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+#
+#   rayopt - raytracing for optical imaging systems
+#   Copyright (C) 2013 Robert Jordens <robert@joerdens.org>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Monte Carlo tolerancing.
+
+Tolerances perturb element parameters of a copy of the nominal
+system, compensators (refocus, reoptimization) then recover as much of
+the performance as possible and a criterion function rates the
+result. The perturbations of all trials are drawn up front from a
+seeded generator: results do not depend on how the trials are
+distributed over worker processes.
+"""
+
+from __future__ import (absolute_import, print_function,
+                        unicode_literals, division)
+
+import copy
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from .system import System
+from .material import PerturbedMaterial
+from .geometric_trace import GeometricTrace
+from .optimize import PathVariable, FuncOp, optimize
+from .transformations import euler_from_matrix
+from .utils import public
+
+
+__all__ = ["MonteCarloResult", "Sensitivity"]
+
+
+@public
+class Tolerance(object):
+    """Tolerance on a parameter of element `element`.
+
+    Values are drawn between `min` and `max` (`-min` and `min` if `max`
+    is not given) according to `distribution`: "uniform", "normal"
+    (the range is +- 2 sigma, truncated) or "end" (either `min` or
+    `max`).
+    """
+    name = None
+    dimension = 1
+
+    def __init__(self, element, min, max=None, distribution="uniform"):
+        if max is None:
+            min, max = -min, min
+        self.element = element
+        self.min = min
+        self.max = max
+        self.distribution = distribution
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.element)
+
+    def sample(self, rng, n):
+        shape = (n,) if self.dimension == 1 else (n, self.dimension)
+        a, b = self.min, self.max
+        if self.distribution == "uniform":
+            return rng.uniform(a, b, shape)
+        elif self.distribution == "normal":
+            x = np.clip(rng.normal(0, .5, shape), -1, 1)
+            return (a + b)/2 + x*(b - a)/2
+        elif self.distribution == "end":
+            return np.where(rng.uniform(size=shape) < .5, a, b)
+        else:
+            raise ValueError("unknown distribution %r" % self.distribution)
+
+    def apply(self, system, value):
+        raise NotImplementedError
+
+
+@public
+class RadiusTolerance(Tolerance):
+    """radius of curvature, flat surfaces stay flat"""
+    name = "radius"
+
+    def apply(self, system, value):
+        e = system[self.element]
+        if e.curvature:
+            e.curvature = 1/(1/e.curvature + value)
+
+
+@public
+class ThicknessTolerance(Tolerance):
+    """distance from the preceding element"""
+    name = "thickness"
+
+    def apply(self, system, value):
+        system[self.element].distance += value
+
+
+@public
+class TiltTolerance(Tolerance):
+    """tilt about the x and y axes (radians)"""
+    name = "tilt"
+    dimension = 2
+
+    def apply(self, system, value):
+        e = system[self.element]
+        e.angles = e.angles + (value[0], value[1], 0.)
+
+
+@public
+class DecenterTolerance(Tolerance):
+    """lateral x and y displacement of a single element
+
+    The element offset is changed and the following offset is
+    corrected. The angles are adjusted such that the elements keep
+    their orientation."""
+    name = "decenter"
+    dimension = 2
+
+    def apply(self, system, value):
+        d = np.array([value[0], value[1], 0.])
+        for j, sign in (self.element, 1), (self.element + 1, -1):
+            if j >= len(system):
+                break
+            e = system[j]
+            r = e.rot_normal if e.rotated else np.eye(3)
+            e.offset = e.offset + sign*d
+            if e.rot_axis is not None:
+                r = np.dot(e.rot_axis.T, r)
+            m = np.eye(4)
+            m[:3, :3] = r
+            e.angles = euler_from_matrix(m, str("rxyz"))
+
+
+@public
+class IndexTolerance(Tolerance):
+    """refractive index of the material after the element"""
+    name = "index"
+
+    def material(self, system):
+        e = system[self.element]
+        if not isinstance(e.material, PerturbedMaterial):
+            e.material = PerturbedMaterial(e.material)
+        return e.material
+
+    def apply(self, system, value):
+        self.material(system).dn += value
+
+
+@public
+class AbbeTolerance(IndexTolerance):
+    """Abbe number of the material after the element"""
+    name = "abbe"
+
+    def apply(self, system, value):
+        self.material(system).dv += value
+
+
+@public
+class Refocus(object):
+    """compensator: geometric (rms) refocus on a ray bundle from
+    `field` using `GeometricTrace.refocus()`"""
+    def __init__(self, field=(0, 0.), wavelength=None, nrays=36,
+                 distribution="hexapolar"):
+        self.field = field
+        self.wavelength = wavelength
+        self.nrays = nrays
+        self.distribution = distribution
+
+    def __call__(self, system):
+        t = GeometricTrace(system)
+        t.rays_point(self.field, self.wavelength, nrays=self.nrays,
+                     distribution=self.distribution, clip=True)
+        t.refocus()
+
+
+@public
+class Reoptimize(object):
+    """compensator: reoptimize the parameters at `paths` within
+    `bounds` (relative to their perturbed values) to minimize
+    `merit(system)` with `optimize()`"""
+    def __init__(self, paths, merit, bounds=(-1., 1.), **kwargs):
+        self.paths = paths
+        self.merit = merit
+        self.bounds = np.broadcast_to(bounds, (len(paths), 2))
+        self.kwargs = kwargs
+
+    def __call__(self, system):
+        variables = []
+        for path, (a, b) in zip(self.paths, self.bounds):
+            v = system.get_path(path)
+            variables.append(PathVariable(system, path, (v + a, v + b)))
+        operands = [FuncOp(system, self.merit, weight=1)]
+        r = optimize(variables, operands, **self.kwargs)
+        r.accept()
+        system.update()
+
+
+@public
+def rms_spot(system, nrays=36):
+    """rms spot radii at the fields of the system (first wavelength,
+    relative to the centroid)"""
+    r = []
+    for h in system.fields:
+        t = GeometricTrace(system)
+        t.rays_point((0, h), None, nrays=nrays, distribution="hexapolar",
+                     clip=True)
+        good = np.all(np.isfinite(t.y[-1]), axis=1)
+        y = t.y[-1, good, :2]
+        w = t.w[good]
+        y0 = np.dot(w, y)/w.sum()
+        r.append(np.sqrt(np.dot(w, np.square(y - y0).sum(1))/w.sum()))
+    return np.array(r)
+
+
+_unit_system = None, None
+
+
+def run_trials(unit):
+    """executor work function: evaluates the trials in `(system json,
+    tolerances, compensators, criterion, values)` and returns the
+    criteria (trials, k), nan for failed trials"""
+    global _unit_system
+    text, tolerances, compensators, criterion, values = unit
+    key, nominal = _unit_system
+    if key != text:
+        nominal = System(**json.loads(text))
+        nominal.update()
+        _unit_system = text, nominal
+    n = values[0].shape[0] if values else 1
+    r = []
+    for i in range(n):
+        s = copy.deepcopy(nominal)
+        try:
+            for t, v in zip(tolerances, values):
+                t.apply(s, v[i])
+            s.update()
+            for c in compensators:
+                c(s)
+            r.append(np.atleast_1d(criterion(s)).ravel())
+        except (ValueError, RuntimeError, FloatingPointError):
+            r.append(None)
+    k = max([ri.shape[0] for ri in r if ri is not None] or [1])
+    return np.array([np.full(k, np.nan) if ri is None else ri
+                     for ri in r])
+
+
+class MonteCarloResult(namedtuple("MonteCarloResult",
+                                  "tolerances values nominal criteria")):
+    """Perturbation `values` for each tolerance (trials, ...), the
+    `nominal` criteria (k,) and the criteria of each trial
+    (trials, k)"""
+    __slots__ = ()
+
+    @property
+    def change(self):
+        return self.criteria - self.nominal
+
+    def percentile(self, q=(50, 90, 98)):
+        """criterion percentiles (q, k) over the successful trials"""
+        return np.nanpercentile(self.criteria, q, axis=0)
+
+    @property
+    def failed(self):
+        return np.any(np.isnan(self.criteria), axis=1)
+
+    def worst(self, n=10, criterion=0):
+        """indices of the n worst trials"""
+        c = np.where(self.failed, np.inf, self.criteria[:, criterion])
+        return np.argsort(c)[::-1][:n]
+
+
+class Sensitivity(namedtuple("Sensitivity", "names tolerance lo hi "
+                             "nominal minus plus")):
+    """Sensitivity matrix: for each row (a tolerance or one of its
+    dimensions, `tolerance` is the index of the tolerance) the criteria
+    (rows, k) at the `lo` (`minus`) and `hi` (`plus`) tolerance
+    limits, and the `nominal` criteria (k,)
+
+    Predictions assume that the criterion changes are linear in the
+    tolerances and add in quadrature (RSS).
+    """
+    __slots__ = ()
+
+    @property
+    def change(self):
+        """worst case criterion change for each row (rows, k)"""
+        return np.maximum(np.fabs(self.minus - self.nominal),
+                          np.fabs(self.plus - self.nominal))
+
+    @property
+    def sensitivity(self):
+        """criterion change per unit tolerance for each row (rows, k)"""
+        w = np.maximum(np.fabs(self.lo), np.fabs(self.hi))
+        return self.change/w[:, None]
+
+    def predict(self, limits=None):
+        """RSS criterion change (k,) for the tolerance `limits` (one
+        per tolerance, default: the analyzed limits)"""
+        if limits is None:
+            c = self.change
+        else:
+            s = self.sensitivity
+            l = np.asarray(limits, np.float64)[self.tolerance, None]
+            with np.errstate(invalid="ignore"):
+                c = np.where(s > 0, s*l, 0.)  # insensitive, unlimited
+        return np.sqrt(np.square(c).sum(0))
+
+    def allocate(self, budget, criterion=0, maximum=np.inf):
+        """inverse sensitivity: tolerance limits (one per tolerance)
+        that each contribute equally to an RSS change of `budget` of
+        criterion `criterion`
+
+        Limits are capped at `maximum` and the remaining budget is
+        distributed over the other tolerances.
+        """
+        s = np.square(self.sensitivity[:, criterion])
+        s = np.sqrt(np.bincount(self.tolerance, s))
+        maximum = np.broadcast_to(maximum, s.shape).astype(np.float64)
+        limits = maximum.copy()
+        free = s > 0
+        b2 = budget**2
+        while np.any(free) and b2 > 0:
+            t = np.sqrt(b2/np.count_nonzero(free))/s[free]
+            capped = t > maximum[free]
+            if not np.any(capped):
+                limits[free] = t
+                break
+            i = np.flatnonzero(free)[capped]
+            limits[i] = maximum[i]
+            free[i] = False
+            b2 -= np.square(s[i]*limits[i]).sum()
+        else:
+            limits[free] = 0.
+        return limits
+
+
+@public
+class MonteCarlo(object):
+    """Monte Carlo tolerance analysis of `system`
+
+    Each trial perturbs a copy of the system by all `tolerances`,
+    applies the `compensators` in order and evaluates
+    `criterion(system)` (an array of k values). The criterion and the
+    compensators must be picklable to use an executor.
+    """
+    def __init__(self, system, tolerances, compensators=(),
+                 criterion=rms_spot, seed=None):
+        self.system = system
+        self.tolerances = list(tolerances)
+        self.compensators = list(compensators)
+        self.criterion = criterion
+        self.seed = seed
+
+    def sample(self, trials):
+        rng = np.random.RandomState(self.seed)
+        return [t.sample(rng, trials) for t in self.tolerances]
+
+    def unit(self, values, text=None):
+        """the `run_trials()` work unit for the tolerance `values`"""
+        if text is None:
+            text = json.dumps(self.system.dict())
+        return (text, self.tolerances, self.compensators, self.criterion,
+                values)
+
+    def units(self, values, chunksize):
+        text = json.dumps(self.system.dict())
+        n = values[0].shape[0] if values else 0
+        for i in range(0, n, chunksize):
+            yield i, self.unit([v[i:i + chunksize] for v in values], text)
+
+    def evaluate(self, values, executor=None, chunksize=16, progress=None):
+        """nominal criteria (k,) and the criteria (trials, k) for the
+        tolerance `values`, optionally on an `executor` (e.g. a
+        `concurrent.futures.ProcessPoolExecutor`) in chunks of
+        `chunksize` trials
+
+        `progress(done, trials)` is called after each chunk.
+        """
+        units = list(self.units(values, chunksize))
+        trials = values[0].shape[0] if values else 0
+        zero = [np.zeros((1,) + v.shape[1:]) for v in values]
+        nominal = run_trials(self.unit(zero))[0]
+        criteria = np.full((trials, nominal.shape[0]), np.nan)
+        done = 0
+        if executor is None:
+            results = ((i, run_trials(unit)) for i, unit in units)
+        else:
+            from concurrent.futures import as_completed
+            futures = dict((executor.submit(run_trials, unit), i)
+                           for i, unit in units)
+            results = ((futures[f], f.result())
+                       for f in as_completed(futures))
+        for i, r in results:
+            criteria[i:i + r.shape[0]] = r
+            done += r.shape[0]
+            if progress:
+                progress(done, trials)
+        return nominal, criteria
+
+    def run(self, trials, **kwargs):
+        """run `trials` random trials, see `evaluate()` for the
+        keyword arguments"""
+        values = self.sample(trials)
+        nominal, criteria = self.evaluate(values, **kwargs)
+        return MonteCarloResult(self.tolerances, values, nominal, criteria)
+
+    def describe(self):
+        """json serializable description of the tolerances, the
+        compensators and the criterion"""
+        def name(v):
+            if callable(v):
+                return "%s.%s" % (v.__module__, v.__name__)
+            if isinstance(v, np.ndarray):
+                return v.tolist()
+            return v
+        return [[[type(t).__name__, t.element, t.min, t.max]
+                 for t in self.tolerances],
+                [[type(c).__name__,
+                  dict((k, name(v)) for k, v in vars(c).items())]
+                 for c in self.compensators],
+                name(self.criterion)]
+
+    def sensitivity(self, cache=None, **kwargs):
+        """sensitivity matrix of the criterion with respect to each
+        tolerance (and each of its dimensions), evaluated at the
+        tolerance limits
+
+        The perturbations are evaluated as a batch of trials, see
+        `evaluate()` for the keyword arguments. If a `ResultCache` is
+        given, the matrix is cached against the system fingerprint and
+        the `describe()`d setup.
+        """
+        if cache is not None:
+            key = cache.key(self.system, MonteCarlo.sensitivity,
+                            self.describe())
+            try:
+                return cache.get(key)
+            except KeyError:
+                pass
+        rows, names, lo, hi = [], [], [], []
+        for j, t in enumerate(self.tolerances):
+            for k in range(t.dimension):
+                rows.append((j, k))
+                names.append(str(t) if t.dimension == 1 else
+                             "%s %s" % (t, "xyz"[k]))
+                lo.append(t.min)
+                hi.append(t.max)
+        m = len(rows)
+        values = []
+        for j, t in enumerate(self.tolerances):
+            shape = (2*m,) if t.dimension == 1 else (2*m, t.dimension)
+            values.append(np.zeros(shape))
+        for i, (j, k) in enumerate(rows):
+            v = values[j].reshape(2*m, -1)
+            v[i, k], v[m + i, k] = lo[i], hi[i]
+        nominal, criteria = self.evaluate(values, **kwargs)
+        s = Sensitivity(np.array(names), np.array([j for j, k in rows]),
+                        np.array(lo, np.float64), np.array(hi, np.float64),
+                        nominal, criteria[:m], criteria[m:])
+        if cache is not None:
+            cache.put(key, s)
+        return s
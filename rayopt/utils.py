@@ -22,7 +22,6 @@ from __future__ import (absolute_import, print_function,
 import sys
 
 import numpy as np
-from scipy.special import orthogonal
 
 
 def public(f):
@@ -106,6 +105,18 @@ def normalize(u):
     u /= norm(u)
 
 
+@public
+def inv2(a):
+    """closed form inverse of (..., 2, 2) matrices"""
+    d = a[..., 0, 0]*a[..., 1, 1] - a[..., 0, 1]*a[..., 1, 0]
+    b = np.empty_like(a)
+    b[..., 0, 0] = a[..., 1, 1]
+    b[..., 1, 1] = a[..., 0, 0]
+    b[..., 0, 1] = -a[..., 0, 1]
+    b[..., 1, 0] = -a[..., 1, 0]
+    return b/d[..., None, None]
+
+
 @public
 def sagittal_meridional(u, z):
     s = np.cross(u, z)
@@ -184,7 +195,7 @@ def pupil_distribution(distribution, nrays):
         n = int(np.sqrt(n/3.-1/12.)-1/2.)
         l = [np.zeros((2, 1))]
         for i in np.arange(1, n + 1.):
-            a = np.linspace(0, 2*np.pi, 6*i, endpoint=False)
+            a = np.linspace(0, 2*np.pi, int(6*i), endpoint=False)
             l.append([np.sin(a)*i/n, np.cos(a)*i/n])
         xy = np.concatenate(l, axis=1).T
     elif d == "radau":
@@ -207,7 +218,8 @@ def gl_roots(n):
     """Gauss Lobatto roots and weights for [-1, 1]
     with -1 first and 1 last
     """
-    leg = orthogonal.legendre(n - 1)
+    from scipy.special import legendre
+    leg = legendre(n - 1)
     x = np.r_[-1, leg.deriv().roots, 1]
     w = 2/(n*(n - 1)*leg(x)**2)
     return x, w
@@ -218,8 +230,9 @@ def gr_roots(n):
     """Gauss Radau roots and weights for [-1, 1]
     with -1 first
     """
-    leg = orthogonal.legendre(n - 1)
-    l = (leg + orthogonal.legendre(n))/np.poly1d((1, 1))
+    from scipy.special import legendre
+    leg = legendre(n - 1)
+    l = (leg + legendre(n))/np.poly1d((1, 1))
     x = np.r_[-1, l[0].roots]
     w = (1 - x)/(n * leg(x))**2
     return x, w